@@ -0,0 +1,96 @@
+"""Write-behind batching.
+
+Items handed to `WriteBehind.put` are written by a background thread in
+batches: a batch is written once `max_batch` items are waiting or
+`interval` seconds after its first item arrived, whichever comes first.
+With many writers this turns one short transaction each into one
+transaction per batch, and takes the writes off the caller's thread.
+
+Items that were not written yet are lost if the process dies, so only
+use it for writes that can be redone, like verdicts of leased jobs.
+"""
+
+import time
+import queue
+import threading
+import traceback
+
+
+class WriteBehind(object):
+    """Calls `write(items)` with batches of the items put. An `interval` of
+    0 disables batching: `put` then writes each item right away, on the
+    caller's thread."""
+
+    def __init__(self, write, interval=0.1, max_batch=50):
+        self.write = write
+        self.interval = interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.failed_batches = 0
+
+    def put(self, item):
+        if self.interval <= 0:
+            self._write([item])
+            return
+        self._start()
+        self._queue.put(item)
+
+    def flush(self):
+        """Blocks until every item put so far has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'interval': self.interval,
+                'max_batch': self.max_batch,
+                'pending': self._queue.qsize(),
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch': self.items / self.batches if self.batches else 0.0,
+                'largest_batch': self.largest_batch,
+                'failed_batches': self.failed_batches,
+            }
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        try:
+            self.write(batch)
+        except Exception:
+            traceback.print_exc()
+            with self._lock:
+                self.failed_batches += 1
+            return
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""Measures mixed read/write throughput of the database configuration.
+
+Runs the same workload once per configuration on a fresh copy of the
+seeded data (see `datagen`): `--verdicts` pending solutions are judged by
+the verification workers, with a fake executor so only the database work
+is measured, while `--reader-processes` processes with `--readers` green
+clients each request problem and solution pages, like other server
+processes sharing the database would. `baseline` uses SQLite's rollback
+journal with full syncs and commits every verdict on its own, as before;
+`tuned` uses the defaults (WAL, synchronous=NORMAL, batched verdicts).
+
+    python benchmarks/bench_db.py --verdicts 2000 --reader-processes 4
+"""
+
+import os, sys, json, time, random, argparse, tempfile, subprocess
+
+benchmarks = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks, '..'))
+
+from stats import percentile
+
+
+configurations = [
+    ('baseline', {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL',
+                  'VERDICT_BATCH_INTERVAL': '0'}),
+    ('tuned', {}),
+]
+
+
+def setup(args):
+    """Fills the scratch database in the working directory and returns the
+    ids of the verification jobs of `--verdicts` pending solutions."""
+    from models import DBSession, Solution, VerificationJob, init_db, rebuild_stats
+    import datagen
+
+    engine = init_db()
+    datagen.populate(engine, args.problems, args.solutions, args.comments,
+                     args.users, args.seed)
+    rng = random.Random(args.seed)
+    db_session = DBSession()
+    rebuild_stats(db_session)
+    pending = [Solution(
+        user_id=datagen.user_name(rng.randrange(args.users)),
+        problem_id=rng.randint(1, args.problems), language='python',
+        source='print(input()) # {}'.format(i), verification='PENDING')
+        for i in range(args.verdicts)]
+    db_session.add_all(pending)
+    db_session.flush()
+    jobs = [VerificationJob(solution_id=solution.id, user_id=solution.user_id)
+            for solution in pending]
+    db_session.add_all(jobs)
+    db_session.commit()
+    job_ids = [job.id for job in jobs]
+    db_session.close()
+    return job_ids
+
+
+def reader(args):
+    """Requests problem and solution pages until the stop file appears, with
+    `--readers` green clients, then prints their latencies as JSON. Runs in
+    its own process, like another server process would."""
+    import eventlet
+    eventlet.monkey_patch()
+    import riker
+    import datagen
+
+    client = riker.create_app({'MIGRATE_SCHEMA': False}).test_client()
+    with client.session_transaction() as session:
+        session['logged_in_user'] = datagen.user_name(0)
+    latencies = []
+    errors = []
+
+    def read(n):
+        rng = random.Random(args.seed + n)
+        while not os.path.exists('stop'):
+            if rng.random() < 0.5:
+                path = '/problem/{}'.format(rng.randint(1, args.problems))
+            else:
+                path = '/problem/1/solution/{}'.format(rng.randint(1, args.solutions))
+            begin = time.perf_counter()
+            try:
+                status = client.get(path).status_code
+            except Exception as e: # e.g. OperationalError: database is locked
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - begin)
+            if status not in (200, 404):
+                errors.append(status)
+            eventlet.sleep(args.think_ms / 1000)
+
+    pool = eventlet.GreenPool(args.readers)
+    print('ready', flush=True)
+    for n in range(args.readers):
+        pool.spawn(read, n)
+    pool.waitall()
+    print(json.dumps({'latencies': latencies, 'errors': len(errors)}))
+
+
+def writer(args):
+    """Judges the pending solutions while reader processes load the pages,
+    and prints the results of this configuration as JSON."""
+    import eventlet
+    eventlet.monkey_patch()
+    import verify
+    import models
+    from models import DBSession, Solution
+    from bench_judge import FakeExecutor
+
+    job_ids = setup(args)
+    verify.set_executor(FakeExecutor(args.run_ms / 1000))
+    readers = [subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--reader'] + sys.argv[1:],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        for _ in range(args.reader_processes)]
+    for process in readers:
+        process.stdout.readline() # ready
+
+    begin = time.perf_counter()
+    for job_id in job_ids:
+        while True:
+            try:
+                Solution._verify_scheduler.submit(Solution._verify, job_id)
+                break
+            except Exception: # QueueFull
+                eventlet.sleep(0.01)
+    db_session = DBSession.session_factory()
+    while db_session.query(Solution).filter(Solution.verification == 'PENDING').count():
+        db_session.rollback()
+        eventlet.sleep(0.05)
+    db_session.close()
+    elapsed = time.perf_counter() - begin
+
+    open('stop', 'w').close()
+    latencies = []
+    errors = 0
+    for process in readers:
+        result = json.loads(process.communicate()[0].strip().splitlines()[-1])
+        latencies.extend(result['latencies'])
+        errors += result['errors']
+    print(json.dumps({
+        'verdicts_per_second': args.verdicts / elapsed,
+        'reads_per_second': len(latencies) / elapsed,
+        'read_p50': percentile(latencies, 0.5),
+        'read_p95': percentile(latencies, 0.95),
+        'read_p99': percentile(latencies, 0.99),
+        'read_errors': errors,
+        'batches': models.verdict_writer.stats()['batches'],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--problems', type=int, default=200)
+    parser.add_argument('--solutions', type=int, default=20000)
+    parser.add_argument('--comments', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--verdicts', type=int, default=500)
+    parser.add_argument('--readers', type=int, default=10,
+                        help='clients per reader process')
+    parser.add_argument('--reader-processes', type=int, default=2)
+    parser.add_argument('--think-ms', type=float, default=20,
+                        help='pause of each client between requests')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--run-ms', type=float, default=5,
+                        help='simulated run time of each test case')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--writer', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--reader', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.reader:
+        return reader(args)
+    if args.writer:
+        return writer(args)
+
+    print('verdicts={} readers={}x{} workers={} solutions={}'.format(
+        args.verdicts, args.reader_processes, args.readers, args.workers,
+        args.solutions))
+    print('{:<10}{:>12}{:>10}{:>10}{:>10}{:>10}{:>8}{:>9}'.format(
+        'config', 'verdicts/s', 'reads/s', 'p50 ms', 'p95 ms', 'p99 ms',
+        'errors', 'batches'))
+    for name, environ in configurations:
+        env = dict(os.environ, VERIFY_WORKERS=str(args.workers),
+                   VERIFY_QUEUE_SIZE=str(args.verdicts), VERIFY_EXECUTOR='local',
+                   GITHUB_CLIENT_ID='bench', GITHUB_CLIENT_SECRET='bench',
+                   **environ)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--writer'] + sys.argv[1:],
+            cwd=tempfile.mkdtemp(prefix='bench-db-'), env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print('{:<10}{:>12.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>8}{:>9}'.format(
+            name, result['verdicts_per_second'], result['reads_per_second'],
+            1000 * result['read_p50'], 1000 * result['read_p95'],
+            1000 * result['read_p99'], result['read_errors'], result['batches']))
+
+
+if __name__ == '__main__':
+    main()
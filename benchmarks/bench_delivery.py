@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Compares per-run overhead of the job delivery modes (bind, tmpfs, stdin).
+
+Runs a trivial program that only reads its input, so the measured time is
+dominated by job delivery and process/container startup. Uses the local
+executor by default so it runs anywhere; pass `--executor docker` or
+`--executor pool` to measure the real sandboxes.
+
+    python benchmarks/bench_delivery.py --runs 50 --input-bytes 4000000
+"""
+
+import os, sys, time, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import verify
+from verify.executors import executor_from_env, delivery_modes
+from stats import percentile
+
+
+program = 'import sys; print(len(sys.stdin.read()))'
+
+
+def bench(executor_name, delivery, runs, testinput):
+    executor = executor_from_env({
+        'VERIFY_EXECUTOR': executor_name,
+        'VERIFY_DELIVERY': delivery,
+        'VERIFY_COMPILE_CACHE_BYTES': '0',
+    })
+    verify.set_executor(executor)
+    executor.start()
+    expected = str(len(testinput))
+    verify.run_case('python', program, testinput, expected, 30) # Warm up
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = verify.run_case('python', program, testinput, expected, 30)
+        samples.append(time.perf_counter() - start)
+        if result != 'PASS':
+            raise RuntimeError('{} delivery returned {}'.format(delivery, result))
+    verify.set_executor(None)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--executor', default='local', choices=('local', 'docker', 'pool'))
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--input-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--modes', nargs='+', default=delivery_modes, choices=delivery_modes)
+    args = parser.parse_args()
+
+    testinput = 'x' * args.input_bytes
+    print('executor={} runs={} input={} bytes'.format(
+        args.executor, args.runs, args.input_bytes))
+    print('{:<8}{:>10}{:>10}{:>10}'.format('mode', 'mean ms', 'p50 ms', 'p95 ms'))
+    for mode in args.modes:
+        samples = bench(args.executor, mode, args.runs, testinput)
+        print('{:<8}{:>10.2f}{:>10.2f}{:>10.2f}'.format(
+            mode, 1000 * sum(samples) / len(samples),
+            1000 * percentile(samples, 0.5), 1000 * percentile(samples, 0.95)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Measures judge throughput: jobs per second and job latency.
+
+Queues a seeded mix of passing and failing submissions on the
+verification scheduler, each judged with `verify.verify_cases` as the
+server does, and reports p50/p95/p99 latency (from submission to verdict)
+and jobs per second. The default `fake` executor only simulates a run of
+`--run-ms` milliseconds, so it measures the scheduler and verify pipeline
+rather than process startup; `--executor local` runs the programs for
+real, `docker` and `pool` in the sandboxes.
+
+    python benchmarks/bench_judge.py --jobs 500 --workers 8 --cases 3
+"""
+
+import eventlet
+eventlet.monkey_patch() # Judge like the server does
+
+import os, sys, time, queue, random, argparse, subprocess, collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import verify
+from verify.exceptions import ProgramCancelled
+from verify.executors import Executor, Usage, executor_from_env
+from verify.scheduler import Scheduler
+from stats import percentile
+
+
+passing = 'print(input())'
+failing = 'print("wrong")'
+
+
+class FakeExecutor(Executor):
+    """Pretends to run a program that echoes its input, or prints `wrong`
+    if its source says so, taking `run_time` seconds."""
+
+    def __init__(self, run_time):
+        self.run_time = run_time
+
+    def run(self, language, source, testinput, timeout, cancel=None,
+            on_output=None):
+        deadline = time.monotonic() + self.run_time
+        while time.monotonic() < deadline:
+            if cancel is not None and cancel.is_set():
+                raise ProgramCancelled()
+            time.sleep(min(0.01, self.run_time))
+        output = 'wrong\n' if 'wrong' in source else testinput + '\n'
+        if on_output is not None:
+            on_output(output)
+        proc_obj = subprocess.CompletedProcess(['fake'], 0, output, '')
+        proc_obj.usage = Usage(self.run_time, self.run_time, 1024)
+        return proc_obj
+
+
+def workload(args):
+    """Returns (user, source, cases) for every job."""
+    rng = random.Random(args.seed)
+    jobs = []
+    for _ in range(args.jobs):
+        cases = []
+        for _ in range(args.cases):
+            line = str(rng.randrange(10 ** 9))
+            cases.append((line, line))
+        source = failing if rng.random() < args.fail_rate else passing
+        jobs.append(('user{}'.format(rng.randrange(args.users)), source, cases))
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--executor', default='fake',
+                        choices=('fake', 'local', 'docker', 'pool'))
+    parser.add_argument('--jobs', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--cases', type=int, default=3)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--fail-rate', type=float, default=0.2)
+    parser.add_argument('--run-ms', type=float, default=20,
+                        help='simulated run time of the fake executor')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.executor == 'fake':
+        executor = FakeExecutor(args.run_ms / 1000)
+    else:
+        executor = executor_from_env({'VERIFY_EXECUTOR': args.executor})
+    verify.set_executor(executor)
+    executor.start()
+
+    jobs = workload(args)
+    scheduler = Scheduler(workers=args.workers, max_queue=len(jobs), max_per_user=len(jobs))
+    done = queue.Queue()
+
+    def judge(user, source, cases, submitted):
+        try:
+            status = verify.verify_cases('python', source, cases)[0]
+        except Exception as e:
+            status = type(e).__name__
+        done.put((status, time.perf_counter() - submitted))
+
+    scheduler.start()
+    begin = time.perf_counter()
+    for user, source, cases in jobs:
+        scheduler.submit(judge, user, source, cases, time.perf_counter(), user=user)
+    latencies = []
+    verdicts = collections.Counter()
+    for _ in jobs:
+        status, latency = done.get()
+        latencies.append(latency)
+        verdicts[status] += 1
+    elapsed = time.perf_counter() - begin
+    verify.set_executor(None)
+
+    print('executor={} jobs={} workers={} cases={}'.format(
+        args.executor, args.jobs, args.workers, args.cases))
+    print('verdicts: {}'.format(', '.join(
+        '{} {}'.format(count, status) for status, count in verdicts.most_common())))
+    print('{:>10}{:>10}{:>10}{:>10}'.format('jobs/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    print('{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+        len(jobs) / elapsed, 1000 * percentile(latencies, 0.5),
+        1000 * percentile(latencies, 0.95), 1000 * percentile(latencies, 0.99)))
+
+
+if __name__ == '__main__':
+    main()
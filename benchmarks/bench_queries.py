@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Measures the latency of the hot page queries with and without indexes.
+
+Fills a scratch SQLite database with random problems, solutions and
+comments, times the queries behind the problem page, `Problem.solved_by`
+and the comment threads, then applies the index migration and times them
+again.
+
+    python benchmarks/bench_queries.py --solutions 1000000
+"""
+
+import os, sys, time, random, argparse, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# bench.db is created in the working directory, keep it in a scratch one
+os.chdir(tempfile.mkdtemp(prefix='bench-queries-'))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker, load_only
+import migrations
+from cache import LRUCache
+from models import Base, Problem, Solution, ProblemComment, SolutionComment
+import datagen
+from stats import percentile
+
+
+def queries(args, rng):
+    """Returns (name, function(db_session)) pairs, with the same random
+    arguments for both runs."""
+    problem_ids = [rng.randint(1, args.problems) for _ in range(args.repeat)]
+    solution_ids = [rng.randint(1, args.solutions) for _ in range(args.repeat)]
+    user_ids = ['user{}'.format(rng.randrange(args.users)) for _ in range(args.repeat)]
+
+    def problem_solutions(db_session, i):
+        return (
+            db_session.query(Solution)
+            .options(load_only(Solution.id, Solution.user_id, Solution.language))
+            .filter(Solution.problem_id == problem_ids[i])
+            .filter(Solution.verification == 'PASS')
+            .order_by(Solution.submission_time)
+            .all()
+        )
+
+    def solved_by(db_session, i):
+        return Problem(id=problem_ids[i]).solved_by(db_session, user_ids[i])
+
+    def problem_comments(db_session, i):
+        return (
+            db_session.query(ProblemComment)
+            .filter(ProblemComment.problem_id == problem_ids[i])
+            .order_by(ProblemComment.submission_time)
+            .all()
+        )
+
+    def solution_comments(db_session, i):
+        return (
+            db_session.query(SolutionComment)
+            .filter(SolutionComment.solution_id == solution_ids[i])
+            .order_by(SolutionComment.submission_time)
+            .all()
+        )
+
+    return [
+        ('problem solutions', problem_solutions),
+        ('solved_by', solved_by),
+        ('problem comments', problem_comments),
+        ('solution comments', solution_comments),
+    ]
+
+
+def run(engine, named_queries, repeat):
+    """Returns {name: samples in seconds}."""
+    db_session = sessionmaker(engine)()
+    results = {}
+    try:
+        for name, query in named_queries:
+            samples = []
+            for i in range(repeat):
+                begin = time.perf_counter()
+                query(db_session, i)
+                samples.append(time.perf_counter() - begin)
+                db_session.expunge_all()
+            results[name] = samples
+    finally:
+        db_session.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--solutions', type=int, default=100000)
+    parser.add_argument('--problems', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--comments', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    engine = create_engine('sqlite:///bench.db')
+    Problem.solved_cache = LRUCache(0) # Set up by init_db otherwise; time the queries
+    Base.metadata.create_all(engine)
+    for table in Base.metadata.sorted_tables: # Start from an unmigrated schema
+        for index in table.indexes:
+            index.drop(engine)
+
+    begin = time.perf_counter()
+    datagen.populate(
+        engine, args.problems, args.solutions, args.comments, args.users, args.seed)
+    print('solutions={} problems={} users={} comments={} (filled in {:.1f}s)'.format(
+        args.solutions, args.problems, args.users, args.comments,
+        time.perf_counter() - begin))
+
+    named_queries = queries(args, rng)
+    before = run(engine, named_queries, args.repeat)
+    begin = time.perf_counter()
+    with engine.begin() as connection:
+        migrations.add_query_indexes(connection, Base.metadata)
+        connection.execute(text('ANALYZE'))
+    print('index migration took {:.1f}s'.format(time.perf_counter() - begin))
+    after = run(engine, named_queries, args.repeat)
+
+    print('{:<20}{:>14}{:>14}{:>14}{:>14}'.format(
+        'query', 'p50 ms before', 'p95 ms before', 'p50 ms after', 'p95 ms after'))
+    for name, _ in named_queries:
+        print('{:<20}{:>14.3f}{:>14.3f}{:>14.3f}{:>14.3f}'.format(
+            name, 1000 * percentile(before[name], 0.5), 1000 * percentile(before[name], 0.95),
+            1000 * percentile(after[name], 0.5), 1000 * percentile(after[name], 0.95)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Measures how long riker takes to start.
+
+Each measurement runs in a fresh interpreter in a scratch directory:
+importing riker, creating the app (which migrates a new or an already
+migrated database, see `models.init_db`), and starting `riker.py` with
+each of `--web-workers` until it answered a first request. Reports the
+median of `--repeat` runs.
+
+    python benchmarks/bench_startup.py --repeat 5 --web-workers 1 2 4
+"""
+
+import os, sys, time, json, argparse, tempfile, subprocess, http.client
+
+from stats import median
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+host, port = '127.0.0.1', 8091
+
+# Prints the seconds taken by each step as JSON
+steps = '''
+import json, sys, time
+sys.path.insert(0, {root!r})
+begin = time.perf_counter()
+import riker
+imported = time.perf_counter()
+riker.create_app()
+created = time.perf_counter()
+print(json.dumps({{'import': imported - begin, 'create_app': created - imported}}))
+'''
+
+
+def run_steps(workdir):
+    output = subprocess.run(
+        [sys.executable, '-c', steps.format(root=root)], cwd=workdir,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        universal_newlines=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def first_response(workdir, web_workers):
+    """Starts riker.py and returns the seconds until it answered."""
+    begin = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(root, 'riker.py')], cwd=workdir,
+        env=dict(os.environ, WEB_WORKERS=str(web_workers)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            connection = http.client.HTTPConnection(host, port)
+            try:
+                connection.request('GET', '/leaderboard')
+                connection.getresponse().read()
+                return time.perf_counter() - begin
+            except (OSError, http.client.HTTPException):
+                if server.poll() is not None:
+                    raise RuntimeError('riker.py exited with {}'.format(server.returncode))
+                time.sleep(0.01)
+            finally:
+                connection.close()
+        raise RuntimeError('riker.py did not start serving')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--web-workers', type=int, nargs='+', default=[1, 2])
+    args = parser.parse_args()
+
+    results = {}
+    for _ in range(args.repeat):
+        workdir = tempfile.mkdtemp(prefix='bench-startup-')
+        new = run_steps(workdir)
+        migrated = run_steps(workdir)
+        results.setdefault('import riker', []).append(new['import'])
+        results.setdefault('create_app, new database', []).append(new['create_app'])
+        results.setdefault('create_app, migrated', []).append(migrated['create_app'])
+        for web_workers in args.web_workers:
+            results.setdefault('first response, {} workers'.format(web_workers), []).append(
+                first_response(workdir, web_workers))
+
+    print('{:<32}{:>10}'.format('step', 'median ms'))
+    for name, samples in results.items():
+        print('{:<32}{:>10.1f}'.format(name, 1000 * median(samples)))
+
+
+if __name__ == '__main__':
+    main()
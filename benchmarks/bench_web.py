@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Load-tests the main pages of riker.py through the eventlet WSGI server.
+
+Fills a scratch database with seeded synthetic data (see `datagen`),
+starts `riker.py` on it in a child process, then has `--concurrency`
+green clients request a weighted mix of pages, half of them logged in.
+Reports the server's startup time (until it answered its first request),
+requests per second, per core used, and p50/p95/p99 latency per route.
+`--web-workers` runs the server with that many WEB_WORKERS processes.
+
+    python benchmarks/bench_web.py --solutions 100000 --requests 5000 --concurrency 50
+    python benchmarks/bench_web.py --web-workers 4 --concurrency 100
+
+riker.py listens on 127.0.0.1:8091, which must be free.
+"""
+
+import os, sys, time, random, argparse, tempfile, subprocess, collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# The scratch database is riker.db in the working directory, so keep it
+# away from a real database. The server runs there as well.
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+workdir = tempfile.mkdtemp(prefix='bench-web-')
+os.chdir(workdir)
+os.environ.setdefault('GITHUB_CLIENT_ID', 'bench')
+os.environ.setdefault('GITHUB_CLIENT_SECRET', 'bench')
+os.environ.setdefault('VERIFY_EXECUTOR', 'local')
+
+import eventlet
+eventlet.monkey_patch() # So the clients below are green
+import http.client
+import riker
+from models import DBSession, Solution, init_db, rebuild_stats
+import datagen
+from stats import percentile
+
+
+host, port = '127.0.0.1', 8091
+
+
+def routes(args, solutions):
+    """Returns (name, weight, function(rng) -> path) for every route."""
+    def problem(rng):
+        return '/problem/{}'.format(rng.randint(1, args.problems))
+    def solution(rng):
+        return '/problem/{1}/solution/{0}'.format(*rng.choice(solutions))
+    def user(rng):
+        return '/user/{}'.format(datagen.user_name(rng.randrange(args.users)))
+    def fastest(rng):
+        return '/problem/{}/fastest'.format(rng.randint(1, args.problems))
+    return [
+        ('home', 20, lambda rng: '/'),
+        ('problem', 35, problem),
+        ('solution', 20, solution),
+        ('user', 15, user),
+        ('leaderboard', 5, lambda rng: '/leaderboard'),
+        ('fastest', 5, fastest),
+    ]
+
+
+app = riker.create_app({'INIT_DB': False}) # Only signs session cookies
+
+
+def session_cookie(user_id):
+    serializer = app.session_interface.get_signing_serializer(app)
+    return '{}={}'.format(
+        app.config['SESSION_COOKIE_NAME'],
+        serializer.dumps({'logged_in_user': user_id}))
+
+
+def start_server(web_workers):
+    """Starts riker.py and returns it with the seconds it took to answer
+    a first request."""
+    begin = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(root, 'riker.py')], cwd=workdir,
+        env=dict(os.environ, WEB_WORKERS=str(web_workers)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) # Access log
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        connection = http.client.HTTPConnection(host, port)
+        try:
+            connection.request('GET', '/leaderboard')
+            connection.getresponse().read()
+            return server, time.perf_counter() - begin
+        except (OSError, http.client.HTTPException):
+            if server.poll() is not None:
+                raise RuntimeError('riker.py exited with {}'.format(server.returncode))
+            time.sleep(0.05)
+        finally:
+            connection.close()
+    server.kill()
+    raise RuntimeError('riker.py did not start serving')
+
+
+def client(n, args, named_routes, requests, samples):
+    """Sends requests until `requests` is exhausted, over one keep-alive
+    connection. Appends (route, status, start, end) to `samples`."""
+    rng = random.Random(args.seed + n)
+    headers = {}
+    if n % 2:
+        headers['Cookie'] = session_cookie(datagen.user_name(rng.randrange(args.users)))
+    names = [name for name, weight, path in named_routes]
+    weights = [weight for name, weight, path in named_routes]
+    paths = {name: path for name, weight, path in named_routes}
+    connection = http.client.HTTPConnection(host, port)
+    while requests:
+        recorded = requests.pop() # False for warm-up requests
+        name = rng.choices(names, weights)[0]
+        begin = time.perf_counter()
+        try:
+            connection.request('GET', paths[name](rng), headers=headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection(host, port)
+            status = 'error'
+        if recorded:
+            samples.append((name, status, begin, time.perf_counter()))
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--problems', type=int, default=500)
+    parser.add_argument('--solutions', type=int, default=20000)
+    parser.add_argument('--comments', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--web-workers', type=int, default=1,
+                        help='server processes (WEB_WORKERS)')
+    args = parser.parse_args()
+
+    begin = time.perf_counter()
+    engine = init_db()
+    datagen.populate(
+        engine, args.problems, args.solutions, args.comments, args.users, args.seed)
+    db_session = DBSession()
+    rebuild_stats(db_session)
+    db_session.commit()
+    solutions = db_session.query(Solution.id, Solution.problem_id).limit(10000).all()
+    db_session.close()
+    print('solutions={} problems={} users={} comments={} (filled in {:.1f}s)'.format(
+        args.solutions, args.problems, args.users, args.comments,
+        time.perf_counter() - begin))
+
+    named_routes = routes(args, solutions)
+    server, startup = start_server(args.web_workers)
+    try:
+        # Popped from the end: warm-up requests first
+        requests = [True] * args.requests + [False] * args.warmup
+        samples = []
+        pool = eventlet.GreenPool(args.concurrency)
+        for n in range(args.concurrency):
+            pool.spawn(client, n, args, named_routes, requests, samples)
+        pool.waitall()
+    finally:
+        server.terminate()
+        server.wait()
+
+    by_route = collections.defaultdict(list)
+    errors = collections.Counter()
+    for name, status, start, end in samples:
+        by_route[name].append(end - start)
+        by_route['all'].append(end - start)
+        if status == 'error' or status >= 400: # Redirects to login are fine
+            errors[name] += 1
+    elapsed = max(end for _, _, _, end in samples) - min(start for _, _, start, _ in samples)
+    cores = min(args.web_workers, os.cpu_count() or 1)
+    print('web_workers={} cores={} startup={:.2f}s'.format(args.web_workers, cores, startup))
+    print('concurrency={} requests={} ({:.1f} requests/s, {:.1f} per core)'.format(
+        args.concurrency, len(samples), len(samples) / elapsed,
+        len(samples) / elapsed / cores))
+    print('{:<14}{:>8}{:>8}{:>10}{:>10}{:>10}'.format(
+        'route', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, weight, path in named_routes + [('all', 0, None)]:
+        latencies = by_route[name]
+        if not latencies:
+            continue
+        print('{:<14}{:>8}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+            name, len(latencies), errors[name] if name != 'all' else sum(errors.values()),
+            1000 * percentile(latencies, 0.5), 1000 * percentile(latencies, 0.95),
+            1000 * percentile(latencies, 0.99)))
+
+
+if __name__ == '__main__':
+    main()
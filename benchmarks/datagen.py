@@ -0,0 +1,86 @@
+"""Seeded synthetic data for the benchmarks.
+
+Fills a database with problems, solutions and comments spread over
+`users` users. The same seed and sizes always produce the same rows, so
+runs before and after a change see the same data.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+from models import Problem, Solution, ProblemComment, SolutionComment
+
+
+verifications = ('PASS', 'PASS', 'FAIL', 'FAIL', 'FAIL', 'Program timed out.')
+languages = ('python', 'python', 'c', 'c++', 'ruby', 'bash')
+batch_size = 10000
+start = datetime(2016, 1, 1)
+
+prompt = """Read a number *n* and print the sum of the first *n* integers.
+
+    input: 3
+    output: 6
+
+Solutions must run in `O(n)` or better.
+"""
+
+
+def time_at(i):
+    return start + timedelta(seconds=i)
+
+
+def user_name(i):
+    return 'user{}'.format(i)
+
+
+def insert(engine, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            engine.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        engine.execute(table.insert(), batch)
+
+
+def problems(rng, count, users):
+    for i in range(1, count + 1):
+        yield {'id': i, 'user_id': user_name(rng.randrange(users)),
+               'title': 'Problem {}'.format(i), 'prompt': prompt, 'timeout': 3,
+               'test_input': '3', 'test_output': '6', 'submission_time': time_at(i)}
+
+
+def solutions(rng, count, problems, users):
+    for i in range(1, count + 1):
+        verification = rng.choice(verifications)
+        row = {'id': i, 'user_id': user_name(rng.randrange(users)),
+               'problem_id': rng.randint(1, problems), 'language': rng.choice(languages),
+               'source': 'print(sum(range(int(input()) + 1)))',
+               'verification': verification, 'submission_time': time_at(i),
+               'cpu_time': None, 'wall_time': None, 'peak_memory': None}
+        if verification == 'PASS': # For the fastest solutions ranking
+            row.update(cpu_time=rng.uniform(0.01, 2), wall_time=rng.uniform(0.05, 3),
+                       peak_memory=rng.randint(2000, 200000))
+        yield row
+
+
+def comments(rng, count, parent_column, parents, users):
+    for i in range(count):
+        yield {parent_column: rng.randint(1, parents),
+               'user_id': user_name(rng.randrange(users)),
+               'body': 'Comment {} with some **markdown**'.format(i),
+               'submission_time': time_at(i)}
+
+
+def populate(engine, problem_count, solution_count, comment_count, users, seed=0):
+    """Inserts `problem_count` problems, `solution_count` solutions and
+    `comment_count` comments each on problems and on solutions. Ids start
+    at 1. Aggregate tables are not filled, see `models.rebuild_stats`."""
+    rng = random.Random(seed)
+    insert(engine, Problem.__table__, problems(rng, problem_count, users))
+    insert(engine, Solution.__table__, solutions(rng, solution_count, problem_count, users))
+    insert(engine, ProblemComment.__table__, comments(
+        rng, comment_count, 'problem_id', problem_count, users))
+    insert(engine, SolutionComment.__table__, comments(
+        rng, comment_count, 'solution_id', solution_count, users))
@@ -0,0 +1,11 @@
+"""Summary statistics of the latency samples the benchmarks collect."""
+
+
+def percentile(samples, p):
+    """The `p` (0 to 1) quantile of `samples`, nearest rank."""
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def median(samples):
+    return percentile(samples, 0.5)
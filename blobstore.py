@@ -0,0 +1,79 @@
+"""Content-addressed blob store for large data such as test cases.
+
+Blobs live on local disk as `<directory>/<first 2 hex digits>/<sha256>` and
+are referenced from the database by their sha256 digest. Blobs are never
+modified, so identical test data uploaded twice is stored once.
+"""
+
+import os, contextlib, hashlib, tempfile
+
+
+class BlobStore(object):
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, data):
+        """Stores `data` (bytes) and returns its digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        if not os.path.exists(self.path(digest)):
+            with self._writer() as (f, tmp_path):
+                f.write(data)
+            self._commit(tmp_path, digest)
+        return digest
+
+    def put_file(self, fileobj):
+        """Stores the contents of the binary file object `fileobj`, reading
+        it in chunks, and returns its digest."""
+        digest = hashlib.sha256()
+        with self._writer() as (f, tmp_path):
+            for chunk in iter(lambda: fileobj.read(self.chunk_size), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        digest = digest.hexdigest()
+        self._commit(tmp_path, digest)
+        return digest
+
+    def open(self, digest):
+        """Opens the blob for reading in binary mode."""
+        return open(self.path(digest), 'rb')
+
+    def read(self, digest):
+        with self.open(digest) as f:
+            return f.read()
+
+    def text(self, digest):
+        """Returns the blob decoded as UTF-8."""
+        return self.read(digest).decode('utf-8')
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    @contextlib.contextmanager
+    def _writer(self):
+        """Yields (file, path) of a temp file in the store directory. The
+        file is removed if the block raises."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                yield f, tmp_path
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _commit(self, tmp_path, digest):
+        """Moves a fully written temp file into place. os.replace is atomic,
+        so concurrent writers of the same blob can't corrupt it."""
+        os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+        os.replace(tmp_path, self.path(digest))
+
+
+def store_from_env(environ=os.environ):
+    """Returns the blob store in BLOB_DIR, `blobs` by default."""
+    return BlobStore(environ.get('BLOB_DIR', 'blobs'))
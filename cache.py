@@ -0,0 +1,82 @@
+"""Bounded in-process caches for data derived from the database."""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Thread-safe mapping holding at most `max_entries` items, evicting the
+    least recently used one first. Counts hits and misses."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0 # Bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._put(key, value)
+
+    def load(self, key, loader):
+        """Returns the cached value for `key`, calling `loader()` to compute
+        it on a miss. The loaded value is not cached if the cache was
+        invalidated while loading, since it may already be stale."""
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+        generation = self._generation
+        value = loader()
+        with self._lock:
+            if generation == self._generation and self.max_entries > 0:
+                self._put(key, value)
+        return value
+
+    def pop(self, key):
+        """Invalidates `key`."""
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+    def _put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+_missing = object()
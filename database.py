@@ -0,0 +1,71 @@
+"""Database engine configuration.
+
+The engine is built from the environment:
+
+* `DATABASE_URL`: SQLAlchemy URL (default `sqlite:///riker.db`).
+* `DB_POOL_SIZE`, `DB_MAX_OVERFLOW`, `DB_POOL_TIMEOUT`: keep up to
+  `DB_POOL_SIZE` connections open, plus `DB_MAX_OVERFLOW` temporary ones,
+  waiting at most `DB_POOL_TIMEOUT` seconds for one. Without
+  `DB_POOL_SIZE` the dialect's default pool is used, which for SQLite
+  files opens a connection per session.
+
+SQLite connections are switched to write-ahead logging, so readers no
+longer block the writer and vice versa, with `synchronous=NORMAL`, which
+only syncs at checkpoints and stays consistent after a crash. The busy
+timeout bounds how long a writer waits for another one. Its wait blocks
+the whole eventlet hub, so write transactions must stay short; see
+`batcher.WriteBehind` for how verdicts are written.
+
+* `SQLITE_JOURNAL_MODE` (default `WAL`), `SQLITE_SYNCHRONOUS` (default
+  `NORMAL`), `SQLITE_BUSY_TIMEOUT` (milliseconds, default 5000).
+"""
+
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+
+journal_modes = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+synchronous_modes = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def sqlite_pragmas(environ=os.environ):
+    """Returns the pragmas set on every new SQLite connection."""
+    journal_mode = environ.get('SQLITE_JOURNAL_MODE', 'WAL').upper()
+    synchronous = environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+    if journal_mode not in journal_modes:
+        raise ValueError('Unknown SQLITE_JOURNAL_MODE: {}'.format(journal_mode))
+    if synchronous not in synchronous_modes:
+        raise ValueError('Unknown SQLITE_SYNCHRONOUS: {}'.format(synchronous))
+    return [
+        ('journal_mode', journal_mode),
+        ('synchronous', synchronous),
+        ('busy_timeout', int(environ.get('SQLITE_BUSY_TIMEOUT', 5000))),
+    ]
+
+
+def engine_from_env(environ=os.environ):
+    """Builds the engine described in the module docstring."""
+    url = environ.get('DATABASE_URL', 'sqlite:///riker.db')
+    sqlite = url.startswith('sqlite')
+    options = {}
+    if 'DB_POOL_SIZE' in environ:
+        options.update(
+            poolclass=QueuePool,
+            pool_size=int(environ['DB_POOL_SIZE']),
+            max_overflow=int(environ.get('DB_MAX_OVERFLOW', 10)),
+            pool_timeout=float(environ.get('DB_POOL_TIMEOUT', 30)))
+        if sqlite: # Pooled connections move between (green) threads
+            options['connect_args'] = {'check_same_thread': False}
+    engine = create_engine(url, **options)
+    if sqlite:
+        pragmas = sqlite_pragmas(environ)
+
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas:
+                cursor.execute('PRAGMA {}={}'.format(name, value))
+            cursor.close()
+    return engine
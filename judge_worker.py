@@ -0,0 +1,211 @@
+"""Standalone judge worker.
+
+Leases verification jobs from a riker web process over its judge API
+(see riker.py), judges them with `verify.verify_cases` in this machine's
+sandbox and posts the verdicts back, renewing the lease while a job runs.
+Any number of workers on any number of machines can share one web
+process. Start the web process with JUDGE_TOKEN set, and VERIFY_REMOTE=1
+to leave all judging to the workers, then:
+
+    JUDGE_TOKEN=<token> python judge_worker.py http://<host>:8091 --concurrency 4
+
+The worker reads the same VERIFY_* sandbox settings as the web process.
+If it dies, its leases expire and the jobs are handed to other workers.
+"""
+
+import os
+import sys
+import signal
+import socket
+import argparse
+import threading
+import traceback
+
+import requests
+
+import verify
+from cache import LRUCache
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class JudgeClient(object):
+    """Calls the judge API of the web process at `url`. Not thread-safe,
+    each worker thread uses its own."""
+
+    def __init__(self, url, token, worker_id, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': 'Bearer ' + token,
+            'X-Judge-Worker': worker_id,
+        })
+
+    def _request(self, method, path, timeout=None, **kwargs):
+        response = self.session.request(
+            method, self.url + path, timeout=timeout or self.timeout, **kwargs)
+        if response.status_code == 409:
+            raise LeaseLost(path)
+        response.raise_for_status()
+        return response
+
+    def lease(self, wait):
+        """Returns the next job, or None if none was queued within `wait`
+        seconds."""
+        response = self._request(
+            'POST', '/judge/api/lease', params={'wait': wait}, timeout=wait + self.timeout)
+        if response.status_code == 204:
+            return None
+        return response.json()
+
+    def cases(self, problem_id):
+        return self._request(
+            'GET', '/judge/api/problems/{}/cases'.format(problem_id)).json()
+
+    def heartbeat(self, job_id):
+        self._request('POST', '/judge/api/jobs/{}/heartbeat'.format(job_id))
+
+    def verdict(self, job_id, cache_key, verification, results, usage):
+        self._request('POST', '/judge/api/jobs/{}/verdict'.format(job_id), json={
+            'cache_key': cache_key,
+            'verification': verification,
+            'results': results,
+            'usage': usage,
+        })
+
+    def fail(self, job_id, error):
+        self._request('POST', '/judge/api/jobs/{}/fail'.format(job_id),
+                      json={'error': error})
+
+
+class Worker(object):
+    """Runs `concurrency` threads that each lease and judge one job at a
+    time. Test data is cached per problem and test data version."""
+
+    def __init__(self, url, token, worker_id, concurrency=1, wait=20,
+                 cases_cache_size=100):
+        self.url = url
+        self.token = token
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self.wait = wait
+        self.cases_cache = LRUCache(cases_cache_size)
+        self.stopping = threading.Event()
+        self.judged = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def run(self):
+        self._threads = [threading.Thread(target=self._loop, daemon=True)
+                         for _ in range(self.concurrency)]
+        for thread in self._threads:
+            thread.start()
+        self.join()
+
+    def join(self):
+        for thread in self._threads:
+            while thread.is_alive():
+                thread.join(1) # Wakes up for KeyboardInterrupt
+
+    def stop(self):
+        """Stops leasing jobs. Jobs being judged are finished, see `join`."""
+        self.stopping.set()
+
+    def _loop(self):
+        client = JudgeClient(self.url, self.token, self.worker_id)
+        backoff = 1
+        while not self.stopping.is_set():
+            try:
+                job = client.lease(self.wait)
+                backoff = 1
+                if job is not None:
+                    self.judge(client, job)
+            except requests.RequestException as e: # Web process unreachable
+                print('{}: {}, retrying in {}s'.format(type(e).__name__, e, backoff),
+                      file=sys.stderr)
+                self.stopping.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def cases(self, client, problem):
+        key = (problem['id'],) + tuple(problem['fingerprints'])
+        return self.cases_cache.load(key, lambda: client.cases(problem['id'])['cases'])
+
+    def judge(self, client, job):
+        """Judges a leased job and posts its verdict, renewing the lease
+        every third of `lease_seconds` meanwhile."""
+        job_id, solution, problem = job['job_id'], job['solution'], job['problem']
+        done = threading.Event()
+        lost = threading.Event()
+
+        def heartbeat():
+            heartbeat_client = JudgeClient(self.url, self.token, self.worker_id)
+            while not done.wait(job['lease_seconds'] / 3):
+                try:
+                    heartbeat_client.heartbeat(job_id)
+                except LeaseLost:
+                    lost.set()
+                    return
+                except requests.RequestException:
+                    traceback.print_exc() # Retried on the next beat
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            verification, results, usage = verify.verify_cases(
+                solution['language'], solution['source'], self.cases(client, problem),
+                problem['timeout'], problem['compare_mode'], problem['float_epsilon'])
+        except Exception as e: # e.g. SandboxError
+            traceback.print_exc()
+            try:
+                client.fail(job_id, '{}: {}'.format(type(e).__name__, e))
+            except LeaseLost:
+                pass
+            return
+        finally:
+            done.set()
+            thread.join()
+        if lost.is_set():
+            print('Lease of job {} lost, dropping its verdict'.format(job_id),
+                  file=sys.stderr)
+            return
+        try:
+            client.verdict(job_id, job['cache_key'], verification, results, usage)
+        except LeaseLost:
+            return
+        with self._lock:
+            self.judged += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('url', help='base URL of the riker web process')
+    parser.add_argument('--token', default=os.environ.get('JUDGE_TOKEN'),
+                        help='shared JUDGE_TOKEN (default: from the environment)')
+    parser.add_argument('--id', default='{}:{}'.format(socket.gethostname(), os.getpid()),
+                        help='worker id, unique per worker process')
+    parser.add_argument('--concurrency', type=int, default=os.cpu_count() or 1,
+                        help='jobs judged at the same time')
+    parser.add_argument('--wait', type=float, default=20,
+                        help='seconds a lease request waits for a job')
+    args = parser.parse_args()
+    if not args.token:
+        parser.error('JUDGE_TOKEN is not set')
+
+    # Stop like on Ctrl-C, so pooled sandboxes are removed at exit
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    worker = Worker(args.url, args.token, args.id, args.concurrency, args.wait)
+    print('Judge worker {} serving {} with {} threads'.format(
+        args.id, args.url, args.concurrency), file=sys.stderr)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        print('Finishing leased jobs, interrupt again to quit', file=sys.stderr)
+        worker.stop()
+        worker.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""In-process metrics, exposed in the Prometheus text format.
+
+Counters and histograms are updated as things happen; gauges are read
+from a callback when the metrics are rendered, so values that already
+have a `stats()` method (queue depth, cache sizes) need no bookkeeping.
+Labels are passed as keyword arguments and must match the label names the
+metric was declared with.
+"""
+
+import math
+import threading
+
+
+# Seconds, for request and judge stage durations
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escape(value))
+                          for name, value in pairs) + '}'
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError('{} takes labels {}, got {}'.format(
+                self.name, self.labels, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} {}'.format(self.name, self.type)]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+    def samples(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonically increasing total, e.g. statements executed."""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return ['{}{} {}'.format(self.name, format_labels(self.labels, key),
+                                 format_value(value))
+                for key, value in values]
+
+
+class Gauge(Metric):
+    """Current value, read from `collect()` on every render. `collect`
+    returns a number, or for a gauge with labels a dict mapping tuples of
+    label values to numbers."""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, collect, labels=()):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def samples(self):
+        values = self.collect()
+        if not self.labels:
+            values = {(): values}
+        return ['{}{} {}'.format(self.name, format_labels(self.labels, key),
+                                 format_value(value))
+                for key, value in sorted(values.items()) if value is not None]
+
+
+class Histogram(Metric):
+    """Distribution of observed values over cumulative `buckets`."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=default_buckets):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {} # label values -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total, count))
+                            for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    format_labels(self.labels, key, [('le', format_value(bound))]),
+                    cumulative))
+            labels = format_labels(self.labels, key)
+            lines.append('{}_sum{} {}'.format(self.name, labels, format_value(total)))
+            lines.append('{}_count{} {}'.format(self.name, labels, count))
+        return lines
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self.metrics):
+                raise ValueError('Duplicate metric: {}'.format(metric.name))
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, collect, labels=()):
+        return self.register(Gauge(name, help, collect, labels))
+
+    def histogram(self, name, help, labels=(), buckets=default_buckets):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self.metrics)
+        return ''.join(metric.render() + '\n' for metric in metrics)
+
+
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,187 @@
+"""Versioned schema migrations for existing databases.
+
+`Base.metadata.create_all` creates missing tables but can't change tables
+that already exist, so columns and indexes added to existing tables are
+applied here. The database records the number of migrations applied in
+the `schema_version` table; `migrate` runs the remaining ones in order.
+
+Migrations are numbered by their position in `migrations`: only ever
+append new ones. A new database gets the full schema from `create_all` and
+is marked as fully migrated. Migrations must be idempotent, because SQLite
+commits DDL statements immediately, so a migration interrupted halfway is
+rerun.
+
+    python migrations.py  # Migrate riker.db and print its schema version
+"""
+
+from datetime import datetime
+
+from sqlalchemy import MetaData, Table, Column, Integer, DateTime, inspect, text, \
+    bindparam
+
+
+schema_version = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, nullable=False))
+
+migrations = []
+
+
+def migration(function):
+    """Registers `function(connection, metadata)` as the next migration."""
+    migrations.append(function)
+    return function
+
+
+def add_column(connection, table_name, column_name, column_type):
+    """Adds a column unless the table already has it."""
+    columns = inspect(connection).get_columns(table_name)
+    if column_name in (column['name'] for column in columns):
+        return
+    connection.execute(text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+        table_name, column_name, column_type)))
+
+
+def create_index(connection, metadata, index_name):
+    """Creates the index declared on the models as `index_name` unless it
+    already exists."""
+    for table in metadata.tables.values():
+        for index in table.indexes:
+            if index.name == index_name:
+                index.create(connection, checkfirst=True)
+                return
+    raise KeyError(index_name)
+
+
+def add_case_results(connection):
+    """Per-case results of solutions. The `test_cases` table itself is
+    created by `create_all`; problems without rows in it are judged on
+    their own `test_input` and `test_output`, and solutions judged before
+    have NULL results, i.e. none per case."""
+    add_column(connection, 'solutions', 'case_results', 'VARCHAR')
+
+
+def add_compare_columns(connection):
+    """Comparison mode and tolerance of problems. Problems created before
+    have NULL, which is judged as exact comparison with the default
+    epsilon."""
+    add_column(connection, 'problems', 'compare_mode', 'VARCHAR')
+    add_column(connection, 'problems', 'float_epsilon', 'FLOAT')
+
+
+def add_blob_columns(connection):
+    """Digests of blob-backed test data. Test cases stored before keep
+    their data inline in `test_input` and `test_output`, which is still
+    read when the digests are NULL."""
+    add_column(connection, 'test_cases', 'input_blob', 'VARCHAR')
+    add_column(connection, 'test_cases', 'output_blob', 'VARCHAR')
+
+
+@migration
+def add_judging_columns(connection, metadata):
+    """Columns added since the first release: per-case results,
+    comparison modes and blob-backed test cases. Existing rows get NULL,
+    which the models treat as the old behaviour."""
+    add_case_results(connection)
+    add_compare_columns(connection)
+    add_blob_columns(connection)
+
+
+@migration
+def add_query_indexes(connection, metadata):
+    """Indexes for the solution list of a problem, `Problem.solved_by`,
+    comment threads, test case loading and the verification queue."""
+    for index_name in (
+            'ix_solutions_problem_verification_time',
+            'ix_solutions_user_problem_verification',
+            'ix_problem_comments_problem_time',
+            'ix_solution_comments_solution_time',
+            'ix_test_cases_problem_position',
+            'ix_verification_jobs_state_lease'):
+        create_index(connection, metadata, index_name)
+
+
+@migration
+def add_pagination_indexes(connection, metadata):
+    """Indexes for the paginated problem and solution lists of the home
+    and user pages."""
+    for index_name in (
+            'ix_problems_time',
+            'ix_problems_user_time',
+            'ix_solutions_user_time'):
+        create_index(connection, metadata, index_name)
+
+
+@migration
+def build_stats(connection, metadata):
+    """Fills the aggregate tables behind the leaderboard from existing
+    solutions."""
+    from sqlalchemy.orm import Session
+    from models import rebuild_stats # Only runs once models is loaded
+    db_session = Session(bind=connection)
+    rebuild_stats(db_session)
+    db_session.close()
+
+
+@migration
+def add_usage_columns(connection, metadata):
+    """Resource usage of judged solutions and cached verdicts, and the
+    index behind the fastest solutions ranking. Solutions judged before
+    have no usage and are left out of the ranking until rejudged."""
+    add_column(connection, 'solutions', 'case_usage', 'VARCHAR')
+    add_column(connection, 'solutions', 'cpu_time', 'FLOAT')
+    add_column(connection, 'solutions', 'wall_time', 'FLOAT')
+    add_column(connection, 'solutions', 'peak_memory', 'INTEGER')
+    add_column(connection, 'verdict_cache', 'case_usage', 'VARCHAR')
+    create_index(connection, metadata, 'ix_solutions_problem_fastest')
+
+
+@migration
+def backfill_submission_times(connection, metadata):
+    """Gives rows inserted without a submission time the oldest time in
+    their table, as pagination cursors (see pagination.py) are built from
+    it. Ties are ordered by id."""
+    for table_name in ('problems', 'solutions', 'problem_comments', 'solution_comments'):
+        connection.execute(text(
+            'UPDATE {0} SET submission_time = COALESCE('
+            '(SELECT MIN(submission_time) FROM {0}), :now) '
+            'WHERE submission_time IS NULL'.format(table_name)).bindparams(
+                bindparam('now', type_=DateTime)),
+            {'now': datetime.utcnow()})
+
+
+def current_version(connection, initial=0):
+    """Returns the number of migrations applied. Databases without a
+    version yet are recorded as `initial`."""
+    schema_version.create(connection, checkfirst=True)
+    version = connection.execute(schema_version.select()).scalar()
+    if version is None:
+        connection.execute(schema_version.insert().values(version=initial))
+        return initial
+    return version
+
+
+def migrate(engine, metadata, log=None):
+    """Creates missing tables, then applies pending migrations. Returns the
+    names of the migrations applied."""
+    new_database = not inspect(engine).get_table_names()
+    metadata.create_all(engine)
+    applied = []
+    with engine.begin() as connection:
+        version = current_version(
+            connection, initial=len(migrations) if new_database else 0)
+    for number, function in enumerate(migrations[version:], version + 1):
+        if log is not None:
+            log('Applying migration {}: {}'.format(number, function.__name__))
+        with engine.begin() as connection:
+            function(connection, metadata)
+            connection.execute(schema_version.update().values(version=number))
+        applied.append(function.__name__)
+    return applied
+
+
+if __name__ == '__main__':
+    from models import init_db
+    engine = init_db()
+    with engine.begin() as connection:
+        print('Schema version {}'.format(current_version(connection)))
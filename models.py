@@ -1,57 +1,221 @@
 import os
+import json
+import socket
 import functools
+import itertools
 import binascii
+import threading
+import hashlib
 import werkzeug
 import contextlib
+import traceback
 import verify
-import eventlet
+from verify.scheduler import scheduler_from_env, QueueFull
+from verify.compile_cache import compile_flags
+from blobstore import store_from_env
+from migrations import migrate
+from cache import LRUCache
+from pubsub import PubSub
+from batcher import WriteBehind
+from database import engine_from_env
+from collections import namedtuple, OrderedDict
 from datetime import datetime, timedelta
 
-from sqlalchemy import create_engine, Column, Integer, String, LargeBinary, \
-    DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, LargeBinary, \
+    DateTime, ForeignKey, Boolean, Float, Index, or_, and_, func, case
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, scoped_session, relationship
+from sqlalchemy.orm import sessionmaker, scoped_session, relationship, \
+    object_session, deferred
 
 
 
-engine = create_engine('sqlite:///riker.db')
-DBSession = scoped_session(sessionmaker(engine))
+# Set up by init_db, so importing models doesn't touch the database or
+# the blob store
+engine = None
+blob_store = None
+verdict_writer = None
+DBSession = scoped_session(sessionmaker())
 Base = declarative_base()
 
 
+def init_db(environ=os.environ, migrate_schema=True):
+    """Creates the engine described by `environ` (see database.py), binds
+    DBSession to it and, with `migrate_schema`, migrates the database. The
+    blob store, verdict writer, caches and verification settings are set
+    up from `environ` as well. Call once per process before using the
+    database."""
+    global engine, blob_store, verdict_writer
+    engine = engine_from_env(environ)
+    DBSession.configure(bind=engine)
+    blob_store = store_from_env(environ)
+    # Verdicts are committed every VERDICT_BATCH_INTERVAL seconds (0 commits
+    # each one right away), at most VERDICT_BATCH_SIZE at a time. Verdicts
+    # not written when the server stops are judged again once their lease
+    # expires.
+    verdict_writer = WriteBehind(
+        write_verdicts,
+        interval=float(environ.get('VERDICT_BATCH_INTERVAL', 0.1)),
+        max_batch=int(environ.get('VERDICT_BATCH_SIZE', 50)))
+    Problem.solved_cache = LRUCache(int(environ.get('SOLVED_CACHE_SIZE', 10000)))
+    Solution.verdict_events = PubSub(int(environ.get('SSE_BUFFER', 16)))
+    Solution.remote_judging = environ.get('VERIFY_REMOTE') == '1'
+    Solution._verify_scheduler = scheduler_from_env(environ)
+    Solution._dispatched = set()
+    VerificationJob.lease_seconds = int(environ.get('VERIFY_LEASE_SECONDS', 120))
+    VerificationJob.max_attempts = int(environ.get('VERIFY_MAX_ATTEMPTS', 3))
+    verify.configure(environ)
+    if migrate_schema:
+        migrate(engine, Base.metadata, log=print)
+    return engine
+
+
 
 class Problem(Base):
     __tablename__ = 'problems'
+    __table_args__ = (
+        # Problem lists, oldest first (see pagination)
+        Index('ix_problems_time', 'submission_time'),
+        Index('ix_problems_user_time', 'user_id', 'submission_time'),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(String)
     submission_time = Column(DateTime, default=datetime.utcnow)
     title = Column(String)
     prompt = Column(String)
-    test_input = Column(String)
-    test_output = Column(String)
+    # Single test case of problems created before `test_cases` existed.
+    # Deferred so listing problems doesn't load test data.
+    test_input = deferred(Column(String))
+    test_output = deferred(Column(String))
     timeout = Column(Integer, default=3)
+    compare_mode = Column(String, default='exact') # See verify.compare
+    float_epsilon = Column(Float, default=1e-6)
+
+    test_cases = relationship(
+        'TestCase', order_by='TestCase.position', cascade='all, delete-orphan')
+
+    def cases(self):
+        """Returns the (test_input, test_output) pairs solutions are checked
+        against. Problems created before multiple test cases were supported
+        only have the single `test_input`/`test_output` pair."""
+        if self.test_cases:
+            return [(case.test_input, case.test_output) for case in self.test_cases]
+        return [(self.test_input, self.test_output)]
+
+    def case_fingerprints(self):
+        """Returns a string identifying each test case's data, without
+        loading blob-backed test data."""
+        if self.test_cases:
+            return [case.fingerprint() for case in self.test_cases]
+        return [fingerprint(self.test_input, self.test_output)]
+
+    def comparison(self):
+        """Returns the (compare_mode, float_epsilon) solutions are judged
+        with. Problems created before comparison modes existed have NULL,
+        i.e. exact comparison with the default tolerance. An epsilon of 0
+        is kept as is."""
+        return (self.compare_mode or 'exact',
+                1e-6 if self.float_epsilon is None else self.float_epsilon)
 
     def solved_by(self, db_session, user_id):
         """Returns True if this problem has been solved by user_id"""
-        solutions = (
-            db_session.query(Solution)
-            .filter(Solution.user_id == user_id)
-            .filter(Solution.problem_id == self.id)
-            .filter(Solution.verification == 'PASS')
-            .first()
-        )
-        return solutions is not None
+        return self.id in Problem.solved_ids(db_session, user_id)
+
+    # (user_id, 'user:<id>' version) -> frozenset of ids of the problems the
+    # user solved. Every change to a user's verdicts bumps that version, so
+    # entries go stale in all processes, not just the one that wrote it.
+    # Sized by SOLVED_CACHE_SIZE in init_db.
+    solved_cache = None
+
+    @staticmethod
+    def solved_ids(db_session, user_id, version=None):
+        """Returns the ids of all problems solved by user_id, with a single
+        query. Cached per version of the user's EntityVersion, which is
+        read first unless given as `version`."""
+        if version is None:
+            key = 'user:{}'.format(user_id)
+            version = EntityVersion.get(db_session, [key])[0][key]
+        def load():
+            rows = (
+                db_session.query(Solution.problem_id)
+                .filter(Solution.user_id == user_id)
+                .filter(Solution.verification == 'PASS')
+                .distinct()
+            )
+            return frozenset(problem_id for problem_id, in rows)
+        return Problem.solved_cache.load((user_id, version), load)
 
     @staticmethod
     def exists(db_session, problem_id):
         """Return True if problem_id exists"""
         problem = db_session.query(Problem).filter(Problem.id==problem_id).first()
         return problem is not None
-        
 
-eventlet.monkey_patch() # Required for eventlet to work with Flask
+
+class TestCase(Base):
+    """A test input/output pair. The data itself lives in `blob_store`;
+    rows only hold the digests."""
+    __tablename__ = 'test_cases'
+    __table_args__ = (
+        Index('ix_test_cases_problem_position', 'problem_id', 'position'),
+    )
+    id = Column(Integer, primary_key=True)
+    problem_id = Column(Integer, ForeignKey('problems.id'))
+    position = Column(Integer)
+    input_blob = Column(String)
+    output_blob = Column(String)
+    # Inline test data of test cases created before the blob store
+    _test_input = deferred(Column('test_input', String))
+    _test_output = deferred(Column('test_output', String))
+
+    @property
+    def test_input(self):
+        if self.input_blob:
+            return blob_store.text(self.input_blob)
+        return self._test_input
+
+    @test_input.setter
+    def test_input(self, value):
+        self.input_blob = blob_store.put(value.encode('utf-8'))
+
+    @property
+    def test_output(self):
+        if self.output_blob:
+            return blob_store.text(self.output_blob)
+        return self._test_output
+
+    @test_output.setter
+    def test_output(self, value):
+        self.output_blob = blob_store.put(value.encode('utf-8'))
+
+    def fingerprint(self):
+        if self.input_blob and self.output_blob:
+            return self.input_blob + ':' + self.output_blob
+        return fingerprint(self._test_input, self._test_output)
+
+
+def fingerprint(test_input, test_output):
+    """Digests of inline test data, in the same form as blob-backed test
+    cases use."""
+    return ':'.join(
+        hashlib.sha256(data.encode('utf-8')).hexdigest()
+        for data in (test_input, test_output))
+
+
 class Solution(Base):
     __tablename__ = 'solutions'
+    __table_args__ = (
+        # Passing solutions of a problem, oldest first (view_problem)
+        Index('ix_solutions_problem_verification_time',
+              'problem_id', 'verification', 'submission_time'),
+        # Problem.solved_by
+        Index('ix_solutions_user_problem_verification',
+              'user_id', 'problem_id', 'verification'),
+        # Solutions of a user, oldest first (view_user)
+        Index('ix_solutions_user_time', 'user_id', 'submission_time'),
+        # Fastest passing solutions of a problem (fastest_solutions)
+        Index('ix_solutions_problem_fastest',
+              'problem_id', 'verification', 'cpu_time'),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(String)
     submission_time = Column(DateTime, default=datetime.utcnow)
@@ -59,33 +223,150 @@ class Solution(Base):
     language = Column(String)
     source = Column(String)
     verification = Column(String) # Status string returned by verify.verify
+    case_results = Column(String) # JSON list of per-case results
+    case_usage = Column(String) # JSON list of per-case resource usage
+    # Totals over the measured cases of the last verification
+    cpu_time = Column(Float) # seconds, summed
+    wall_time = Column(Float) # seconds, summed
+    peak_memory = Column(Integer) # KiB, maximum
+
+    def results(self):
+        """Returns the per-case results of the last verification."""
+        return json.loads(self.case_results) if self.case_results else []
+
+    def usage(self):
+        """Returns the per-case resource usage of the last verification,
+        see `verify.measure_case`."""
+        return json.loads(self.case_usage) if self.case_usage else []
+
+    def set_usage(self, usage):
+        """Stores per-case `usage` and its totals."""
+        for name, value in Solution.usage_columns(usage).items():
+            setattr(self, name, value)
+
+    @staticmethod
+    def usage_columns(usage):
+        """Returns the column values storing per-case `usage` and its
+        totals, e.g. for bulk updates. Totals are None if no case was
+        measured."""
+        measured = [u for u in usage if u is not None]
+        return {
+            'case_usage': json.dumps(usage),
+            'cpu_time': sum(u['cpu'] for u in measured) if measured else None,
+            'wall_time': sum(u['wall'] for u in measured) if measured else None,
+            'peak_memory': max(u['memory'] for u in measured) if measured else None,
+        }
 
     problem = relationship('Problem')
 
+    @staticmethod
+    def fastest(db_session, problem_id, limit):
+        """Returns up to `limit` passing solutions of a problem, least CPU
+        time first, then least memory."""
+        return db_session.query(Solution).filter(
+            Solution.problem_id == problem_id,
+            Solution.verification == 'PASS',
+            Solution.cpu_time != None).order_by(
+                Solution.cpu_time, Solution.peak_memory,
+                Solution.submission_time).limit(limit).all()
+
     def verify(self):
-        Solution._verify(self.id)
+        """Queues this solution for verification. The job is persisted in
+        `verification_jobs` first so it survives a restart. Problem authors
+        verifying their own problem go through the scheduler's priority
+        lane."""
+        db_session = object_session(self)
+        job = VerificationJob(
+            solution_id=self.id, user_id=self.user_id,
+            priority=self.user_id == self.problem.user_id)
+        db_session.add(job)
+        db_session.commit()
+        Solution._dispatch(job)
+
+    # Verdicts are published on 'solution:<id>' once committed, set up by
+    # init_db
+    verdict_events = None
+
+    def publish_verdict(self):
+        Solution.verdict_events.publish('solution:{}'.format(self.id), {
+            'verification': self.verification,
+            'results': self.results(),
+        })
+
+    def verdict_key(self):
+        """Returns the verdict cache key of this solution against its
+        problem's current test data, see `CachedVerdict.key`."""
+        problem = self.problem
+        return CachedVerdict.key(
+            self.language, self.source, problem.case_fingerprints(),
+            problem.timeout, *problem.comparison())
+
+    # With VERIFY_REMOTE=1 jobs are only judged by judge_worker.py
+    # processes, which lease them over the judge API (see riker.py).
+    remote_judging = False
+
+    _verify_scheduler = None # Set up by init_db
+    _dispatched = set() # ids of jobs queued on _verify_scheduler
+    @staticmethod
+    def _dispatch(job):
+        """Hands `job` to `_verify_scheduler`. If the scheduler queue is
+        full the job stays queued in the database and is picked up later by
+        `requeue_verification`."""
+        if Solution.remote_judging or job.id in Solution._dispatched:
+            return
+        try:
+            Solution._verify_scheduler.submit(
+                Solution._verify, job.id, user=job.user_id, priority=job.priority)
+        except QueueFull:
+            return
+        Solution._dispatched.add(job.id)
 
-    _verify_sem = eventlet.semaphore.Semaphore(1)
     @staticmethod
-    def _verify(solution_id):
+    def _verify(job_id):
         """Verifies the correctness of the solution using `verify.verify`.
-        Task is launched in a separate thread to avoid stalling the server.
-        Verify threads must acquire verify_sem to avoid running too many
-        verification jobs at once."""
-        def thread():
-            db_session = DBSession()
+        Runs on one of `_verify_scheduler`'s workers to avoid stalling the
+        server. The job is leased first, so a job that is already being
+        judged elsewhere is skipped, and the verdict is only written if the
+        lease is still ours when judging finishes. The lease is renewed
+        while judging. Verdicts are written in batches by `verdict_writer`."""
+        Solution._dispatched.discard(job_id)
+        db_session = DBSession.session_factory() # Not shared with request handlers
+        try:
+            job = VerificationJob.lease(db_session, job_id)
+            if job is None:
+                return
             solution = db_session.query(Solution).filter(
-                Solution.id == solution_id).first()
-            with Solution._verify_sem:
-                solution.verification = verify.verify(
-                    solution.language, solution.source, solution.problem.test_input, 
-                    solution.problem.test_output, solution.problem.timeout)
-
-            db_session.add(solution)
-            db_session.commit()
-            db_session.close()
+                Solution.id == job.solution_id).first()
+            if solution is None: # Deleted while queued
+                job.finish(db_session)
+                db_session.commit()
+                return
+
+            problem = solution.problem
+            key = solution.verdict_key()
+            cached = CachedVerdict.lookup(db_session, key)
+            if cached is not None:
+                verification, results = cached.verification, cached.results()
+                usage = cached.usage()
+            else:
+                try:
+                    with job.heartbeat() as lost:
+                        verification, results, usage = verify.verify_cases(
+                            solution.language, solution.source, problem.cases(),
+                            problem.timeout, *problem.comparison())
+                except Exception:
+                    job.fail(db_session)
+                    db_session.commit()
+                    if job.state == 'failed':
+                        solution.publish_verdict()
+                    raise
+                if lost.is_set(): # Taken over after the lease expired
+                    return
 
-        eventlet.spawn_n(thread)
+            verdict_writer.put(Verdict(
+                job, solution.id, key, cached is not None, verification, results, usage))
+        finally:
+            db_session.close()
 
     @staticmethod
     def exists(db_session, solution_id):
@@ -96,6 +377,9 @@ class Solution(Base):
     
 class ProblemComment(Base):
     __tablename__ = 'problem_comments'
+    __table_args__ = (
+        Index('ix_problem_comments_problem_time', 'problem_id', 'submission_time'),
+    )
     id = Column(Integer, primary_key=True)
     problem_id = Column(Integer, ForeignKey('problems.id'))
     body = Column(String)
@@ -111,6 +395,9 @@ class ProblemComment(Base):
 
 class SolutionComment(Base):
     __tablename__ = 'solution_comments'
+    __table_args__ = (
+        Index('ix_solution_comments_solution_time', 'solution_id', 'submission_time'),
+    )
     id = Column(Integer, primary_key=True)
     solution_id = Column(Integer, ForeignKey('solutions.id'))
     body = Column(String)
@@ -125,5 +412,580 @@ class SolutionComment(Base):
         return solution_comment is not None
 
 
-Base.metadata.create_all(engine)
+class EntityVersion(Base):
+    """Change counters for cached pages. Every write bumps the keys of the
+    pages it affects, e.g. 'problems' (the problem list), 'problem:<id>',
+    'solution:<id>' and 'user:<id>', in the same transaction; pages derive
+    their ETag and Last-Modified headers from them."""
+    __tablename__ = 'entity_versions'
+    key = Column(String, primary_key=True)
+    version = Column(Integer, default=0)
+    update_time = Column(DateTime)
+
+    @staticmethod
+    def bump(db_session, *keys):
+        now = datetime.utcnow()
+        for key in keys:
+            updated = (
+                db_session.query(EntityVersion)
+                .filter(EntityVersion.key == key)
+                .update({
+                    'version': EntityVersion.version + 1,
+                    'update_time': now,
+                }, synchronize_session=False)
+            )
+            if not updated:
+                db_session.add(EntityVersion(key=key, version=1, update_time=now))
+                db_session.flush()
+
+    @staticmethod
+    def get(db_session, keys):
+        """Returns ({key: version}, time of the latest change or None) for
+        `keys`, with one query. Keys that were never bumped are at 0."""
+        versions = dict.fromkeys(keys, 0)
+        last_modified = None
+        rows = (
+            db_session.query(EntityVersion)
+            .filter(EntityVersion.key.in_(keys))
+        )
+        for row in rows:
+            versions[row.key] = row.version
+            if last_modified is None or row.update_time > last_modified:
+                last_modified = row.update_time
+        return versions, last_modified
+
+
+class CachedVerdict(Base):
+    """Verdicts of previous verifications, keyed by a hash of everything
+    that determines the outcome: language, source, test data digests,
+    timeout, comparison mode, the language's limits and compiler flags.
+    Changing a problem's test data changes the key, so stale entries are
+    never hit. Only deterministic outcomes are cached, along with the
+    resource usage measured when they were judged."""
+    __tablename__ = 'verdict_cache'
+    cache_key = Column(String, primary_key=True)
+    verification = Column(String)
+    case_results = Column(String) # JSON list of per-case results
+    case_usage = Column(String) # JSON list of per-case resource usage
+    hits = Column(Integer, default=0)
+    creation_time = Column(DateTime, default=datetime.utcnow)
+
+    cacheable_results = ('PASS', 'FAIL', 'CANCELLED')
+
+    def results(self):
+        return json.loads(self.case_results)
+
+    def usage(self):
+        if self.case_usage:
+            return json.loads(self.case_usage)
+        return [None] * len(self.results()) # Cached before usage was measured
+
+    @staticmethod
+    def key(language, source, case_fingerprints, timeout, compare_mode, float_epsilon):
+        """`case_fingerprints` identify the test data, see
+        `Problem.case_fingerprints`."""
+        digest = hashlib.sha256()
+        parts = [language, source, str(timeout), compare_mode, repr(float_epsilon),
+                 repr(tuple(verify.get_limits().get(language, ()))),
+                 compile_flags.get(language, '')] # As in the compile cache key
+        parts.extend(case_fingerprints)
+        for part in parts:
+            data = part.encode('utf-8')
+            digest.update(str(len(data)).encode('ascii') + b':' + data)
+        return digest.hexdigest()
+
+    @staticmethod
+    def lookup(db_session, key):
+        """Returns the cached verdict for key, or None. Hits are counted
+        separately, see `hit`."""
+        return db_session.query(CachedVerdict).filter(
+            CachedVerdict.cache_key == key).first()
+
+    @staticmethod
+    def hit(db_session, key):
+        db_session.query(CachedVerdict).filter(CachedVerdict.cache_key == key).update(
+            {'hits': CachedVerdict.hits + 1}, synchronize_session=False)
+
+    @staticmethod
+    def store(db_session, key, verification, results, usage):
+        """Caches a verdict unless it depends on timing (timeouts, errors,
+        output and memory limits) rather than on the program's output."""
+        if not results or any(r not in CachedVerdict.cacheable_results for r in results):
+            return
+        db_session.merge(CachedVerdict(
+            cache_key=key, verification=verification,
+            case_results=json.dumps(results), case_usage=json.dumps(usage)))
+
+
+class VerificationJob(Base):
+    """Persistent verification queue entry. A worker leases a job before
+    judging it; a lease that is not finished before `lease_expires` is
+    considered orphaned and the job is retried, up to `max_attempts`."""
+    __tablename__ = 'verification_jobs'
+    __table_args__ = (
+        Index('ix_verification_jobs_state_lease', 'state', 'lease_expires'),
+    )
+    id = Column(Integer, primary_key=True)
+    solution_id = Column(Integer, ForeignKey('solutions.id'))
+    user_id = Column(String)
+    priority = Column(Boolean, default=False)
+    state = Column(String, default='queued') # queued, leased, done or failed
+    owner = Column(String)
+    attempts = Column(Integer, default=0)
+    lease_expires = Column(DateTime)
+    enqueue_time = Column(DateTime, default=datetime.utcnow)
+    finish_time = Column(DateTime)
+
+    # From VERIFY_LEASE_SECONDS and VERIFY_MAX_ATTEMPTS, see init_db
+    lease_seconds = 120
+    max_attempts = 3
+
+    @staticmethod
+    def local_owner():
+        """Lease owner of jobs judged in this process. Computed on each
+        call, so forked web workers don't share their parent's."""
+        return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    @staticmethod
+    def lease(db_session, job_id, owner=None):
+        """Atomically leases job_id. Returns the job, or None if it is
+        finished or currently leased by someone else."""
+        now = datetime.utcnow()
+        leased = (
+            db_session.query(VerificationJob)
+            .filter(VerificationJob.id == job_id)
+            .filter(or_(
+                VerificationJob.state == 'queued',
+                and_(VerificationJob.state == 'leased',
+                     VerificationJob.lease_expires < now)))
+            .update({
+                'state': 'leased',
+                'owner': owner or VerificationJob.local_owner(),
+                'lease_expires': now + timedelta(seconds=VerificationJob.lease_seconds),
+                'attempts': VerificationJob.attempts + 1,
+            }, synchronize_session=False)
+        )
+        db_session.commit()
+        if not leased:
+            return None
+        return db_session.query(VerificationJob).filter(
+            VerificationJob.id == job_id).first()
+
+    @staticmethod
+    def lease_next(db_session, owner):
+        """Leases the next queued job for `owner`, problem authors' jobs
+        first, then oldest first. Returns None if no job is queued."""
+        while True:
+            candidates = (
+                db_session.query(VerificationJob.id)
+                .filter(VerificationJob.state == 'queued')
+                .order_by(VerificationJob.priority.desc(), VerificationJob.id)
+                .limit(10)
+                .all()
+            )
+            if not candidates:
+                db_session.rollback()
+                return None
+            for job_id, in candidates: # Others may lease them first
+                job = VerificationJob.lease(db_session, job_id, owner)
+                if job is not None:
+                    return job
+
+    @staticmethod
+    def held(db_session, job_id, owner):
+        """Returns job_id if `owner` holds its lease, else None."""
+        return (
+            db_session.query(VerificationJob)
+            .filter(VerificationJob.id == job_id)
+            .filter(VerificationJob.state == 'leased')
+            .filter(VerificationJob.owner == owner)
+            .first()
+        )
+
+    @staticmethod
+    def renew(db_session, job_id, owner):
+        """Extends the lease `owner` holds on job_id by `lease_seconds`.
+        Returns False if the lease was lost."""
+        renewed = (
+            db_session.query(VerificationJob)
+            .filter(VerificationJob.id == job_id)
+            .filter(VerificationJob.state == 'leased')
+            .filter(VerificationJob.owner == owner)
+            .update({'lease_expires': datetime.utcnow() + timedelta(
+                seconds=VerificationJob.lease_seconds)}, synchronize_session=False)
+        )
+        db_session.commit()
+        return renewed == 1
+
+    def finish(self, db_session):
+        """Marks the job done if we still hold its lease. Returns False if
+        the lease expired and the job was taken over by someone else."""
+        finished = (
+            db_session.query(VerificationJob)
+            .filter(VerificationJob.id == self.id)
+            .filter(VerificationJob.state == 'leased')
+            .filter(VerificationJob.owner == self.owner)
+            .update({'state': 'done', 'finish_time': datetime.utcnow()},
+                    synchronize_session=False)
+        )
+        return finished == 1
+
+    def fail(self, db_session):
+        """Returns the job to the queue, or gives up on it once it has been
+        attempted `max_attempts` times."""
+        if self.attempts < VerificationJob.max_attempts:
+            self.state = 'queued'
+            return
+        self.state = 'failed'
+        self.finish_time = datetime.utcnow()
+        solution = db_session.query(Solution).filter(
+            Solution.id == self.solution_id).first()
+        if solution is not None:
+            previous = solution.verification
+            solution.verification = 'Verification failed'
+            record_verdict(db_session, solution, previous, solution.verification)
+            EntityVersion.bump(db_session, 'solution:{}'.format(solution.id))
+
+    @contextlib.contextmanager
+    def heartbeat(self):
+        """Renews the lease on the job every third of `lease_seconds`
+        while the block runs, on a session of its own. Yields an event that
+        is set if the lease was lost meanwhile."""
+        done = threading.Event()
+        lost = threading.Event()
+
+        def renew():
+            db_session = DBSession.session_factory()
+            try:
+                while not done.wait(VerificationJob.lease_seconds / 3):
+                    if not VerificationJob.renew(db_session, self.id, self.owner):
+                        lost.set()
+                        return
+            except Exception:
+                traceback.print_exc()
+            finally:
+                db_session.close()
+
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            done.set()
+            thread.join()
+
+    @staticmethod
+    def requeue_expired(db_session):
+        """Requeues (or fails) jobs whose lease expired without a verdict,
+        e.g. because the worker holding them was killed."""
+        expired = (
+            db_session.query(VerificationJob)
+            .filter(VerificationJob.state == 'leased')
+            .filter(VerificationJob.lease_expires < datetime.utcnow())
+            .all()
+        )
+        for job in expired:
+            job.fail(db_session)
+        db_session.commit()
+
+    @staticmethod
+    def enqueue_orphans(db_session):
+        """Creates jobs for PENDING solutions that have no live job, e.g.
+        solutions submitted before the job table existed."""
+        live_jobs = (
+            db_session.query(VerificationJob.solution_id)
+            .filter(VerificationJob.state.in_(('queued', 'leased')))
+        )
+        orphans = (
+            db_session.query(Solution)
+            .filter(Solution.verification == 'PENDING')
+            .filter(~Solution.id.in_(live_jobs))
+            .all()
+        )
+        for solution in orphans:
+            db_session.add(VerificationJob(
+                solution_id=solution.id, user_id=solution.user_id,
+                priority=solution.user_id == solution.problem.user_id))
+        db_session.commit()
+
+
+class ProblemStats(Base):
+    """Judged submissions, passing submissions and distinct solvers of a
+    problem, maintained by `record_verdict`."""
+    __tablename__ = 'problem_stats'
+    problem_id = Column(Integer, primary_key=True)
+    attempts = Column(Integer, default=0)
+    passes = Column(Integer, default=0)
+    solvers = Column(Integer, default=0)
+
+    def acceptance_rate(self):
+        return self.passes / self.attempts if self.attempts else 0.0
+
+
+class UserProblemStats(Base):
+    """Submissions of one user to one problem, and when the user first
+    solved it. Lets `record_verdict` tell whether a verdict changes the
+    number of distinct problems a user solved."""
+    __tablename__ = 'user_problem_stats'
+    user_id = Column(String, primary_key=True)
+    problem_id = Column(Integer, primary_key=True)
+    attempts = Column(Integer, default=0)
+    passes = Column(Integer, default=0)
+    first_solve_time = Column(DateTime) # Earliest passing submission
+
+    __table_args__ = (
+        Index('ix_user_problem_stats_problem', 'problem_id'),
+    )
+
+
+class UserStats(Base):
+    """Problems solved by a user, and when they solved their first and
+    latest one. Ranked by solved count, then by who got there first."""
+    __tablename__ = 'user_stats'
+    user_id = Column(String, primary_key=True)
+    solved = Column(Integer, default=0)
+    first_solve_time = Column(DateTime)
+    last_solve_time = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_user_stats_rank', 'solved', 'last_solve_time'),
+    )
+
+    @staticmethod
+    def leaderboard(db_session, limit):
+        return (
+            db_session.query(UserStats)
+            .filter(UserStats.solved > 0)
+            .order_by(UserStats.solved.desc(), UserStats.last_solve_time)
+            .limit(limit)
+            .all()
+        )
+
+
+def judged(verification):
+    return verification not in (None, 'PENDING')
+
+
+def _add(db_session, model, key, **deltas):
+    """Adds `deltas` to counters of the `model` row identified by `key`,
+    creating the row if needed. The update is a single SQL expression, so
+    concurrent writers can't lose each other's increments."""
+    updated = (
+        db_session.query(model)
+        .filter_by(**key)
+        .update({
+            getattr(model, name): getattr(model, name) + delta
+            for name, delta in deltas.items()
+        }, synchronize_session=False)
+    )
+    if not updated:
+        db_session.add(model(**dict(key, **deltas)))
+        db_session.flush()
+
+
+def record_verdict(db_session, solution, previous, verification):
+    """Updates the aggregate tables for `solution` going from verification
+    `previous` to `verification`, in the caller's transaction. Call after
+    the change is made in `db_session`; pass None as `verification` for a
+    deleted solution."""
+    attempts = judged(verification) - judged(previous)
+    passes = (verification == 'PASS') - (previous == 'PASS')
+    if not attempts and not passes:
+        return
+    problem_key = {'problem_id': solution.problem_id}
+    pair_key = {'user_id': solution.user_id, 'problem_id': solution.problem_id}
+    _add(db_session, ProblemStats, problem_key, attempts=attempts, passes=passes)
+    _add(db_session, UserProblemStats, pair_key, attempts=attempts, passes=passes)
+    if passes:
+        _record_solved(db_session, solution, passes)
+    if attempts < 0: # Drop rows of deleted submissions, as rebuild_stats would
+        for model, key in ((UserProblemStats, pair_key), (ProblemStats, problem_key)):
+            db_session.query(model).filter_by(attempts=0, **key).delete(
+                synchronize_session=False)
+
+
+def _record_solved(db_session, solution, passes):
+    """Updates first solve times and solver counts after the passing
+    submissions of a user to a problem changed by `passes`."""
+    problem_key = {'problem_id': solution.problem_id}
+    pair_key = {'user_id': solution.user_id, 'problem_id': solution.problem_id}
+    pair_passes = (
+        db_session.query(UserProblemStats.passes)
+        .filter_by(**pair_key)
+        .scalar()
+    )
+    first_solve_time = (
+        db_session.query(func.min(Solution.submission_time))
+        .filter(Solution.user_id == solution.user_id)
+        .filter(Solution.problem_id == solution.problem_id)
+        .filter(Solution.verification == 'PASS')
+        .scalar()
+    )
+    db_session.query(UserProblemStats).filter_by(**pair_key).update(
+        {'first_solve_time': first_solve_time}, synchronize_session=False)
+    was_solved, solved = pair_passes - passes > 0, pair_passes > 0
+    if was_solved != solved:
+        _add(db_session, ProblemStats, problem_key, solvers=1 if solved else -1)
+    _refresh_user_stats(db_session, solution.user_id)
+
+
+def record_problem_deleted(db_session, problem_id):
+    """Drops the aggregates of a deleted problem. Call after its solutions
+    are deleted in `db_session`."""
+    solvers = [
+        user_id for user_id, in
+        db_session.query(UserProblemStats.user_id)
+        .filter(UserProblemStats.problem_id == problem_id)
+        .filter(UserProblemStats.passes > 0)
+    ]
+    db_session.query(UserProblemStats).filter(
+        UserProblemStats.problem_id == problem_id).delete(synchronize_session=False)
+    db_session.query(ProblemStats).filter(
+        ProblemStats.problem_id == problem_id).delete(synchronize_session=False)
+    for user_id in solvers:
+        _refresh_user_stats(db_session, user_id)
+
+
+def _refresh_user_stats(db_session, user_id):
+    solved, first_solve_time, last_solve_time = (
+        db_session.query(
+            func.count(), func.min(UserProblemStats.first_solve_time),
+            func.max(UserProblemStats.first_solve_time))
+        .filter(UserProblemStats.user_id == user_id)
+        .filter(UserProblemStats.passes > 0)
+        .one()
+    )
+    if not solved:
+        db_session.query(UserStats).filter(UserStats.user_id == user_id).delete(
+            synchronize_session=False)
+        return
+    db_session.merge(UserStats(
+        user_id=user_id, solved=solved, first_solve_time=first_solve_time,
+        last_solve_time=last_solve_time))
+
+
+def rebuild_stats(db_session):
+    """Recomputes all aggregate tables from `solutions`, e.g. after they
+    were modified outside the app. See rebuild_stats.py."""
+    for model in (UserStats, UserProblemStats, ProblemStats):
+        db_session.query(model).delete(synchronize_session=False)
+    is_pass = case((Solution.verification == 'PASS', 1), else_=0)
+    pairs = (
+        db_session.query(
+            Solution.user_id, Solution.problem_id, func.count(), func.sum(is_pass),
+            func.min(case((Solution.verification == 'PASS', Solution.submission_time))))
+        .filter(Solution.verification != 'PENDING')
+        .group_by(Solution.user_id, Solution.problem_id)
+    )
+    problems, users = {}, {}
+    for user_id, problem_id, attempts, passes, first_solve_time in pairs:
+        db_session.add(UserProblemStats(
+            user_id=user_id, problem_id=problem_id, attempts=attempts,
+            passes=passes, first_solve_time=first_solve_time))
+        stats = problems.setdefault(problem_id, ProblemStats(
+            problem_id=problem_id, attempts=0, passes=0, solvers=0))
+        stats.attempts += attempts
+        stats.passes += passes
+        if passes:
+            stats.solvers += 1
+            user = users.setdefault(user_id, UserStats(user_id=user_id, solved=0))
+            user.solved += 1
+            user.first_solve_time = min(
+                filter(None, (user.first_solve_time, first_solve_time)), default=None)
+            user.last_solve_time = max(
+                filter(None, (user.last_solve_time, first_solve_time)), default=None)
+    db_session.add_all(problems.values())
+    db_session.add_all(users.values())
+    db_session.flush()
+
+
+# A judged solution, queued on `verdict_writer`. `cached` tells whether it
+# came from the verdict cache, whose hit count is then incremented.
+Verdict = namedtuple(
+    'Verdict', 'job solution_id cache_key cached verification results usage')
+
+
+def write_verdicts(verdicts):
+    """Writes a batch of verdicts in one transaction, then publishes them.
+    A verdict whose job lease was taken over in the meantime is dropped,
+    like one whose solution was deleted while it was judged."""
+    db_session = DBSession.session_factory(expire_on_commit=False)
+    try:
+        solutions = {solution.id: solution for solution in db_session.query(Solution).filter(
+            Solution.id.in_([verdict.solution_id for verdict in verdicts]))}
+        written = []
+        for verdict in verdicts:
+            if verdict.cached:
+                CachedVerdict.hit(db_session, verdict.cache_key)
+            else:
+                CachedVerdict.store(
+                    db_session, verdict.cache_key, verdict.verification,
+                    verdict.results, verdict.usage)
+            solution = solutions.get(verdict.solution_id)
+            if not verdict.job.finish(db_session) or solution is None:
+                continue
+            previous = solution.verification
+            solution.verification = verdict.verification
+            solution.case_results = json.dumps(verdict.results)
+            solution.set_usage(verdict.usage)
+            record_verdict(db_session, solution, previous, verdict.verification)
+            EntityVersion.bump( # Problem page shows submission counts
+                db_session, 'solution:{}'.format(solution.id),
+                'user:{}'.format(solution.user_id),
+                'problem:{}'.format(solution.problem_id))
+            written.append(solution)
+        db_session.commit()
+        for solution in written:
+            solution.publish_verdict()
+    finally:
+        db_session.close()
+
+
+
+def fair_order(jobs):
+    """Orders queued jobs for dispatch: priority jobs first, then one job
+    of each user in turn, each user's oldest first, so the free scheduler
+    slots don't all go to whoever has the longest backlog."""
+    jobs = sorted(jobs, key=lambda job: job.id)
+    by_user = OrderedDict()
+    for job in jobs:
+        if not job.priority:
+            by_user.setdefault(job.user_id, []).append(job)
+    ordered = [job for job in jobs if job.priority]
+    for turn in itertools.zip_longest(*by_user.values()):
+        ordered.extend(job for job in turn if job is not None)
+    return ordered
+
+
+def requeue_verification():
+    """Recovers the verification queue from the database: requeues expired
+    leases, creates jobs for orphaned PENDING solutions and dispatches every
+    queued job that is not already on the scheduler, in `fair_order`."""
+    db_session = DBSession.session_factory()
+    try:
+        VerificationJob.requeue_expired(db_session)
+        VerificationJob.enqueue_orphans(db_session)
+        queued = (
+            db_session.query(VerificationJob)
+            .filter(VerificationJob.state == 'queued')
+            .all()
+        )
+        for job in fair_order(queued):
+            Solution._dispatch(job)
+    finally:
+        db_session.close()
+
+
+def start_verification(interval=10):
+    """Recovers the verification queue at startup, then keeps requeueing
+    expired leases and overflow jobs every `interval` seconds."""
+    import eventlet # Only the server needs it, and it is slow to import
 
+    def loop():
+        while True:
+            try:
+                requeue_verification()
+            except Exception:
+                traceback.print_exc()
+            eventlet.sleep(interval)
+    eventlet.spawn_n(loop)
@@ -0,0 +1,88 @@
+"""Keyset pagination on (submission_time, id).
+
+A page is fetched with a range condition on the sort key of the row just
+before or after it, instead of an OFFSET, so every page costs the same no
+matter how far into the history it is. Cursors encode that sort key as
+`<microseconds since epoch>-<id>`, so rows must have a submission time;
+those inserted without one are backfilled by a migration (see
+migrations.py).
+"""
+
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+
+
+_epoch = datetime(1970, 1, 1)
+_microsecond = timedelta(microseconds=1)
+
+last_page = 'end' # `before` cursor of the last page
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class Page(object):
+    """One page of rows. Iterates over the rows, so templates can loop over
+    it like a list. `next`/`prev` are the cursors of the adjacent pages, or
+    None at either end; `name` prefixes their query string parameters."""
+
+    def __init__(self, name, items, next=None, prev=None):
+        self.name = name
+        self.items = items
+        self.next = next
+        self.prev = prev
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(submission_time, id):
+    return '{}-{}'.format((submission_time - _epoch) // _microsecond, id)
+
+
+def decode_cursor(cursor):
+    try:
+        microseconds, id = cursor.split('-')
+        return _epoch + int(microseconds) * _microsecond, int(id)
+    except (ValueError, OverflowError):
+        raise InvalidCursor(cursor)
+
+
+def paginate(query, model, name, size, after=None, before=None):
+    """Returns the Page of `query` (over `model`, which must have
+    `submission_time` and `id` columns) following the cursor `after` or
+    preceding the cursor `before`, oldest first. With neither, returns the
+    first page; `before=last_page` returns the last one."""
+    time_column, id_column = model.submission_time, model.id
+    backwards = before is not None
+    cursor = before if backwards else after
+    if cursor is not None and cursor != last_page:
+        time, id = decode_cursor(cursor)
+        if backwards:
+            query = query.filter(or_(
+                time_column < time, and_(time_column == time, id_column < id)))
+        else:
+            query = query.filter(or_(
+                time_column > time, and_(time_column == time, id_column > id)))
+    if backwards:
+        query = query.order_by(time_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(time_column, id_column)
+    items = query.limit(size + 1).all() # One extra row tells if there's more
+    more = len(items) > size
+    items = items[:size]
+    if backwards:
+        items.reverse()
+    if not items:
+        return Page(name, items)
+    first = encode_cursor(items[0].submission_time, items[0].id)
+    last = encode_cursor(items[-1].submission_time, items[-1].id)
+    if backwards:
+        return Page(name, items, next=last if cursor != last_page else None,
+                    prev=first if more else None)
+    return Page(name, items, next=last if more else None,
+                prev=first if cursor is not None else None)
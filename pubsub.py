@@ -0,0 +1,87 @@
+"""In-process publish/subscribe, used to push verdicts to browsers.
+
+Each subscriber gets its own bounded buffer. A subscriber that doesn't keep
+up loses its oldest messages rather than blocking publishers or growing
+without bound.
+"""
+
+import queue
+import threading
+
+
+class Subscription(object):
+
+    def __init__(self, pubsub, topic, max_buffer):
+        self.pubsub = pubsub
+        self.topic = topic
+        self.dropped = 0
+        self._buffer = queue.Queue(max_buffer)
+
+    def get(self, timeout=None):
+        """Returns the next message, or None if there was none within
+        `timeout` seconds."""
+        try:
+            return self._buffer.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def put(self, message):
+        while True:
+            try:
+                self._buffer.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self._buffer.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        self.pubsub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class PubSub(object):
+
+    def __init__(self, max_buffer=16):
+        self.max_buffer = max_buffer
+        self._topics = {} # topic -> set of subscriptions
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, topic):
+        subscription = Subscription(self, topic, self.max_buffer)
+        with self._lock:
+            self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._topics.get(subscription.topic, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._topics.pop(subscription.topic, None)
+
+    def publish(self, topic, message):
+        """Delivers `message` to every current subscriber of `topic`.
+        Returns the number of subscribers."""
+        with self._lock:
+            subscriptions = list(self._topics.get(topic, ()))
+            self.published += 1
+        for subscription in subscriptions:
+            subscription.put(message)
+        return len(subscriptions)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'topics': len(self._topics),
+                'subscribers': sum(len(s) for s in self._topics.values()),
+                'published': self.published,
+            }
@@ -0,0 +1,60 @@
+"""Counts the SQL statements a block of code issues, so tests can catch N+1
+query regressions.
+
+Views declare their budget with `riker.query_budget`; with
+`app.config['ENFORCE_QUERY_BUDGETS']` set, a request that goes over budget
+raises QueryBudgetExceeded. Statements are counted per engine, so run
+budget checks while no verification jobs are writing to the database.
+"""
+
+import contextlib
+from sqlalchemy import event
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter(object):
+    """Context manager recording every statement executed on `engine`."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def start(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def stop(self):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def check(self, budget, label='block'):
+        """Raises QueryBudgetExceeded if more than `budget` statements were
+        recorded."""
+        if self.count > budget:
+            raise QueryBudgetExceeded(
+                '{} issued {} SQL statements, budget is {}:\n{}'.format(
+                    label, self.count, budget, '\n'.join(self.statements)))
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextlib.contextmanager
+def assert_query_budget(engine, budget, label='block'):
+    """Fails if the body of the with-block issues more than `budget` SQL
+    statements on `engine`."""
+    with QueryCounter(engine) as counter:
+        yield counter
+    counter.check(budget, label)
@@ -0,0 +1,15 @@
+"""Recomputes the leaderboard and problem statistics from the solutions
+table, for recovery if the aggregate tables got out of sync.
+
+    python rebuild_stats.py
+"""
+
+from models import DBSession, init_db, rebuild_stats
+
+
+if __name__ == '__main__':
+    init_db()
+    db_session = DBSession()
+    rebuild_stats(db_session)
+    db_session.commit()
+    db_session.close()
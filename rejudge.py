@@ -0,0 +1,356 @@
+"""Re-verifies the solutions of a problem, e.g. after its test data was
+fixed, and reports the verdicts that changed.
+
+Solutions are read in batches of `--batch-size` in id order, so memory
+stays flat however many there are, and judged on `--processes` worker
+processes that receive the problem's test data once (see
+`verify.JudgePool`). Verdicts
+already in the verdict cache are not judged again. Each batch is written
+back in one transaction, with the aggregate tables updated for the
+verdicts that changed. Pending solutions are skipped, their queued jobs
+judge them against the new data anyway.
+
+    python rejudge.py <problem_id> [--language python] [--verification PASS]
+                      [--user <user_id>] [--processes 8] [--batch-size 200]
+                      [--dry-run]
+
+Problem authors and `ADMIN_USERS` can also start a rejudge with
+`POST /problem/<id>/rejudge`, see riker.py.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import threading
+import traceback
+import collections
+
+import verify
+from models import DBSession, Problem, Solution, CachedVerdict, EntityVersion, \
+    init_db, record_verdict
+
+
+# Defaults, overridden per rejudge
+processes = int(os.environ.get('REJUDGE_PROCESSES', os.cpu_count() or 1))
+batch_size = int(os.environ.get('REJUDGE_BATCH_SIZE', 200))
+
+
+class ProblemNotFound(Exception):
+    pass
+
+
+class RejudgeRunning(Exception):
+    pass
+
+
+class Rejudge(object):
+    """Re-verifies the judged solutions of `problem_id`, optionally only
+    those in `language`, with verdict `verification` or by `user_id`.
+    `progress()` can be called from other threads while `run()` works. With
+    `dry_run` verdicts are judged and compared but not written."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, problem_id, language=None, verification=None, user_id=None,
+                 processes=processes, batch_size=batch_size, dry_run=False,
+                 max_changes=1000):
+        self.id = next(Rejudge._ids)
+        self.problem_id = int(problem_id)
+        self.language = language
+        self.verification = verification
+        self.user_id = user_id
+        self.processes = processes
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.max_changes = max_changes # Changed solutions listed in progress()
+        self.state = 'queued'
+        self.error = None
+        self.total = 0
+        self.done = 0
+        self.cached = 0
+        self.failed = 0 # Judging raised, verdict left as it was
+        self.transitions = collections.Counter() # (old, new) -> count
+        self.changes = []
+        self._started = None
+        self._finished = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """Stops after the current solution. Verdicts judged so far are
+        still written."""
+        self._cancelled = True
+
+    def running(self):
+        return self.state in ('queued', 'running')
+
+    def progress(self):
+        """Returns counts, rate, ETA (seconds) and the verdicts that changed
+        so far."""
+        with self._lock:
+            end = self._finished or time.monotonic()
+            elapsed = end - self._started if self._started else 0.0
+            rate = self.done / elapsed if elapsed else 0.0
+            eta = None
+            if self.state == 'running' and rate:
+                eta = (self.total - self.done) / rate
+            return {
+                'id': self.id,
+                'problem_id': self.problem_id,
+                'filters': {'language': self.language, 'verification': self.verification,
+                            'user': self.user_id},
+                'dry_run': self.dry_run,
+                'state': self.state,
+                'error': self.error,
+                'total': self.total,
+                'done': self.done,
+                'cached': self.cached,
+                'failed': self.failed,
+                'changed': sum(self.transitions.values()),
+                'elapsed': elapsed,
+                'rate': rate,
+                'eta': eta,
+                'transitions': {'{} -> {}'.format(old, new): count
+                                for (old, new), count in self.transitions.most_common()},
+                'changes': list(self.changes),
+            }
+
+    def run(self):
+        with self._lock:
+            self._started = time.monotonic()
+            self.state = 'running'
+        db_session = DBSession.session_factory()
+        pool = None
+        state = 'failed'
+        try:
+            problem = db_session.query(Problem).filter(
+                Problem.id == self.problem_id).first()
+            if problem is None:
+                raise ProblemNotFound(self.problem_id)
+            settings = (problem.timeout,) + problem.comparison()
+            fingerprints = problem.case_fingerprints()
+            cases = problem.cases()
+            self.total = self._solutions(db_session).count()
+            db_session.rollback()
+
+            pool = verify.JudgePool(self.processes, cases, *settings)
+            for batch in self._batches(db_session):
+                self._rejudge(db_session, pool, batch, fingerprints, settings)
+                if self._cancelled:
+                    break
+            state = 'cancelled' if self._cancelled else 'done'
+        except Exception as e:
+            self.error = '{}: {}'.format(type(e).__name__, e)
+            raise
+        finally:
+            if pool is not None:
+                pool.close()
+            db_session.close()
+            with self._lock:
+                self._finished = time.monotonic()
+                self.state = state
+
+    def _solutions(self, db_session):
+        query = db_session.query(
+            Solution.id, Solution.user_id, Solution.problem_id, Solution.language,
+            Solution.source, Solution.verification,
+        ).filter(
+            Solution.problem_id == self.problem_id,
+            Solution.verification != 'PENDING',
+        )
+        if self.language is not None:
+            query = query.filter(Solution.language == self.language)
+        if self.verification is not None:
+            query = query.filter(Solution.verification == self.verification)
+        if self.user_id is not None:
+            query = query.filter(Solution.user_id == self.user_id)
+        return query
+
+    def _batches(self, db_session):
+        """Yields the solutions in batches, ordered by id. Each batch is a
+        separate query, so no read transaction stays open while judging."""
+        last_id = 0
+        while True:
+            batch = (
+                self._solutions(db_session)
+                .filter(Solution.id > last_id)
+                .order_by(Solution.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            db_session.rollback()
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1].id
+
+    def _rejudge(self, db_session, pool, batch, fingerprints, settings):
+        keys = {solution.id: CachedVerdict.key(
+            solution.language, solution.source, fingerprints, *settings)
+            for solution in batch}
+        cached = {entry.cache_key: entry for entry in db_session.query(CachedVerdict)
+                  .filter(CachedVerdict.cache_key.in_(set(keys.values())))}
+        verdicts = {}
+        for solution in batch:
+            entry = cached.get(keys[solution.id])
+            if entry is not None:
+                verdicts[solution.id] = (entry.verification, entry.results(), entry.usage())
+        db_session.rollback()
+        with self._lock:
+            self.done += len(verdicts)
+            self.cached += len(verdicts)
+
+        tasks = [(solution.id, solution.language, solution.source)
+                 for solution in batch if solution.id not in verdicts]
+        for solution_id, verdict in pool.judge(tasks):
+            with self._lock:
+                self.done += 1
+                if verdict is None:
+                    self.failed += 1
+            if verdict is not None:
+                verdicts[solution_id] = tuple(verdict)
+            if self._cancelled:
+                break
+
+        solutions = [solution for solution in batch if solution.id in verdicts]
+        if self.dry_run:
+            previous = {solution.id: solution.verification for solution in solutions}
+        else:
+            previous = self._write(db_session, solutions, verdicts, keys, cached)
+        self._record_changes(solutions, verdicts, previous)
+
+    def _write(self, db_session, solutions, verdicts, keys, cached):
+        """Writes the verdicts of a batch in one transaction and returns the
+        verification each written solution had before. Solutions deleted or
+        resubmitted since they were read are left alone."""
+        previous = dict(
+            db_session.query(Solution.id, Solution.verification)
+            .filter(Solution.id.in_([solution.id for solution in solutions]))
+            .filter(Solution.verification != 'PENDING')
+        )
+        solutions = [solution for solution in solutions if solution.id in previous]
+        db_session.bulk_update_mappings(Solution, [dict(
+            id=solution.id, verification=verdicts[solution.id][0],
+            case_results=json.dumps(verdicts[solution.id][1]),
+            **Solution.usage_columns(verdicts[solution.id][2]))
+            for solution in solutions])
+
+        hits = {keys[solution.id] for solution in solutions if keys[solution.id] in cached}
+        if hits:
+            db_session.query(CachedVerdict).filter(CachedVerdict.cache_key.in_(hits)).update(
+                {'hits': CachedVerdict.hits + 1}, synchronize_session=False)
+        for solution in solutions:
+            if keys[solution.id] not in cached:
+                CachedVerdict.store(db_session, keys[solution.id], *verdicts[solution.id])
+
+        changed = [solution for solution in solutions
+                   if previous[solution.id] != verdicts[solution.id][0]]
+        for solution in changed:
+            record_verdict(db_session, solution, previous[solution.id],
+                           verdicts[solution.id][0])
+        versions = ['problem:{}'.format(self.problem_id)]
+        versions.extend('solution:{}'.format(solution.id) for solution in solutions)
+        versions.extend('user:{}'.format(user_id)
+                        for user_id in sorted({solution.user_id for solution in changed}))
+        EntityVersion.bump(db_session, *versions)
+        db_session.commit()
+        return previous
+
+    def _record_changes(self, solutions, verdicts, previous):
+        with self._lock:
+            for solution in solutions:
+                if solution.id not in previous:
+                    continue
+                old, new = previous[solution.id], verdicts[solution.id][0]
+                if old == new:
+                    continue
+                self.transitions[old, new] += 1
+                if len(self.changes) < self.max_changes:
+                    self.changes.append({
+                        'solution_id': solution.id,
+                        'user_id': solution.user_id,
+                        'language': solution.language,
+                        'old': old,
+                        'new': new,
+                    })
+
+
+# Rejudges started with `start`, by id. Finished ones are kept for their
+# results until `max_finished` newer ones finished.
+rejudges = collections.OrderedDict()
+max_finished = 20
+_rejudges_lock = threading.Lock()
+
+
+def start(problem_id, **options):
+    """Runs a `Rejudge` on a background thread and returns it. Raises
+    RejudgeRunning if the problem is already being rejudged."""
+    with _rejudges_lock:
+        for rejudge in rejudges.values():
+            if rejudge.problem_id == int(problem_id) and rejudge.running():
+                raise RejudgeRunning(rejudge.id)
+        rejudge = Rejudge(problem_id, **options)
+        rejudges[rejudge.id] = rejudge
+        finished = [r.id for r in rejudges.values() if not r.running()]
+        for rejudge_id in finished[:-max_finished]:
+            del rejudges[rejudge_id]
+
+    def run():
+        try:
+            rejudge.run()
+        except Exception:
+            traceback.print_exc()
+    threading.Thread(target=run, daemon=True).start()
+    return rejudge
+
+
+def format_progress(progress):
+    line = '{done}/{total} judged, {cached} cached, {failed} failed, {changed} changed, {rate:.1f}/s'.format(
+        **progress)
+    if progress['eta'] is not None:
+        line += ', ETA {:.0f}s'.format(progress['eta'])
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('problem_id', type=int)
+    parser.add_argument('--language')
+    parser.add_argument('--verification', help='only solutions with this verdict')
+    parser.add_argument('--user', help='only solutions by this user')
+    parser.add_argument('--processes', type=int, default=processes)
+    parser.add_argument('--batch-size', type=int, default=batch_size)
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report changed verdicts without writing them')
+    parser.add_argument('--interval', type=float, default=2,
+                        help='seconds between progress lines')
+    args = parser.parse_args()
+
+    init_db()
+    rejudge = Rejudge(
+        args.problem_id, args.language, args.verification, args.user,
+        args.processes, args.batch_size, args.dry_run, max_changes=sys.maxsize)
+    thread = threading.Thread(target=rejudge.run, daemon=True)
+    thread.start()
+    while thread.is_alive():
+        thread.join(args.interval)
+        print(format_progress(rejudge.progress()), flush=True)
+
+    progress = rejudge.progress()
+    for change in progress['changes']:
+        print('solution {solution_id} by {user_id} ({language}): {old} -> {new}'.format(
+            **change))
+    for transition, count in progress['transitions'].items():
+        print('{}: {}'.format(transition, count))
+    print('{} in {:.1f}s'.format(progress['state'], progress['elapsed']))
+    if progress['state'] != 'done':
+        if progress['error']:
+            print(progress['error'], file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
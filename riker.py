@@ -1,25 +1,111 @@
+if __name__ == '__main__':
+    # Patch before anything below creates locks, threads or sockets
+    import eventlet
+    eventlet.monkey_patch()
+
 import os
+import sys
+import hmac
+import signal
 import binascii
-import requests
+import json
+import time
+import hashlib
+import traceback
 from urllib.parse import urlencode, parse_qs
 
-from flask import Flask, request, session, render_template, redirect, \
-                  url_for, g, flash, abort
+from flask import Flask, Blueprint, request, session, render_template, redirect, \
+                  url_for, g, flash, abort, jsonify, make_response, Response, \
+                  has_request_context, current_app
 from flask_misaka import Misaka
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.orm import load_only, joinedload, contains_eager
 from urllib.parse import urlparse, urljoin
 from functools import wraps
-from models import DBSession, Problem, Solution, ProblemComment, SolutionComment
-from verify import supported_languages 
-
-
+import models
+from models import DBSession, Problem, TestCase, Solution, ProblemComment, \
+    SolutionComment, EntityVersion, ProblemStats, UserStats, VerificationJob, \
+    CachedVerdict, Verdict, record_verdict, record_problem_deleted, \
+    start_verification
+import rejudge
+from verify import supported_languages, get_executor
+from verify.compare import compare_modes
+from verify import stages
+from query_budget import QueryCounter
+from pagination import paginate, InvalidCursor, last_page
+from cache import LRUCache
+from uploads import check_text, store_text, InvalidUpload
+from metrics import Registry, content_type as metrics_content_type
+
+
+
+markdown_renderer = Misaka() # Used by the cached markdown filter below
+
+
+def config_from_env(environ=os.environ):
+    """Returns the app settings given in the environment."""
+    web_workers = int(environ.get('WEB_WORKERS', 1))
+    return {
+        'SECRET_KEY': environ.get('SECRET_KEY', 'development_key'),
+        'DATABASE_URL': environ.get('DATABASE_URL', 'sqlite:///riker.db'), # See database.py
+        'BLOB_DIR': environ.get('BLOB_DIR', 'blobs'), # Test data, see blobstore.py
+        'MAX_CONTENT_LENGTH': 1024 * 1024, # 1 MiB request size limit
+        # Size limit of new problems only, their test data files are
+        # streamed to disk (see uploads.py)
+        'MAX_UPLOAD_LENGTH': int(environ.get('MAX_UPLOAD_MB', 512)) * 1024 * 1024,
+        'PAGE_SIZE': int(environ.get('PAGE_SIZE', 50)),
+        'LEADERBOARD_SIZE': int(environ.get('LEADERBOARD_SIZE', 100)),
+        'FASTEST_SIZE': int(environ.get('FASTEST_SIZE', 20)),
+        'SSE_HEARTBEAT': int(environ.get('SSE_HEARTBEAT', 15)), # seconds
+        'SSE_TIMEOUT': int(environ.get('SSE_TIMEOUT', 300)), # seconds
+        # Seconds between database checks of event streams, for verdicts
+        # written by other processes. 0 relies on in-process events only.
+        'SSE_POLL': float(environ.get('SSE_POLL', 2 if web_workers > 1 else 0)),
+        # Requests slower than this are logged, 0 disables the log
+        'SLOW_REQUEST_SECONDS': float(environ.get('SLOW_REQUEST_SECONDS', 0)),
+        # Users allowed to rejudge any problem, besides its author
+        'ADMIN_USERS': set(filter(None, environ.get('ADMIN_USERS', '').split(','))),
+        # Shared secret of judge_worker.py processes, the judge API is off without it
+        'JUDGE_TOKEN': environ.get('JUDGE_TOKEN'),
+        'JUDGE_MAX_WAIT': float(environ.get('JUDGE_MAX_WAIT', 30)), # seconds
+        # GitHub login is off without them
+        'GITHUB_CLIENT_ID': environ.get('GITHUB_CLIENT_ID'),
+        'GITHUB_CLIENT_SECRET': environ.get('GITHUB_CLIENT_SECRET'),
+        # Set up the database at DATABASE_URL (see models.init_db) if
+        # create_app finds it isn't yet, and migrate it then
+        'INIT_DB': True,
+        'MIGRATE_SCHEMA': True,
+    }
 
-app = Flask(__name__)
-Misaka(app) # Load Misaka extension (used for jinja2 markdown filter)
-app.secret_key = 'development_key'
 
-app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 # 1 MiB filesize limit
-app.config['GITHUB_CLIENT_ID'] = os.environ['GITHUB_CLIENT_ID']
-app.config['GITHUB_CLIENT_SECRET'] = os.environ['GITHUB_CLIENT_SECRET']
+# Views, request hooks and template helpers, registered on every app made
+# by create_app
+bp = Blueprint('riker', __name__)
+
+
+def create_app(config=None):
+    """Returns the app configured from the environment, with `config`
+    overriding it. Importing this module leaves the database alone, the
+    first app sets it up at DATABASE_URL (see INIT_DB), as does an app
+    given another DATABASE_URL. The blob store, scheduler and other
+    settings read by `models.init_db` are then taken from the app config
+    too, falling back to the environment. Monkey patching is left to the
+    caller, see `serve`."""
+    app = Flask(__name__)
+    app.config.update(config_from_env())
+    app.config.update(config or {})
+    app.register_blueprint(bp)
+    url = app.config['DATABASE_URL']
+    if app.config['INIT_DB'] and (models.engine is None or
+            models.engine.url.render_as_string(hide_password=False) != url):
+        models.init_db(dict(os.environ, **app.config),
+                       migrate_schema=app.config['MIGRATE_SCHEMA'])
+    if models.engine is not None and not event.contains(
+            models.engine, 'before_cursor_execute', start_sql_timer):
+        event.listen(models.engine, 'before_cursor_execute', start_sql_timer)
+        event.listen(models.engine, 'after_cursor_execute', record_sql_time)
+    return app
 
 
 #############################
@@ -41,9 +127,133 @@ def close_db_session():
         delattr(g, 'db_session')
 
 
-@app.after_request
+@bp.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+
+
+@bp.before_app_request
+def start_query_count():
+    if current_app.config.get('ENFORCE_QUERY_BUDGETS'):
+        g.query_counter = QueryCounter(models.engine).start()
+
+
+@bp.after_app_request
 def after_request(response):
     close_db_session()
+    record_request(response)
+    check_query_budget()
+    return response
+
+
+def record_request(response):
+    """Records the request's latency and SQL statements in the metrics,
+    and logs it if it took longer than SLOW_REQUEST_SECONDS."""
+    if 'request_start' not in g:
+        return
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'none'
+    request_duration.observe(
+        elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    request_sql_statements.observe(g.sql_statements, endpoint=endpoint)
+    request_sql_duration.observe(g.sql_seconds, endpoint=endpoint)
+    slow = current_app.config['SLOW_REQUEST_SECONDS']
+    if slow and elapsed >= slow:
+        current_app.logger.warning(
+            'Slow request: %s %s returned %s in %.3fs, %d SQL statements took %.3fs',
+            request.method, request.full_path.rstrip('?'), response.status_code, elapsed,
+            g.sql_statements, g.sql_seconds)
+
+
+def check_query_budget():
+    """Fails the request if its view issued more SQL statements than the
+    budget declared with `query_budget`."""
+    counter = g.pop('query_counter', None)
+    if counter is None:
+        return
+    counter.stop()
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None)
+    if budget is not None:
+        counter.check(budget, request.endpoint)
+
+
+def query_budget(budget):
+    """Decorator declaring the maximum number of SQL statements a view may
+    issue. Checked only when the ENFORCE_QUERY_BUDGETS setting is set,
+    e.g. in tests. Must be applied directly below @bp.route."""
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+
+def paginate_list(query, model, name):
+    """Returns the page of `query` selected by the `<name>_after` or
+    `<name>_before` cursor in the query string."""
+    try:
+        return paginate(
+            query, model, name, current_app.config['PAGE_SIZE'],
+            after=request.args.get(name + '_after'),
+            before=request.args.get(name + '_before'))
+    except InvalidCursor:
+        abort(400)
+
+
+@bp.app_template_global()
+def page_url(page, direction):
+    """URL of the current view showing the page after (`direction` is
+    'after') or before ('before') `page`, keeping other lists' cursors."""
+    args = request.args.to_dict()
+    args.pop(page.name + '_after', None)
+    args.pop(page.name + '_before', None)
+    args[page.name + '_' + direction] = page.next if direction == 'after' else page.prev
+    args.update(request.view_args)
+    return url_for(request.endpoint, **args)
+
+
+# Rendered page fragments, keyed by everything they depend on, including
+# the entity versions, so a write makes them unreachable
+fragment_cache = LRUCache(int(os.environ.get('FRAGMENT_CACHE_SIZE', 1000)))
+
+
+def cached_fragment(key, render):
+    """Returns the HTML string returned by render(), cached under `key`."""
+    return Markup(fragment_cache.load(key, render))
+
+
+def conditional_response(keys, render):
+    """Renders a page whose content depends only on the entities `keys`
+    (see EntityVersion), the logged in user and the URL. The ETag and
+    Last-Modified headers are derived from those, and if the client's copy
+    is current the page isn't rendered at all and 304 is returned.
+    `render(versions)` gets the {key: version} dict, for fragment keys.
+
+    Pages showing one-off session state (form validation, comment
+    previews) are always rendered and not cached by the client."""
+    versions, last_modified = EntityVersion.get(get_db_session(), keys)
+    if 'validation' in session or 'form_cache' in session:
+        return render(versions)
+    etag = hashlib.sha1(repr((
+        request.full_path, session.get('logged_in_user'),
+        sorted(versions.items()), current_app.config['PAGE_SIZE'])).encode('utf-8')).hexdigest()
+    if last_modified is not None:
+        last_modified = last_modified.replace(microsecond=0)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = (last_modified is not None and
+                        request.if_modified_since is not None and
+                        last_modified <= request.if_modified_since.replace(tzinfo=None))
+    response = current_app.response_class(status=304) if not_modified \
+        else make_response(render(versions))
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True # Revalidate on every view
     return response
 
 
@@ -53,20 +263,112 @@ def requires_login(view):
     @wraps(view)
     def decorator(*args, **kwargs):
         if 'logged_in_user' not in session:
-            return redirect(url_for('login', redirect_url=request.url))
+            return redirect(url_for('.login', redirect_url=request.url))
         return view(*args, **kwargs)
     return decorator
 
 
 
+#############################
+### Metrics
+#############################
+
+# Served at /metrics, see metrics.py
+metrics = Registry()
+
+request_duration = metrics.histogram(
+    'riker_request_duration_seconds', 'Time to handle a request, by view.',
+    labels=('endpoint', 'method', 'status'))
+request_sql_statements = metrics.histogram(
+    'riker_request_sql_statements', 'SQL statements issued per request, by view.',
+    labels=('endpoint',), buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128))
+request_sql_duration = metrics.histogram(
+    'riker_request_sql_duration_seconds', 'Time spent in SQL per request, by view.',
+    labels=('endpoint',))
+sql_statements = metrics.counter(
+    'riker_sql_statements_total',
+    'SQL statements executed, by requests or in the background (judging).',
+    labels=('source',))
+sql_duration = metrics.counter(
+    'riker_sql_duration_seconds_total',
+    'Time spent in SQL, by requests or in the background (judging).',
+    labels=('source',))
+
+judge_stage_duration = metrics.histogram(
+    'verify_stage_duration_seconds',
+    'Time spent in each stage of judging a test case, see verify/stages.py.',
+    labels=('stage',))
+stages.add_listener(
+    lambda stage, seconds: judge_stage_duration.observe(seconds, stage=stage))
+
+def scheduler_stat(name):
+    return lambda: Solution._verify_scheduler.stats()[name]
+
+metrics.gauge('verify_queue_depth', 'Verification jobs waiting for a worker.',
+              scheduler_stat('queue_depth'))
+metrics.gauge('verify_workers', 'Verification workers.', scheduler_stat('workers'))
+metrics.gauge('verify_workers_busy', 'Verification workers judging a job.',
+              scheduler_stat('running'))
+metrics.gauge('verify_queue_wait_p95_seconds',
+              '95th percentile of recent queue wait times.', scheduler_stat('wait_p95'))
+metrics.gauge('verify_pool_sandboxes_busy', 'Pooled sandboxes running a job.',
+              lambda: get_executor().stats().get('busy'))
+metrics.gauge('verify_pool_utilization', 'Fraction of pooled sandboxes running a job.',
+              lambda: get_executor().stats().get('utilization'))
+metrics.gauge('riker_db_connections_checked_out',
+              'Database connections in use, for pools that track them.',
+              lambda: models.engine.pool.checkedout()
+              if hasattr(models.engine.pool, 'checkedout') else None)
+metrics.gauge('verify_verdicts_pending', 'Verdicts waiting to be written.',
+              lambda: models.verdict_writer.stats()['pending'])
+metrics.gauge('riker_verdict_subscribers', 'Open verdict event streams.',
+              lambda: Solution.verdict_events.stats()['subscribers'])
+
+def cache_stats(name):
+    def collect():
+        caches = {
+            'solved': Problem.solved_cache,
+            'markdown': markdown_cache,
+            'fragment': fragment_cache,
+        }
+        return {(cache,): c.stats()[name] for cache, c in caches.items()}
+    return collect
+
+metrics.gauge('riker_cache_entries', 'Entries in the in-process caches.',
+              cache_stats('entries'), labels=('cache',))
+metrics.gauge('riker_cache_hit_ratio', 'Hit rate of the in-process caches.',
+              cache_stats('hit_rate'), labels=('cache',))
+
+
+# Listening on the engine, see create_app
+def start_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_start = time.perf_counter()
+
+
+def record_sql_time(conn, cursor, statement, parameters, context, executemany):
+    if context is None or not hasattr(context, 'metrics_start'):
+        return
+    elapsed = time.perf_counter() - context.metrics_start
+    source = 'background'
+    if has_request_context() and 'request_start' in g:
+        source = 'request'
+        g.sql_statements += 1
+        g.sql_seconds += elapsed
+    sql_statements.inc(source=source)
+    sql_duration.inc(elapsed, source=source)
+
+
+
 #############################
 ### Views
 #############################
 
 def handle_github_login(session_code):
+    import requests # Slow to import and only needed here
     data = {
-        'client_id': app.config['GITHUB_CLIENT_ID'],
-        'client_secret': app.config['GITHUB_CLIENT_SECRET'],
+        'client_id': current_app.config['GITHUB_CLIENT_ID'],
+        'client_secret': current_app.config['GITHUB_CLIENT_SECRET'],
         'code': session_code,
         'state': session.get('state', '')
     }
@@ -78,113 +380,195 @@ def handle_github_login(session_code):
             'https://api.github.com/user', 
             params={'access_token': access_token})
     session['logged_in_user'] = result.json()['login']
-    return redirect(session.pop('redirect_url', url_for('home')))
+    return redirect(session.pop('redirect_url', url_for('.home')))
 
 
-@app.route('/', methods=['GET'])
+@bp.route('/', methods=['GET'])
+@query_budget(2)
 def home():
     # Handle github login request
     if 'code' in request.args:
         return handle_github_login(request.args['code'])
 
     db_session = get_db_session()
-    problems = db_session.query(Problem).all()
-    return render_template('home.html', problems=problems)
-
-
-@app.route('/login', methods=['GET'])
+    def render_problem_list():
+        problems = paginate_list(
+            db_session.query(Problem)
+            .options(load_only(Problem.id, Problem.title, Problem.submission_time)),
+            Problem, 'problems')
+        return render_template('problem-list.html', problems=problems)
+    def render(versions):
+        problem_list = cached_fragment(
+            ('problem-list', versions['problems'], request.query_string),
+            render_problem_list)
+        return render_template('home.html', problem_list=problem_list)
+    return conditional_response(['problems'], render)
+
+
+@bp.route('/login', methods=['GET'])
 def login():
+    if not current_app.config['GITHUB_CLIENT_ID']:
+        abort(404)
     state = binascii.hexlify(os.urandom(32)).decode('utf-8')
-    session['redirect_url'] = request.args.get('redirect_url', url_for('home'))
+    session['redirect_url'] = request.args.get('redirect_url', url_for('.home'))
     session['state'] = state
     query = {
-        'client_id': app.config['GITHUB_CLIENT_ID'],
+        'client_id': current_app.config['GITHUB_CLIENT_ID'],
         'state': state
     }
     return redirect(
         'https://github.com/login/oauth/authorize/?' + urlencode(query))
         
 
-@app.route('/logout', methods=['POST'])
+@bp.route('/logout', methods=['POST'])
 def logout():
     session.pop('logged_in_user', None)
-    return redirect(url_for('home'))
+    return redirect(url_for('.home'))
 
 
-@app.route('/user/<user_id>', methods=['GET'])
+@bp.route('/user/<user_id>', methods=['GET'])
+@query_budget(3)
 def view_user(user_id):
+    # Deleting a problem also deletes other users' solutions to it
+    return conditional_response(
+        ['problems', 'user:' + user_id], lambda versions: render_user(user_id))
+
+
+def render_user(user_id):
     db_session = get_db_session()
-    problems = (
+    problems = paginate_list(
         db_session.query(Problem)
-        .filter(Problem.user_id==user_id)
-        .all()
-    )
-    solutions = (
+        .options(load_only(Problem.id, Problem.title, Problem.submission_time))
+        .filter(Problem.user_id==user_id),
+        Problem, 'problems')
+    # Problem titles are joined in rather than lazy loaded per solution
+    solutions = paginate_list(
         db_session.query(Solution)
-        .filter(Solution.user_id==user_id)
-        .all()
-    )
+        .join(Solution.problem)
+        .options(
+            load_only(Solution.id, Solution.problem_id, Solution.submission_time),
+            contains_eager(Solution.problem).load_only(Problem.id, Problem.title))
+        .filter(Solution.user_id==user_id),
+        Solution, 'solutions')
     return render_template(
         'user.html', user_id=user_id, problems=problems, solutions=solutions)
 
 
-@app.route('/problem', methods=['GET'])
+@bp.route('/problem', methods=['GET'])
 @requires_login
 def problem_form():
-    return render_template('problem-form.html', validation={}, form_cache={}, preview=False)
+    return render_template(
+        'problem-form.html', validation={}, form_cache={}, preview=False,
+        compare_modes=compare_modes)
 
 
-@app.route('/problem', methods=['POST'])
+@bp.route('/problem', methods=['POST'])
 def create_problem():
+    # Checked before the body is read, so anonymous requests keep the 1 MiB
+    # limit and the test data of logged in users only is spooled to disk
+    if not 'logged_in_user' in session:
+        abort(401)
+    request.max_content_length = current_app.config['MAX_UPLOAD_LENGTH']
     db_session = get_db_session()
     title = request.form.get('title', '').strip()
     prompt = request.form.get('prompt', '').strip()
-    test_input_file = request.files.get('test-input-file', None)
-    test_output_file = request.files.get('test-output-file', None)
+    # Test cases are paired up by the sorted filenames of the input and
+    # output files, e.g. 01.in with 01.out
+    test_input_files = sorted(
+        (f for f in request.files.getlist('test-input-file') if f),
+        key=lambda f: f.filename)
+    test_output_files = sorted(
+        (f for f in request.files.getlist('test-output-file') if f),
+        key=lambda f: f.filename)
     timeout = int(request.form.get('timeout', 3))
+    compare_mode = request.form.get('compare-mode', 'exact')
+    float_epsilon = request.form.get('float-epsilon', '1e-6').strip()
 
     form_cache = { 
         'title': title, 
         'prompt': prompt, 
-        'timeout': timeout 
+        'timeout': timeout,
+        'compare_mode': compare_mode,
+        'float_epsilon': float_epsilon,
     }
 
     validation = {}
-    if not 'logged_in_user' in session:
-        abort(401)
     if not title:
         validation['title'] = { 'level': 'error', 'msg': 'Field Required'}
     if not prompt:
         validation['prompt'] = { 'level': 'error', 'msg': 'Field required' }
-    if not test_input_file:
+    if not test_input_files:
         validation['test_input_file'] = { 'level': 'error', 'msg': 'Field required' }
-    if not test_output_file:
+    if not test_output_files:
         validation['test_output_file'] = { 'level': 'error', 'msg': 'Field required' }
+    elif len(test_input_files) != len(test_output_files):
+        validation['test_output_file'] = {
+            'level': 'error', 'msg': 'Need one output file per input file' }
     if not 3 <= timeout <= 10:
         abort(400)
+    if compare_mode not in compare_modes:
+        abort(400)
+    try:
+        float_epsilon = float(float_epsilon)
+    except ValueError:
+        validation['float_epsilon'] = { 'level': 'error', 'msg': 'Must be a number' }
+    else:
+        # Nothing would ever match a negative or NaN tolerance
+        if not 0 <= float_epsilon < float('inf'):
+            validation['float_epsilon'] = {
+                'level': 'error', 'msg': 'Must be a non-negative, finite number' }
 
     if 'preview' in request.form:
         return render_template(
-            'problem-form.html', form_cache=form_cache, preview=True)
+            'problem-form.html', validation={}, form_cache=form_cache, preview=True,
+            compare_modes=compare_modes)
 
     if validation:
         return render_template(
-            'problem-form.html', validation=validation, form_cache=form_cache)
+            'problem-form.html', validation=validation, form_cache=form_cache,
+            compare_modes=compare_modes)
 
     problem = Problem(
-        title=title, prompt=prompt, 
-        test_input=test_input_file.read().decode('utf-8')[:-1], # remove trailing newline
-        test_output=test_output_file.read().decode('utf-8')[:-1], # remove trailing newline 
-        timeout=timeout, user_id=session['logged_in_user'])
+        title=title, prompt=prompt, timeout=timeout,
+        compare_mode=compare_mode, float_epsilon=float_epsilon,
+        user_id=session['logged_in_user'])
+    try:
+        for test_file in test_input_files + test_output_files:
+            check_text(test_file.stream, test_file.filename)
+    except InvalidUpload as e:
+        validation['test_input_file'] = { 'level': 'error', 'msg': str(e) }
+        return render_template(
+            'problem-form.html', validation=validation, form_cache=form_cache,
+            compare_modes=compare_modes)
+    for position, (test_input_file, test_output_file) in enumerate(
+            zip(test_input_files, test_output_files)):
+        problem.test_cases.append(TestCase(
+            position=position,
+            input_blob=store_text(
+                models.blob_store, test_input_file.stream, test_input_file.filename),
+            output_blob=store_text(
+                models.blob_store, test_output_file.stream, test_output_file.filename)))
     db_session.add(problem)
+    db_session.flush()
+    EntityVersion.bump(
+        db_session, 'problems', 'problem:{}'.format(problem.id),
+        'user:' + problem.user_id)
     db_session.commit()
 
-    return redirect(url_for('view_problem', problem_id=problem.id))
+    return redirect(url_for('.view_problem', problem_id=problem.id))
     
 
 
-@app.route('/problem/<problem_id>', methods=['GET'])
+@bp.route('/problem/<int:problem_id>', methods=['GET'])
+@query_budget(6)
 def view_problem(problem_id):
+    keys = ['problem:{}'.format(problem_id)]
+    if 'logged_in_user' in session: # Whether the user solved it
+        keys.append('user:' + session['logged_in_user'])
+    return conditional_response(keys, lambda versions: render_problem(problem_id, versions))
+
+
+def render_problem(problem_id, versions):
     db_session = get_db_session()
     problem = (
         db_session.query(Problem)
@@ -193,26 +577,34 @@ def view_problem(problem_id):
     )
     if problem is None:
         abort(404)
-    solutions = (
+    solutions = paginate_list(
         db_session.query(Solution)
+        .options(load_only(
+            Solution.id, Solution.user_id, Solution.language, Solution.submission_time))
         .filter(Solution.problem_id==problem_id)
-        .filter(Solution.verification=='PASS')
-        .order_by(Solution.submission_time)
-        .all()
-    )
-    comments = (
-        db_session.query(ProblemComment)
-        .filter(ProblemComment.problem_id==problem_id)
-        .order_by(ProblemComment.submission_time)
-        .all()
-    )
-    solved = 'logged_in_user' in session and problem.solved_by(db_session, session['logged_in_user'])
+        .filter(Solution.verification=='PASS'),
+        Solution, 'solutions')
+    def render_comments():
+        comments = paginate_list(
+            db_session.query(ProblemComment)
+            .filter(ProblemComment.problem_id==problem_id),
+            ProblemComment, 'comments')
+        return render_template('problem-comments.html', comments=comments)
+    comment_thread = cached_fragment(
+        ('problem-comments', problem_id, versions['problem:{}'.format(problem_id)],
+         session.get('logged_in_user'), request.query_string),
+        render_comments)
+    solved = ('logged_in_user' in session and
+              problem.id in Problem.solved_ids(
+                  db_session, session['logged_in_user'],
+                  versions['user:' + session['logged_in_user']]))
+    stats = db_session.query(ProblemStats).get(problem.id)
     return render_template(
         'view-problem.html', problem=problem, solutions=solutions, 
-        comments=comments, solved=solved)
+        comment_thread=comment_thread, solved=solved, stats=stats)
 
 
-@app.route('/problem/<problem_id>', methods=['POST']) # html forms don't support delete
+@bp.route('/problem/<int:problem_id>', methods=['POST']) # html forms don't support delete
 @requires_login
 def delete_problem(problem_id):
     """Deletes problem and all associated comments/solutions form database"""
@@ -231,13 +623,21 @@ def delete_problem(problem_id):
         .filter(Solution.problem_id == problem_id)
         .all()
     )
+    forget_markdown(problem.prompt)
     db_session.delete(problem)
     for solution in solutions:
         db_session.delete(solution)
-    return redirect(url_for('home'))
+    db_session.flush()
+    record_problem_deleted(db_session, problem.id)
+    EntityVersion.bump(
+        db_session, 'problems', 'problem:{}'.format(problem_id),
+        *['solution:{}'.format(solution.id) for solution in solutions] +
+        sorted({'user:' + solution.user_id for solution in solutions}))
+    db_session.commit()
+    return redirect(url_for('.home'))
 
 
-@app.route('/problem/<problem_id>/solution', methods=['GET'])
+@bp.route('/problem/<int:problem_id>/solution', methods=['GET'])
 @requires_login
 def solution_form(problem_id):
     db_session = get_db_session()
@@ -253,7 +653,7 @@ def solution_form(problem_id):
         supported_languages=supported_languages)
 
 
-@app.route('/problem/<problem_id>/solution', methods=['POST'])
+@bp.route('/problem/<int:problem_id>/solution', methods=['POST'])
 @requires_login
 def create_solution(problem_id):
     db_session = get_db_session()
@@ -265,10 +665,6 @@ def create_solution(problem_id):
     if problem is None:
         abort(404)
 
-    ### DEBUG
-    print(problem.test_input)
-    ###
-    
     source_file = request.files.get('source-file', None)
     language = request.form.get('language', None)
 
@@ -291,40 +687,120 @@ def create_solution(problem_id):
         language=language, source=source_file.read().decode('utf-8'), 
         verification='PENDING')
     db_session.add(solution)
+    EntityVersion.bump(db_session, 'user:' + solution.user_id)
     db_session.commit()
     solution.verify() # Launch verification thread
 
     return redirect(url_for(
-        'view_solution', problem_id=problem_id, solution_id=solution.id))
+        '.view_solution', problem_id=problem_id, solution_id=solution.id))
 
     
 
 
-@app.route('/problem/<problem_id>/solution/<solution_id>', methods=['GET'])
+@bp.route('/problem/<int:problem_id>/solution/<int:solution_id>', methods=['GET'])
+@query_budget(4)
 @requires_login
 def view_solution(problem_id, solution_id):
+    return conditional_response(
+        ['solution:{}'.format(solution_id), 'user:' + session['logged_in_user']],
+        lambda versions: render_solution(solution_id, versions))
+
+
+def render_solution(solution_id, versions):
     db_session = get_db_session()
     solution = (
         db_session.query(Solution)
+        .options(joinedload(Solution.problem).load_only(
+            Problem.id, Problem.title, Problem.user_id))
         .filter(Solution.id==solution_id)
         .first()
     ) 
     if solution is None:
         abort(404)
-    comments = (
+    comments = paginate_list(
         db_session.query(SolutionComment)
-        .filter(SolutionComment.solution_id==solution_id)
-        .order_by(SolutionComment.submission_time)
-        .all()
-    )
+        .filter(SolutionComment.solution_id==solution_id),
+        SolutionComment, 'comments')
     user = session['logged_in_user']
-    solution_viewable = (solution.user_id == user) or (solution.problem.solved_by(db_session, user))
+    solution_viewable = (
+        solution.user_id == user or
+        solution.problem_id in Problem.solved_ids(db_session, user, versions['user:' + user]))
     return render_template(
         'view-solution.html', problem=solution.problem, solution=solution, 
         comments=comments, solution_viewable=solution_viewable)
 
 
-@app.route('/problem/<problem_id>/solution/<solution_id>', methods=['POST']) # html forms don't support delete
+@bp.route('/problem/<int:problem_id>/solution/<int:solution_id>/events', methods=['GET'])
+@query_budget(1)
+@requires_login
+def solution_events(problem_id, solution_id):
+    """Server-Sent Events stream sending a `verdict` event once the
+    solution has been judged, then closing. Sends a comment line every
+    SSE_HEARTBEAT seconds to keep proxies from dropping the connection and
+    gives up after SSE_TIMEOUT seconds; browsers then reconnect. With
+    SSE_POLL the database is checked as well, since verdicts judged by
+    other web workers are only published in their process."""
+    # Subscribe before reading the verdict, so one written in between
+    # isn't missed
+    subscription = Solution.verdict_events.subscribe('solution:{}'.format(solution_id))
+    solution = (
+        get_db_session().query(Solution)
+        .options(load_only(Solution.id, Solution.verification, Solution.case_results))
+        .filter(Solution.id==solution_id)
+        .first()
+    )
+    if solution is None:
+        subscription.close()
+        abort(404)
+    current = None
+    if solution.verification != 'PENDING':
+        current = {'verification': solution.verification, 'results': solution.results()}
+    heartbeat = current_app.config['SSE_HEARTBEAT']
+    poll = current_app.config['SSE_POLL']
+    deadline = time.monotonic() + current_app.config['SSE_TIMEOUT']
+
+    def stream():
+        message = current
+        next_heartbeat = time.monotonic() + heartbeat
+        while message is None:
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            wake = min(next_heartbeat, deadline, now + poll if poll else deadline)
+            message = subscription.get(timeout=wake - now)
+            if message is None and poll:
+                message = stored_verdict(solution_id)
+            if message is None and time.monotonic() >= next_heartbeat:
+                next_heartbeat = time.monotonic() + heartbeat
+                yield ': heartbeat\n\n' # Fails once the client is gone
+        yield 'event: verdict\ndata: {}\n\n'.format(json.dumps(message))
+
+    response = Response(stream(), mimetype='text/event-stream')
+    response.call_on_close(subscription.close)
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no' # Don't buffer in nginx
+    return response
+
+
+def stored_verdict(solution_id):
+    """Returns the event message of a judged solution, or None while it is
+    pending. Runs after the request ended, so uses its own session."""
+    db_session = DBSession.session_factory()
+    try:
+        solution = (
+            db_session.query(Solution)
+            .options(load_only(Solution.id, Solution.verification, Solution.case_results))
+            .filter(Solution.id==solution_id)
+            .first()
+        )
+        if solution is None or solution.verification == 'PENDING':
+            return None
+        return {'verification': solution.verification, 'results': solution.results()}
+    finally:
+        db_session.close()
+
+
+@bp.route('/problem/<int:problem_id>/solution/<int:solution_id>', methods=['POST']) # html forms don't support delete
 @requires_login
 def delete_solution(problem_id, solution_id):
     db_session = get_db_session()
@@ -338,10 +814,16 @@ def delete_solution(problem_id, solution_id):
     elif solution.user_id != session['logged_in_user']:
         abort(401)
     db_session.delete(solution)
-    return redirect(url_for('home'))
+    db_session.flush()
+    record_verdict(db_session, solution, solution.verification, None)
+    EntityVersion.bump(
+        db_session, 'problem:{}'.format(solution.problem_id),
+        'solution:{}'.format(solution_id), 'user:' + solution.user_id)
+    db_session.commit()
+    return redirect(url_for('.home'))
 
 
-@app.route('/problem/<problem_id>/comment', methods=['POST'])
+@bp.route('/problem/<int:problem_id>/comment', methods=['POST'])
 @requires_login
 def create_problem_comment(problem_id):
     db_session = get_db_session()
@@ -356,21 +838,24 @@ def create_problem_comment(problem_id):
     if 'preview' in request.form:
         session['form_cache'] = { 'body': body }
         return redirect(url_for(
-            'view_problem', problem_id=problem_id, _anchor="comment-form", preview=True))
+            '.view_problem', problem_id=problem_id, _anchor="comment-form", preview=True))
 
     if validation:
         session['validation'] = validation
         return redirect(url_for(
-            'view_problem', problem_id=problem_id, _anchor="comment-form"))
+            '.view_problem', problem_id=problem_id, _anchor="comment-form"))
 
     comment = ProblemComment(
         problem_id=problem_id, user_id=session['logged_in_user'], body=body)
     db_session.add(comment)
-    return redirect(url_for('view_problem', problem_id=problem_id))
+    EntityVersion.bump(db_session, 'problem:{}'.format(problem_id))
+    return redirect(url_for(
+        '.view_problem', problem_id=problem_id, comments_before=last_page,
+        _anchor='comments'))
 
     
 
-@app.route('/problem-comment/<comment_id>/', methods=['POST']) # html forms don't support delete
+@bp.route('/problem-comment/<int:comment_id>/', methods=['POST']) # html forms don't support delete
 @requires_login
 def delete_problem_comment(comment_id):
     db_session = get_db_session()
@@ -386,10 +871,12 @@ def delete_problem_comment(comment_id):
 
     problem_id = comment.problem_id
     db_session.delete(comment)
-    return redirect(url_for('view_problem', problem_id=problem_id))
+    EntityVersion.bump(db_session, 'problem:{}'.format(problem_id))
+    forget_markdown(comment.body)
+    return redirect(url_for('.view_problem', problem_id=problem_id))
 
 
-@app.route('/problem/<problem_id>/solution/<solution_id>/comment', methods=['POST'])
+@bp.route('/problem/<int:problem_id>/solution/<int:solution_id>/comment', methods=['POST'])
 @requires_login
 def create_solution_comment(problem_id, solution_id):
     db_session = get_db_session()
@@ -406,24 +893,26 @@ def create_solution_comment(problem_id, solution_id):
     if 'preview' in request.form:
         session['form_cache'] = { 'body': body }
         return redirect(url_for(
-            'view_solution', problem_id=problem_id, solution_id=solution_id,
+            '.view_solution', problem_id=problem_id, solution_id=solution_id,
             _anchor="comment-form", preview=True))
 
     if validation:
         session['validation'] = validation
         return redirect(url_for(
-            'view_solution', problem_id=problem_id, solution_id=solution_id, 
+            '.view_solution', problem_id=problem_id, solution_id=solution_id, 
             _anchor="comment-form"))
 
     comment = SolutionComment(
         solution_id=solution_id, user_id=session['logged_in_user'], body=body)
     db_session.add(comment)
+    EntityVersion.bump(db_session, 'solution:{}'.format(solution_id))
 
     return redirect(url_for(
-        'view_solution', problem_id=problem_id, solution_id=solution_id))
+        '.view_solution', problem_id=problem_id, solution_id=solution_id,
+        comments_before=last_page, _anchor='comments'))
 
 
-@app.route('/solution-comment/<comment_id>/delete', methods=['POST']) # html form don't support DELETE
+@bp.route('/solution-comment/<int:comment_id>/delete', methods=['POST']) # html form don't support DELETE
 @requires_login
 def delete_solution_comment(comment_id):
     db_session = get_db_session()
@@ -445,8 +934,311 @@ def delete_solution_comment(comment_id):
         .problem_id
     )
     db_session.delete(comment)
+    EntityVersion.bump(db_session, 'solution:{}'.format(solution_id))
+    forget_markdown(comment.body)
+    return redirect(url_for(
+        '.view_solution', problem_id=problem_id, solution_id=solution_id))
+
+
+
+@bp.route('/leaderboard', methods=['GET'])
+@query_budget(1)
+def leaderboard():
+    """Users ranked by problems solved, read from the `user_stats`
+    aggregate table."""
+    users = UserStats.leaderboard(get_db_session(), current_app.config['LEADERBOARD_SIZE'])
+    return render_template('leaderboard.html', users=users)
+
+
+@bp.route('/problem/<int:problem_id>/fastest', methods=['GET'])
+@query_budget(3)
+def fastest_solutions(problem_id):
+    """Passing solutions of a problem ranked by CPU time, then peak
+    memory."""
+    return conditional_response(
+        ['problem:{}'.format(problem_id)], lambda versions: render_fastest(problem_id))
+
+
+def render_fastest(problem_id):
+    db_session = get_db_session()
+    problem = (
+        db_session.query(Problem)
+        .options(load_only(Problem.id, Problem.title))
+        .filter(Problem.id==problem_id)
+        .first()
+    )
+    if problem is None:
+        abort(404)
+    solutions = Solution.fastest(db_session, problem.id, current_app.config['FASTEST_SIZE'])
+    return render_template('fastest.html', problem=problem, solutions=solutions)
+
+
+def requires_problem_admin(problem_id):
+    """Aborts unless the logged in user wrote the problem or is one of
+    ADMIN_USERS."""
+    problem = (
+        get_db_session().query(Problem)
+        .options(load_only(Problem.id, Problem.user_id))
+        .filter(Problem.id==problem_id)
+        .first()
+    )
+    if problem is None:
+        abort(404)
+    user_id = session['logged_in_user']
+    if user_id != problem.user_id and user_id not in current_app.config['ADMIN_USERS']:
+        abort(401)
+
+
+@bp.route('/problem/<int:problem_id>/rejudge', methods=['POST'])
+@requires_login
+def start_rejudge(problem_id):
+    """Re-verifies the problem's solutions in the background, optionally
+    only those matching the `language`, `verification` and `user` form
+    fields. Redirects to the rejudge's progress."""
+    requires_problem_admin(problem_id)
+    try:
+        started = rejudge.start(
+            problem_id, language=request.form.get('language') or None,
+            verification=request.form.get('verification') or None,
+            user_id=request.form.get('user') or None,
+            dry_run=request.form.get('dry_run') == '1')
+    except rejudge.RejudgeRunning as e:
+        return redirect(url_for(
+            '.rejudge_progress', problem_id=problem_id, rejudge_id=e.args[0]))
+    return redirect(url_for(
+        '.rejudge_progress', problem_id=problem_id, rejudge_id=started.id))
+
+
+def get_rejudge(problem_id, rejudge_id):
+    requires_problem_admin(problem_id)
+    started = rejudge.rejudges.get(rejudge_id)
+    if started is None or started.problem_id != problem_id:
+        abort(404)
+    return started
+
+
+@bp.route('/problem/<int:problem_id>/rejudge/<int:rejudge_id>', methods=['GET'])
+@requires_login
+def rejudge_progress(problem_id, rejudge_id):
+    """Progress, ETA and changed verdicts of a rejudge, see rejudge.py."""
+    return jsonify(get_rejudge(problem_id, rejudge_id).progress())
+
+
+@bp.route('/problem/<int:problem_id>/rejudge/<int:rejudge_id>/cancel', methods=['POST'])
+@requires_login
+def cancel_rejudge(problem_id, rejudge_id):
+    started = get_rejudge(problem_id, rejudge_id)
+    started.cancel()
     return redirect(url_for(
-        'view_solution', problem_id=problem_id, solution_id=solution_id))
+        '.rejudge_progress', problem_id=problem_id, rejudge_id=started.id))
+
+
+
+@bp.route('/judge/stats', methods=['GET'])
+def judge_stats():
+    """Queue depth, busy workers and queue wait times of the verification
+    scheduler, for sizing the worker pool, and cache counters."""
+    stats = {
+        'process': os.getpid(), # Stats are per web worker
+        'scheduler': Solution._verify_scheduler.stats(),
+        'solved_cache': Problem.solved_cache.stats(),
+        'markdown_cache': markdown_cache.stats(),
+        'fragment_cache': fragment_cache.stats(),
+        'verdict_events': Solution.verdict_events.stats(),
+        'verdict_writer': models.verdict_writer.stats(),
+        'remote_workers': remote_worker_stats(),
+    }
+    compile_cache = get_executor().compile_cache
+    if compile_cache is not None:
+        stats['compile_cache'] = compile_cache.stats()
+    executor_stats = get_executor().stats()
+    if executor_stats:
+        stats['executor'] = executor_stats
+    return jsonify(stats)
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Request, SQL and judging metrics in the Prometheus text format."""
+    return Response(metrics.render(), content_type=metrics_content_type)
+
+
+
+#############################
+### Judge API
+#############################
+
+# Used by judge_worker.py processes to lease verification jobs, renew the
+# lease while judging and post the verdict back. Workers send JUDGE_TOKEN
+# as a bearer token and their id in the X-Judge-Worker header.
+
+# worker id -> {'last_seen': time, 'leases': count, 'verdicts': count}
+remote_workers = {}
+
+
+def requires_judge_token(view):
+    """Decorator for judge API views. Sets g.judge_worker to the calling
+    worker's id."""
+    @wraps(view)
+    def decorator(*args, **kwargs):
+        token = current_app.config['JUDGE_TOKEN']
+        if not token:
+            abort(404)
+        authorization = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(authorization.encode(), ('Bearer ' + token).encode()):
+            abort(401)
+        g.judge_worker = request.headers.get('X-Judge-Worker')
+        if not g.judge_worker:
+            abort(400)
+        worker = remote_workers.setdefault(
+            g.judge_worker, {'last_seen': None, 'leases': 0, 'verdicts': 0})
+        worker['last_seen'] = time.time()
+        return view(*args, **kwargs)
+    return decorator
+
+
+def remote_worker_stats():
+    """Workers seen within the last lease period."""
+    since = time.time() - VerificationJob.lease_seconds
+    return {worker_id: dict(worker) for worker_id, worker in remote_workers.items()
+            if worker['last_seen'] >= since}
+
+
+@bp.route('/judge/api/lease', methods=['POST'])
+@requires_judge_token
+def judge_lease():
+    """Leases the next queued job, waiting up to `wait` seconds (capped at
+    JUDGE_MAX_WAIT) for one. Answers 204 if none was queued, and 400 if
+    `wait` isn't a non-negative number. Jobs whose verdict is cached are
+    finished here instead of being handed out. The problem's test data is
+    served separately by `judge_cases`, so workers can keep it between
+    jobs."""
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        abort(400)
+    if not 0 <= wait < float('inf'): # Also rejects NaN
+        abort(400)
+    wait = min(wait, current_app.config['JUDGE_MAX_WAIT'])
+    deadline = time.monotonic() + wait
+    db_session = get_db_session()
+    while True:
+        job = VerificationJob.lease_next(db_session, g.judge_worker)
+        if job is None:
+            if time.monotonic() >= deadline:
+                return '', 204
+            time.sleep(min(0.5, deadline - time.monotonic())) # Green
+            continue
+        db_session.expunge(job) # Stays usable for verdict_writer after commit
+        solution = db_session.query(Solution).filter(
+            Solution.id == job.solution_id).first()
+        if solution is None: # Deleted while queued
+            job.finish(db_session)
+            db_session.commit()
+            continue
+        key = solution.verdict_key()
+        cached = CachedVerdict.lookup(db_session, key)
+        if cached is not None:
+            models.verdict_writer.put(Verdict(
+                job, solution.id, key, True, cached.verification, cached.results(),
+                cached.usage()))
+            continue
+        problem = solution.problem
+        compare_mode, float_epsilon = problem.comparison()
+        remote_workers[g.judge_worker]['leases'] += 1
+        return jsonify({
+            'job_id': job.id,
+            'lease_seconds': VerificationJob.lease_seconds,
+            'cache_key': key,
+            'solution': {
+                'id': solution.id,
+                'language': solution.language,
+                'source': solution.source,
+            },
+            'problem': {
+                'id': problem.id,
+                'fingerprints': problem.case_fingerprints(),
+                'timeout': problem.timeout,
+                'compare_mode': compare_mode,
+                'float_epsilon': float_epsilon,
+            },
+        })
+
+
+@bp.route('/judge/api/problems/<int:problem_id>/cases', methods=['GET'])
+@requires_judge_token
+def judge_cases(problem_id):
+    """Test data of a problem, with the fingerprints identifying it."""
+    problem = get_db_session().query(Problem).filter(Problem.id == problem_id).first()
+    if problem is None:
+        abort(404)
+    return jsonify({
+        'fingerprints': problem.case_fingerprints(),
+        'cases': problem.cases(),
+    })
+
+
+def held_job(job_id):
+    """Returns job_id, detached from the request's session, or answers 409
+    if the calling worker lost its lease."""
+    db_session = get_db_session()
+    job = VerificationJob.held(db_session, job_id, g.judge_worker)
+    if job is None:
+        abort(409)
+    db_session.expunge(job)
+    return job
+
+
+@bp.route('/judge/api/jobs/<int:job_id>/heartbeat', methods=['POST'])
+@requires_judge_token
+def judge_heartbeat(job_id):
+    """Renews the worker's lease. Answers 409 if it was lost, e.g. after
+    the worker stalled for longer than the lease."""
+    if not VerificationJob.renew(get_db_session(), job_id, g.judge_worker):
+        abort(409)
+    return jsonify({'lease_seconds': VerificationJob.lease_seconds})
+
+
+@bp.route('/judge/api/jobs/<int:job_id>/verdict', methods=['POST'])
+@requires_judge_token
+def judge_verdict(job_id):
+    """Takes the verdict of a leased job, as returned by
+    `verify.verify_cases`, along with the `cache_key` it was leased with.
+    The verdict is written by `verdict_writer`."""
+    data = request.get_json(silent=True) or {}
+    verification, results, usage = (
+        data.get('verification'), data.get('results'), data.get('usage'))
+    if not isinstance(verification, str) or not isinstance(results, list) \
+            or not isinstance(usage, list) or len(usage) != len(results) \
+            or not isinstance(data.get('cache_key'), str):
+        abort(400)
+    job = held_job(job_id)
+    models.verdict_writer.put(Verdict(
+        job, job.solution_id, data['cache_key'], False, verification, results, usage))
+    remote_workers[g.judge_worker]['verdicts'] += 1
+    return jsonify({'accepted': True}), 202
+
+
+@bp.route('/judge/api/jobs/<int:job_id>/fail', methods=['POST'])
+@requires_judge_token
+def judge_failure(job_id):
+    """Returns a job the worker could not judge (e.g. its sandbox is
+    broken) to the queue, or fails it after too many attempts."""
+    data = request.get_json(silent=True) or {}
+    db_session = get_db_session()
+    job = VerificationJob.held(db_session, job_id, g.judge_worker)
+    if job is None:
+        abort(409)
+    current_app.logger.warning('Judge worker %s failed job %s: %s',
+                               g.judge_worker, job_id, data.get('error'))
+    job.fail(db_session)
+    db_session.commit()
+    if job.state == 'failed':
+        solution = db_session.query(Solution).filter(
+            Solution.id == job.solution_id).first()
+        if solution is not None:
+            solution.publish_verdict()
+    return jsonify({'state': job.state})
 
 
 
@@ -454,15 +1246,104 @@ def delete_solution_comment(comment_id):
 ### Jinja2 Template Filters
 #############################
 
-@app.template_filter('datetime')
+@bp.app_template_filter('datetime')
 def format_datetime(value):
     return value.strftime('%a %b %d %Y')
 
 
+# Rendered HTML of problem prompts and comments, keyed by a hash of the
+# markdown and the render options
+markdown_cache = LRUCache(int(os.environ.get('MARKDOWN_CACHE_SIZE', 10000)))
+
+
+def markdown_key(text, options):
+    digest = hashlib.sha256(text.encode('utf-8'))
+    digest.update(repr(sorted(options.items())).encode('utf-8'))
+    return digest.hexdigest()
+
+
+@bp.app_template_filter('markdown')
+def render_markdown(text, **options):
+    """Renders markdown with Misaka, reusing the HTML rendered for the
+    same text before."""
+    return markdown_cache.load(
+        markdown_key(text, options), lambda: markdown_renderer.render(text, **options))
+
+
+def forget_markdown(text, no_html=True):
+    """Drops the cached rendering of `text` with the options the templates
+    use, e.g. when the comment it belongs to is deleted."""
+    markdown_cache.pop(markdown_key(text, {'no_html': no_html}))
+
+
+
+def serve_worker(sock, config=None):
+    """Serves requests on the listening socket `sock` in this process
+    until SIGTERM or SIGINT, then removes its pooled sandboxes."""
+    from eventlet import wsgi
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    app = create_app(config)
+    get_executor().start() # Pre-start pooled sandboxes before taking requests
+    try:
+        start_verification() # Resume jobs left over from the last run
+        wsgi.server(sock, app)
+    finally:
+        get_executor().close() # Forked workers exit without atexit handlers
+
+
+def serve(host, port, workers=1):
+    """Runs the eventlet WSGI server on `workers` processes that share one
+    listening socket, so each can use a core. The schema is migrated once,
+    then the workers are forked, restarted if they die and stopped on
+    SIGTERM or SIGINT. Expects eventlet.monkey_patch() to have been called
+    before this module was imported."""
+    import eventlet
+    sock = eventlet.listen((host, port))
+    if workers <= 1:
+        return serve_worker(sock)
+
+    models.init_db().dispose() # Before forking, so no connection is shared
+    children = set()
+    stopping = []
+
+    def fork():
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                eventlet.hubs.use_hub() # Don't share the parent's event hub
+                serve_worker(sock, {'MIGRATE_SCHEMA': False})
+                status = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        children.add(pid)
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        fork()
+    print('Serving on {}:{} with {} workers'.format(host, port, workers), file=sys.stderr)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print('Worker {} exited with status {}, restarting'.format(pid, status),
+                  file=sys.stderr)
+            time.sleep(1)
+            fork()
 
-from eventlet import wsgi
-import eventlet
 
 if __name__ == '__main__':
-    wsgi.server(eventlet.listen(('127.0.0.1', 8091)), app)
-
+    serve(os.environ.get('HOST', '127.0.0.1'), int(os.environ.get('PORT', 8091)),
+          int(os.environ.get('WEB_WORKERS', 1)))
@@ -0,0 +1,62 @@
+"""Checks that the blob store and verification settings come from the
+config given to `riker.create_app`, not from the environment the modules
+were imported in.
+
+    python -m pytest tests
+"""
+
+import io, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+
+import models
+import riker
+import verify
+from models import DBSession, Solution, VerificationJob
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """An empty working directory, with the database not yet set up."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(models, 'engine', None)
+    yield tmp_path
+    DBSession.remove()
+    models.engine.dispose()
+
+
+def test_importing_leaves_the_disk_alone(workdir):
+    riker.create_app({'DATABASE_URL': 'sqlite://', 'TESTING': True})
+    assert os.listdir(workdir) == []
+
+
+def test_blob_dir_from_config(workdir):
+    app = riker.create_app({
+        'DATABASE_URL': 'sqlite://', 'BLOB_DIR': str(workdir / 'data'),
+        'SECRET_KEY': 'test', 'TESTING': True})
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in_user'] = 'alice'
+    response = client.post('/problem', data={
+        'title': 'Echo', 'prompt': 'Echo it', 'timeout': '3',
+        'test-input-file': (io.BytesIO(b'1\n'), '01.in'),
+        'test-output-file': (io.BytesIO(b'1\n'), '01.out')},
+        content_type='multipart/form-data')
+    assert response.status_code == 302
+    assert os.listdir(workdir) == ['data']
+    assert models.blob_store.directory == str(workdir / 'data')
+
+
+def test_settings_from_config(workdir):
+    riker.create_app({
+        'DATABASE_URL': 'sqlite://', 'TESTING': True, 'VERIFY_WORKERS': 3,
+        'VERIFY_QUEUE_SIZE': 7, 'VERDICT_BATCH_INTERVAL': 0, 'VERIFY_LEASE_SECONDS': 60,
+        'VERIFY_CASE_WORKERS': 2, 'VERIFY_LIMITS': 'python=2:512'})
+    assert Solution._verify_scheduler.stats()['workers'] == 3
+    assert Solution._verify_scheduler.max_queue == 7
+    assert models.verdict_writer.interval == 0
+    assert VerificationJob.lease_seconds == 60
+    assert verify.get_settings().case_workers == 2
+    assert verify.get_limits()['python'] == (2.0, 512)
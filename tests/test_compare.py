@@ -0,0 +1,117 @@
+"""Checks the streaming output comparators (see verify/compare.py): output
+split at any point compares like the whole, and judging stops at the first
+mismatch or once a program prints too much.
+
+    python -m pytest tests
+"""
+
+import os, sys, importlib, subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+
+from verify.compare import make_comparator
+from verify.executors import Executor
+
+verify_module = importlib.import_module('verify.verify')
+
+
+def compare(mode, expected, chunks, epsilon=1e-6):
+    comparator = make_comparator(mode, expected, epsilon)
+    return all(comparator.feed(chunk) for chunk in chunks) and comparator.finish()
+
+
+def splits(output):
+    """Yields `output` whole, in single characters and cut at every point."""
+    yield [output]
+    yield list(output)
+    for i in range(len(output) + 1):
+        yield [output[:i], output[i:]]
+
+
+@pytest.mark.parametrize('mode, expected, output, passed', [
+    ('exact', '1 2\n3', '1 2\n3', True),
+    ('exact', '1 2\n3', '1 2\n3\n', True),
+    ('exact', '1 2\n3', '1 2\n3\n\n', False),
+    ('exact', '1 2\n3', '1 2\n3 ', False),
+    ('exact', '1 2\n3', '1  2\n3', False),
+    ('exact', '1 2\n3', '1 2\n', False),
+    ('exact', '', '', True),
+    ('whitespace', '1 2\n3\n', ' 1\t2 3   \n\n', True),
+    ('whitespace', '1 2\n3\n', '1 23', False),
+    ('whitespace', '1 2\n3\n', '1 2 3 4', False),
+    ('whitespace', '1 2\n3\n', '1 2', False),
+    ('whitespace', '12 3', '1 23', False),
+    ('float', '0.5 100\n', '0.5000001 100.00005 \n', True),
+    ('float', '0.5 100\n', '0.50001 100', False),
+    ('float', '0.5 100\n', '0.5 100 1', False),
+    ('float', 'yes 1', 'yes 1.0', True),
+    ('float', 'yes 1', 'no 1', False),
+])
+def test_chunk_boundaries(mode, expected, output, passed):
+    for chunks in splits(output):
+        assert compare(mode, expected, chunks) == passed, chunks
+
+
+def test_float_epsilon():
+    assert compare('float', '1.5', ['1.5'], epsilon=0)
+    assert not compare('float', '1.5', ['1.5000001'], epsilon=0)
+    assert compare('float', '1.5', ['1.6'], epsilon=0.1)
+
+
+def test_mismatch_is_reported_early():
+    comparator = make_comparator('exact', '1\n2\n')
+    assert not comparator.feed('2')
+    comparator = make_comparator('whitespace', '1 2')
+    assert comparator.feed('1 ')
+    assert not comparator.feed('3') # Can't be the start of 2
+    comparator = make_comparator('float', '1')
+    assert comparator.feed('1.000')
+    assert not comparator.feed(' 2') # Past the expected tokens
+
+
+class ChunkExecutor(Executor):
+    """Pretends to run a program that prints `chunks`, stopping when
+    `on_output` asks it to. `printed` counts the chunks it got to."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.printed = 0
+
+    def run(self, language, source, testinput, timeout, cancel=None,
+            on_output=None):
+        for chunk in self.chunks:
+            self.printed += 1
+            if not on_output(chunk):
+                break
+        return subprocess.CompletedProcess(['fake'], 0, '', '')
+
+
+@pytest.fixture
+def run(monkeypatch):
+    """Returns run(chunks, expected, mode, output_limit) -> (status, number
+    of chunks printed before the program was stopped)."""
+    def run(chunks, expected, mode='exact', output_limit=1024):
+        executor = ChunkExecutor(chunks)
+        monkeypatch.setattr(verify_module, '_executor', executor)
+        monkeypatch.setattr(verify_module, '_settings', verify_module.Settings(
+            case_workers=1, output_limit=output_limit))
+        status, usage = verify_module.measure_case(
+            'python', '', '', expected, compare=mode)
+        return status, executor.printed
+    return run
+
+
+def test_killed_on_first_mismatch(run):
+    chunks = ['1\n', '2\n', 'x\n'] + ['4\n'] * 100
+    assert run(chunks, '1\n2\n3\n') == ('FAIL', 3)
+    assert run(chunks, '1 2 3', 'whitespace') == ('FAIL', 3)
+    assert run(chunks, '1 2 3', 'float') == ('FAIL', 3)
+    assert run(['1\n', '2\n', '3\n'], '1\n2\n3\n') == ('PASS', 3)
+
+
+def test_killed_on_output_limit(run):
+    chunks = ['1\n'] * 100
+    assert run(chunks, '1\n' * 100, output_limit=10) == ('OUTPUT_LIMIT', 6)
+    assert run(chunks, '1\n' * 100, output_limit=200) == ('PASS', 100)
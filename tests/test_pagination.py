@@ -0,0 +1,82 @@
+"""Checks that keyset pagination (see pagination.py) pages through every
+row exactly once, in both directions, when many rows share a submission
+time.
+
+    python -m pytest tests
+"""
+
+import os, sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, ProblemComment
+from pagination import paginate, decode_cursor, encode_cursor, last_page, InvalidCursor
+
+
+size = 4
+
+
+@pytest.fixture(scope='module')
+def db_session():
+    """Comments posted at only three distinct times, inserted so that id
+    order differs from time order."""
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    db_session = sessionmaker(bind=engine)()
+    start = datetime(2020, 1, 1, 12, 0, 0, 123456)
+    times = [start + timedelta(microseconds=(i * 7) % 3) for i in range(19)]
+    db_session.add_all(ProblemComment(problem_id=1, user_id='u', body=str(i),
+                                      submission_time=time)
+                       for i, time in enumerate(times))
+    db_session.commit()
+    yield db_session
+    db_session.close()
+    engine.dispose()
+
+
+def page(db_session, after=None, before=None):
+    return paginate(db_session.query(ProblemComment), ProblemComment, 'comments',
+                    size, after=after, before=before)
+
+
+def key(comment):
+    return comment.submission_time, comment.id
+
+
+def test_forward_then_back(db_session):
+    ordered = sorted(db_session.query(ProblemComment), key=key)
+    pages = [page(db_session)]
+    assert pages[0].prev is None
+    while pages[-1].next is not None and len(pages) < 10:
+        pages.append(page(db_session, after=pages[-1].next))
+    assert [comment.id for p in pages for comment in p] == \
+        [comment.id for comment in ordered]
+    assert [len(p) for p in pages] == [4, 4, 4, 4, 3]
+
+    backwards = [page(db_session, before=last_page)]
+    assert backwards[0].next is None
+    while backwards[-1].prev is not None and len(backwards) < 10:
+        backwards.append(page(db_session, before=backwards[-1].prev))
+    assert [comment.id for p in reversed(backwards) for comment in p] == \
+        [comment.id for comment in ordered]
+
+
+def test_next_and_prev_are_inverse(db_session):
+    first = page(db_session)
+    second = page(db_session, after=first.next)
+    assert [c.id for c in page(db_session, before=second.prev)] == [c.id for c in first]
+    third = page(db_session, after=second.next)
+    assert [c.id for c in page(db_session, before=third.prev)] == [c.id for c in second]
+
+
+def test_cursors():
+    time = datetime(2020, 1, 1, 12, 0, 0, 123456)
+    assert decode_cursor(encode_cursor(time, 42)) == (time, 42)
+    for cursor in ('', '1', '1-2-3', 'a-1', '1-b', '9' * 30 + '-1'):
+        with pytest.raises(InvalidCursor):
+            decode_cursor(cursor)
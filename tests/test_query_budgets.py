@@ -0,0 +1,110 @@
+"""Checks that the pages listing solutions and comments stay within the
+query budgets their views declare with `riker.query_budget`, however many
+rows they show.
+
+    python -m pytest tests
+"""
+
+import os, re, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+
+import models
+import riker
+from models import DBSession, Problem, Solution, ProblemComment, SolutionComment
+from query_budget import QueryBudgetExceeded, assert_query_budget
+
+
+# More rows than fit on a page, so pagination and per-row loading both count
+rows = 80
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    database = tmp_path_factory.mktemp('db') / 'riker.db'
+    app = riker.create_app({
+        'DATABASE_URL': 'sqlite:///{}'.format(database), 'SECRET_KEY': 'test',
+        'ENFORCE_QUERY_BUDGETS': True, 'TESTING': True})
+    fill(DBSession())
+    yield app
+    DBSession.remove()
+    models.engine.dispose()
+
+
+def fill(db_session):
+    """alice wrote the problems, bob solved all of them and carol solved
+    the first, and everyone commented on the first problem and bob's
+    solution to it."""
+    problems = [Problem(user_id='alice', title='Problem {}'.format(i), prompt='*Sum* it',
+                        test_input='1\n', test_output='1\n', timeout=3)
+                for i in range(rows)]
+    db_session.add_all(problems)
+    db_session.flush()
+    solutions = [Solution(problem_id=problem.id, user_id='bob', language='python',
+                          source='print(input())', verification='PASS',
+                          case_results='[["PASS", null]]')
+                 for problem in problems]
+    solutions.append(Solution(problem_id=problems[0].id, user_id='carol', language='python',
+                              source='print(1)', verification='PASS'))
+    db_session.add_all(solutions)
+    db_session.flush()
+    for i in range(rows):
+        user_id = 'user{}'.format(i)
+        db_session.add(Solution(problem_id=problems[0].id, user_id=user_id, language='python',
+                                source='print(1)', verification='PASS'))
+        db_session.add(ProblemComment(problem_id=problems[0].id, user_id=user_id,
+                                      body='Comment *{}*'.format(i)))
+        db_session.add(SolutionComment(solution_id=solutions[0].id, user_id=user_id,
+                                       body='Comment *{}*'.format(i)))
+    db_session.commit()
+    db_session.close()
+
+
+def get(app, url, user=None):
+    client = app.test_client()
+    if user is not None:
+        with client.session_transaction() as session:
+            session['logged_in_user'] = user
+    response = client.get(url)
+    assert response.status_code == 200
+    return response
+
+
+def test_view_user(app):
+    get(app, '/user/bob')
+    get(app, '/user/alice', user='bob')
+
+
+def test_view_problem(app):
+    get(app, '/problem/1')
+    get(app, '/problem/1', user='carol')
+    page = get(app, '/problem/1', user='bob').get_data(as_text=True)
+    next_pages = re.findall(r'href="(/problem/1\?[^"]*_(?:after|before)=[^"]*)"', page)
+    assert next_pages
+    for url in next_pages:
+        get(app, url.replace('&amp;', '&'), user='bob')
+
+
+def test_view_solution(app):
+    get(app, '/problem/1/solution/1', user='bob')
+    get(app, '/problem/1/solution/1', user='carol') # Viewable as carol solved it
+
+
+def test_budget_is_enforced(app, monkeypatch):
+    monkeypatch.setattr(riker.view_problem, 'query_budget', 1)
+    with pytest.raises(QueryBudgetExceeded):
+        app.test_client().get('/problem/1')
+
+
+def test_solved_ids(app):
+    db_session = DBSession()
+    Problem.solved_cache.clear()
+    with assert_query_budget(models.engine, 2, 'solved_ids'): # Version, then solutions
+        assert len(Problem.solved_ids(db_session, 'bob')) == rows
+    with assert_query_budget(models.engine, 1, 'cached solved_ids'):
+        assert len(Problem.solved_ids(db_session, 'bob')) == rows
+    with assert_query_budget(models.engine, 0, 'solved_ids with version'):
+        assert len(Problem.solved_ids(db_session, 'bob', version=0)) == rows
+    db_session.close()
@@ -0,0 +1,65 @@
+"""Checks that the verification scheduler shares its queue fairly between
+users (see verify/scheduler.py).
+
+    python -m pytest tests
+"""
+
+import os, sys, threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+
+from verify.scheduler import Scheduler, QueueFull
+
+
+@pytest.fixture
+def blocked():
+    """A scheduler whose single worker is stuck on a first job until the
+    test releases it, so submitted jobs stay queued. Yields (scheduler,
+    release, ran), `ran` being the (user, n) of the jobs run in order."""
+    scheduler = Scheduler(workers=1, max_queue=20, max_per_user=5)
+    release = threading.Event()
+    started = threading.Event()
+    ran = []
+
+    def block():
+        started.set()
+        release.wait()
+
+    scheduler.submit(block, user='setup')
+    assert started.wait(5)
+    yield scheduler, release, ran
+    release.set()
+
+
+def submit(scheduler, ran, done, user, n, priority=False):
+    def job():
+        ran.append((user, n))
+        done.release()
+    scheduler.submit(job, user=user, priority=priority)
+
+
+def test_one_user_cannot_fill_the_queue(blocked):
+    scheduler, release, ran = blocked
+    done = threading.Semaphore(0)
+    for n in range(5):
+        submit(scheduler, ran, done, 'spammer', n)
+    with pytest.raises(QueueFull):
+        submit(scheduler, ran, done, 'spammer', 5)
+    submit(scheduler, ran, done, 'alice', 0) # Others still get in
+    submit(scheduler, ran, done, 'spammer', 6, priority=True) # Not limited
+    assert scheduler.stats()['queue_depth'] == 7
+
+
+def test_round_robin_between_users(blocked):
+    scheduler, release, ran = blocked
+    done = threading.Semaphore(0)
+    for n in range(3):
+        submit(scheduler, ran, done, 'spammer', n)
+    submit(scheduler, ran, done, 'alice', 0)
+    submit(scheduler, ran, done, 'bob', 0, priority=True)
+    release.set()
+    for _ in range(5):
+        assert done.acquire(timeout=5)
+    assert ran == [('bob', 0), ('spammer', 0), ('alice', 0), ('spammer', 1), ('spammer', 2)]
@@ -0,0 +1,126 @@
+"""Checks that the aggregate tables kept up to date by `record_verdict` and
+`record_problem_deleted` match what `rebuild_stats` computes from the
+solutions after every kind of change.
+
+    python -m pytest tests
+"""
+
+import os, sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, Solution, ProblemStats, UserProblemStats, UserStats, \
+    record_verdict, record_problem_deleted, rebuild_stats
+
+
+@pytest.fixture
+def db_session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    db_session = sessionmaker(bind=engine)()
+    yield db_session
+    db_session.close()
+    engine.dispose()
+
+
+def stats(db_session):
+    """All rows of the aggregate tables, as tuples."""
+    return {
+        model.__tablename__: [
+            tuple(getattr(row, column.name) for column in model.__table__.columns)
+            for row in db_session.query(model).order_by(*model.__table__.primary_key)]
+        for model in (ProblemStats, UserProblemStats, UserStats)}
+
+
+def assert_rebuilt_matches(db_session):
+    """Commits the incrementally maintained stats and checks rebuild_stats
+    computes the same, leaving them in place."""
+    db_session.commit()
+    recorded = stats(db_session)
+    rebuild_stats(db_session)
+    rebuilt = stats(db_session)
+    db_session.rollback()
+    assert recorded == rebuilt
+    return recorded
+
+
+minute = timedelta(minutes=1)
+start = datetime(2020, 1, 1)
+
+
+def submit(db_session, user_id, problem_id, minutes):
+    solution = Solution(user_id=user_id, problem_id=problem_id, language='python',
+                        source='', verification='PENDING',
+                        submission_time=start + minutes * minute)
+    db_session.add(solution)
+    db_session.flush()
+    return solution
+
+
+def judge(db_session, solution, verification):
+    previous = solution.verification
+    solution.verification = verification
+    record_verdict(db_session, solution, previous, verification)
+
+
+def delete(db_session, solution):
+    """Deletes `solution` like riker.delete_solution does."""
+    solution = db_session.query(Solution).filter(Solution.id == solution.id).one()
+    db_session.delete(solution)
+    db_session.flush()
+    record_verdict(db_session, solution, solution.verification, None)
+
+
+def test_pass(db_session):
+    solution = submit(db_session, 'alice', 1, 0)
+    assert_rebuilt_matches(db_session)
+    judge(db_session, solution, 'PASS')
+    recorded = assert_rebuilt_matches(db_session)
+    assert recorded['problem_stats'] == [(1, 1, 1, 1)]
+    assert recorded['user_stats'] == [('alice', 1, start, start)]
+
+
+def test_fail_pass_flip(db_session):
+    first = submit(db_session, 'alice', 1, 0)
+    second = submit(db_session, 'alice', 1, 1)
+    other = submit(db_session, 'bob', 2, 2)
+    judge(db_session, first, 'FAIL')
+    judge(db_session, second, 'PASS')
+    judge(db_session, other, 'PASS')
+    assert_rebuilt_matches(db_session)
+    judge(db_session, first, 'PASS') # E.g. rejudged with new test data
+    recorded = assert_rebuilt_matches(db_session)
+    assert recorded['user_problem_stats'][0] == ('alice', 1, 2, 2, start)
+    judge(db_session, first, 'FAIL')
+    judge(db_session, second, 'TIMEOUT')
+    recorded = assert_rebuilt_matches(db_session)
+    assert recorded['problem_stats'][0] == (1, 2, 0, 0)
+    assert recorded['user_stats'] == [('bob', 1, start + 2 * minute, start + 2 * minute)]
+
+
+def test_deletes(db_session):
+    solutions = [submit(db_session, user_id, problem_id, minutes)
+                 for minutes, (user_id, problem_id) in enumerate(
+                     [('alice', 1), ('alice', 1), ('alice', 2), ('bob', 1), ('bob', 2)])]
+    for solution, verification in zip(solutions, ['PASS', 'FAIL', 'PASS', 'PASS', 'ERROR']):
+        judge(db_session, solution, verification)
+    assert_rebuilt_matches(db_session)
+
+    delete(db_session, solutions[0]) # alice's first solve of problem 1
+    assert_rebuilt_matches(db_session)
+    delete(db_session, solutions[1]) # Her last submission to problem 1
+    recorded = assert_rebuilt_matches(db_session)
+    assert [row[:2] for row in recorded['user_problem_stats']] == \
+        [('alice', 2), ('bob', 1), ('bob', 2)]
+
+    for solution in (solutions[2], solutions[4]): # Problem 2 and its solutions
+        db_session.delete(solution)
+    record_problem_deleted(db_session, 2)
+    recorded = assert_rebuilt_matches(db_session)
+    assert recorded['problem_stats'] == [(1, 1, 1, 1)]
+    assert recorded['user_stats'] == [('bob', 1, start + 3 * minute, start + 3 * minute)]
@@ -0,0 +1,66 @@
+"""Checks that uploaded test files are validated as UTF-8 and stored
+without their trailing newline, however they are split into chunks (see
+uploads.py).
+
+    python -m pytest tests
+"""
+
+import io, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+
+from blobstore import BlobStore
+from uploads import TextReader, InvalidUpload, check_text, store_text
+
+
+chunk_sizes = (1, 2, 3, 64 * 1024)
+
+
+def read_all(data, chunk_size):
+    reader = TextReader(io.BytesIO(data), 'test.in')
+    return b''.join(iter(lambda: reader.read(chunk_size), b''))
+
+
+@pytest.mark.parametrize('data, text', [
+    (b'1 2\n3\n', b'1 2\n3'),
+    (b'1 2\n3', b'1 2\n3'),
+    (b'1\n\n', b'1\n'),
+    (b'1\r\n', b'1\r'),
+    (b'\n', b''),
+    (b'', b''),
+    ('été ☃\n'.encode('utf-8'), 'été ☃'.encode('utf-8')),
+])
+def test_trailing_newline(data, text):
+    for chunk_size in chunk_sizes:
+        assert read_all(data, chunk_size) == text, chunk_size
+
+
+@pytest.mark.parametrize('data', [
+    b'\xff\n',
+    b'ok\n\xc3(\n', # Lead byte, then no continuation byte
+    b'ok\n\xe2\x98', # Truncated at the end of the file
+    b'ok\n\xed\xa0\x80\n', # Surrogate
+])
+def test_invalid_utf8(data):
+    for chunk_size in chunk_sizes:
+        with pytest.raises(InvalidUpload):
+            read_all(data, chunk_size)
+
+
+def test_check_text_rewinds():
+    fileobj = io.BytesIO(b'1\n')
+    check_text(fileobj)
+    assert fileobj.read() == b'1\n'
+    with pytest.raises(InvalidUpload, match='bad.in'):
+        check_text(io.BytesIO(b'\xff'), 'bad.in')
+
+
+def test_store_text(tmp_path):
+    blob_store = BlobStore(str(tmp_path))
+    digest = store_text(blob_store, io.BytesIO(b'1\n2\n'))
+    assert blob_store.text(digest) == '1\n2'
+    with pytest.raises(InvalidUpload):
+        store_text(blob_store, io.BytesIO(b'1\n' * 100000 + b'\xff'))
+    assert sorted(os.listdir(tmp_path)) == [digest[:2]] # No partial blob left
@@ -0,0 +1,33 @@
+"""Checks that `models.CachedVerdict.key` changes with everything that can
+change a verdict.
+
+    python -m pytest tests
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from models import CachedVerdict
+from verify import compile_cache
+
+
+def key(language='c', source='int main() {}', timeout=3, compare_mode='exact',
+        float_epsilon=1e-6):
+    return CachedVerdict.key(
+        language, source, ['fingerprint'], timeout, compare_mode, float_epsilon)
+
+
+def test_settings_change_the_key():
+    assert key() == key()
+    assert key() != key(source='int main() { return 1; }')
+    assert key() != key(timeout=4)
+    assert key() != key(compare_mode='whitespace')
+    assert key(float_epsilon=0) != key(float_epsilon=1e-6)
+
+
+def test_compiler_flags_change_the_key(monkeypatch):
+    c_key, python_key = key(), key('python', 'print(1)')
+    monkeypatch.setitem(compile_cache.compile_flags, 'c', '-O2')
+    assert key() != c_key
+    assert key('python', 'print(1)') == python_key
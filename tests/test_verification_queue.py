@@ -0,0 +1,83 @@
+"""Checks that jobs left in the database when the scheduler queue was full
+are dispatched fairly by `models.requeue_verification`.
+
+    python -m pytest tests
+"""
+
+import os, sys, threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+
+import models
+import riker
+from models import DBSession, Solution, VerificationJob, requeue_verification
+from verify.scheduler import Scheduler
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = riker.create_app({
+        'DATABASE_URL': 'sqlite:///{}'.format(tmp_path / 'riker.db'), 'TESTING': True})
+    yield app
+    DBSession.remove()
+    models.engine.dispose()
+
+
+def queue_jobs(jobs):
+    """Adds (user_id, priority) jobs to the database, returns their ids."""
+    db_session = DBSession()
+    rows = [VerificationJob(user_id=user_id, priority=priority) for user_id, priority in jobs]
+    db_session.add_all(rows)
+    db_session.commit()
+    ids = [row.id for row in rows]
+    db_session.close()
+    return ids
+
+
+def run_requeued(monkeypatch, job_count, max_queue):
+    """Runs requeue_verification on a one-worker scheduler holding at most
+    `max_queue` jobs, returns the ids of the jobs judged in order."""
+    scheduler = Scheduler(workers=1, max_queue=max_queue, max_per_user=max_queue)
+    release = threading.Event()
+    started = threading.Event()
+    scheduler.submit(lambda: started.set() or release.wait(), user='setup')
+    assert started.wait(5)
+    ran = []
+    done = threading.Semaphore(0)
+
+    def verify(job_id):
+        ran.append(job_id)
+        done.release()
+    monkeypatch.setattr(Solution, '_verify_scheduler', scheduler)
+    monkeypatch.setattr(Solution, '_dispatched', set())
+    monkeypatch.setattr(Solution, '_verify', verify)
+    requeue_verification()
+    release.set()
+    for _ in range(job_count):
+        assert done.acquire(timeout=5)
+    return ran
+
+
+def test_other_users_go_before_a_backlog(app, monkeypatch):
+    spam = queue_jobs([('spammer', False)] * 20)
+    alice, = queue_jobs([('alice', False)])
+    ran = run_requeued(monkeypatch, 4, max_queue=4)
+    assert alice in ran[:2]
+    assert ran[0] == spam[0]
+
+
+def test_priority_jobs_first(app, monkeypatch):
+    queue_jobs([('spammer', False)] * 5 + [('alice', False)])
+    author, = queue_jobs([('author', True)])
+    ran = run_requeued(monkeypatch, 3, max_queue=3)
+    assert ran[0] == author
+
+
+def test_fair_order():
+    jobs = [VerificationJob(id=i, user_id=user_id, priority=priority)
+            for i, (user_id, priority) in enumerate(
+                [('a', False), ('a', False), ('a', False), ('b', False), ('c', True),
+                 ('b', False)], 1)]
+    assert [job.id for job in models.fair_order(jobs)] == [5, 1, 4, 2, 6, 3]
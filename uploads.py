@@ -0,0 +1,66 @@
+"""Streaming of uploaded test data into the blob store.
+
+Werkzeug spools uploaded files larger than 500 KiB to a temporary file
+while it parses the request, so an upload never has to fit in memory.
+`store_text` then copies one into the blob store chunk by chunk, hashing
+it on the way (see `BlobStore.put_file`), checking that it is UTF-8 text
+and dropping the trailing newline test files end with. Memory use is
+bounded by the chunk size whatever the size of the file. `check_text`
+validates a file without storing it, so a request can check all of its
+files first.
+"""
+
+import time
+import codecs
+
+
+class InvalidUpload(Exception):
+    pass
+
+
+class TextReader(object):
+    """Binary file object over `fileobj` that raises InvalidUpload as soon
+    as the data read is not valid UTF-8, and leaves out a final newline.
+    Each read briefly yields to other green threads, so copying a large
+    file doesn't stall the eventlet hub."""
+
+    def __init__(self, fileobj, name=None):
+        self.fileobj = fileobj
+        self.name = name
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._last = b'' # Held back until we know whether it ends the file
+        self._done = False
+
+    def read(self, size=-1):
+        while not self._done:
+            chunk = self.fileobj.read(size)
+            time.sleep(0) # Cooperative once eventlet has patched time
+            try:
+                self._decoder.decode(chunk, final=not chunk)
+            except UnicodeDecodeError:
+                raise InvalidUpload('{} is not UTF-8 text'.format(self.name or 'File'))
+            if not chunk:
+                self._done = True
+                return b'' if self._last == b'\n' else self._last
+            data = self._last + chunk
+            self._last = data[-1:]
+            if len(data) > 1:
+                return data[:-1]
+        return b''
+
+
+def check_text(fileobj, name=None, chunk_size=64 * 1024):
+    """Raises InvalidUpload unless `fileobj` is UTF-8 text, then rewinds
+    it. Lets a request check all its files before `store_text` stores any,
+    so a bad file doesn't leave the others' blobs behind."""
+    reader = TextReader(fileobj, name)
+    while reader.read(chunk_size):
+        pass
+    fileobj.seek(0)
+
+
+def store_text(blob_store, fileobj, name=None):
+    """Stores the UTF-8 text read from `fileobj` without its trailing
+    newline in `blob_store` and returns its digest. Raises InvalidUpload
+    if the file isn't UTF-8, in which case nothing is stored."""
+    return blob_store.put_file(TextReader(fileobj, name))
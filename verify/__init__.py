@@ -1 +1,6 @@
-from verify.verify import run_program, verify, supported_languages
+from verify.verify import run_program, run_case, measure_case, verify, \
+    verify_cases, supported_languages, get_executor, set_executor, get_settings, \
+    configure
+from verify.executors import Executor, DockerExecutor, SandboxPool, LocalExecutor
+from verify.limits import get_limits, time_limit, memory_limit
+from verify.worker import JudgePool
@@ -0,0 +1,120 @@
+"""Streaming output comparators. A comparator is fed the program's stdout
+chunk by chunk and reports a mismatch as soon as one is certain, so the
+program can be killed without waiting for it to finish.
+
+  * exact: output must equal the expected output, optionally followed by a
+    single trailing newline.
+  * whitespace: output and expected output must contain the same
+    whitespace-separated tokens.
+  * float: like whitespace, but numeric tokens may differ by `epsilon`
+    (absolute, or relative for numbers larger than 1).
+"""
+
+import re
+
+
+compare_modes = ('exact', 'whitespace', 'float')
+
+_token_re = re.compile(r'\S+')
+
+
+class Comparator(object):
+
+    def feed(self, chunk):
+        """Compares the next chunk of output. Returns False as soon as the
+        output can no longer match."""
+        raise NotImplementedError
+
+    def finish(self):
+        """Returns True if the complete output matched."""
+        raise NotImplementedError
+
+
+class ExactComparator(Comparator):
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.pos = 0
+        self.extra = ''
+
+    def feed(self, chunk):
+        if self.extra or self.pos == len(self.expected):
+            self.extra += chunk
+            return self.extra in ('', '\n')
+        head = chunk[:len(self.expected) - self.pos]
+        if not self.expected.startswith(head, self.pos):
+            return False
+        self.pos += len(head)
+        return self.feed(chunk[len(head):]) if len(head) < len(chunk) else True
+
+    def finish(self):
+        return self.pos == len(self.expected) and self.extra in ('', '\n')
+
+
+class WhitespaceComparator(Comparator):
+
+    def __init__(self, expected):
+        self.expected = _token_re.findall(expected)
+        self.index = 0
+        self.partial = '' # Last token, which may continue in the next chunk
+
+    def feed(self, chunk):
+        text = self.partial + chunk
+        tokens = _token_re.findall(text)
+        self.partial = tokens.pop() if tokens and not text[-1].isspace() else ''
+        return self._compare(tokens) and self.partial_matches()
+
+    def finish(self):
+        tokens = [self.partial] if self.partial else []
+        self.partial = ''
+        return self._compare(tokens) and self.index == len(self.expected)
+
+    def _compare(self, tokens):
+        for token in tokens:
+            if self.index >= len(self.expected):
+                return False
+            if not self.match(token, self.expected[self.index]):
+                return False
+            self.index += 1
+        return True
+
+    def match(self, token, expected):
+        return token == expected
+
+    def partial_matches(self):
+        """Returns False if the incomplete last token already can't match."""
+        if not self.partial:
+            return True
+        return (self.index < len(self.expected) and
+                self.expected[self.index].startswith(self.partial))
+
+
+class FloatComparator(WhitespaceComparator):
+
+    def __init__(self, expected, epsilon=1e-6):
+        super().__init__(expected)
+        self.epsilon = epsilon
+
+    def match(self, token, expected):
+        if token == expected:
+            return True
+        try:
+            actual, wanted = float(token), float(expected)
+        except ValueError:
+            return False
+        return abs(actual - wanted) <= self.epsilon * max(1.0, abs(wanted))
+
+    def partial_matches(self):
+        # Numbers may be printed with more digits than expected
+        return not self.partial or self.index < len(self.expected)
+
+
+def make_comparator(mode, expected, epsilon=1e-6):
+    """Returns a comparator for `mode` (one of `compare_modes`)."""
+    if mode == 'exact':
+        return ExactComparator(expected)
+    if mode == 'whitespace':
+        return WhitespaceComparator(expected)
+    if mode == 'float':
+        return FloatComparator(expected, epsilon)
+    raise ValueError('Unknown compare mode: {}'.format(mode))
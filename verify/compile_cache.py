@@ -0,0 +1,150 @@
+"""Content-addressed cache of compiled C/C++ programs.
+
+Binaries are stored on local disk under the sha256 of (language, compiler
+flags, source). On a hit the binary is copied into the workspace and the
+entry script skips compilation. The cache is bounded by total size and
+evicts least recently used binaries first.
+"""
+
+import os, hashlib, shutil, tempfile, threading
+
+
+compiled_languages = ('c', 'c++')
+
+# Passed to the compiler by the entry script; part of the cache key
+compile_flags = {
+    'c': os.environ.get('VERIFY_CFLAGS', ''),
+    'c++': os.environ.get('VERIFY_CXXFLAGS', ''),
+}
+
+binary_name = 'program.out'
+compile_time_name = 'compile_ms' # Written by the entry script after compiling
+
+
+class CompileCache(object):
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0 # Compile time skipped thanks to hits
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(language, source):
+        """Returns the cache key for `source`, or None if `language` is not
+        compiled."""
+        if language not in compiled_languages:
+            return None
+        digest = hashlib.sha256()
+        for part in (language, compile_flags[language], source):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def lookup(self, key):
+        """Returns the path of the cached binary for `key`, or None."""
+        path = os.path.join(self.directory, key)
+        try:
+            os.utime(path) # Most recently used
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += self._compile_seconds(key)
+        return path
+
+    def fetch(self, key, workspace):
+        """Copies the cached binary for `key` into `workspace`. Returns True
+        on a hit."""
+        path = self.lookup(key)
+        if path is None:
+            return False
+        try:
+            shutil.copy(path, os.path.join(workspace, binary_name))
+        except FileNotFoundError: # Evicted in the meantime
+            return False
+        return True
+
+    def store(self, key, workspace):
+        """Adds the binary compiled in `workspace` to the cache."""
+        binary_path = os.path.join(workspace, binary_name)
+        compile_time_path = os.path.join(workspace, compile_time_name)
+        if not os.path.isfile(compile_time_path):
+            return # Compilation failed or was killed before it finished
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        os.close(fd)
+        try:
+            shutil.copy(binary_path, tmp_path)
+            os.replace(tmp_path, os.path.join(self.directory, key))
+        except OSError:
+            os.unlink(tmp_path)
+            return
+        try:
+            with open(compile_time_path) as f:
+                milliseconds = f.read().strip()
+            with open(os.path.join(self.directory, key + '.ms'), 'w') as f:
+                f.write(milliseconds)
+        except OSError:
+            pass
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used binaries until the cache fits in
+        `max_bytes`."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.') or name.endswith('.ms'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for path in (name, name + '.ms'):
+                try:
+                    os.unlink(os.path.join(self.directory, path))
+                except FileNotFoundError:
+                    pass
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'saved_seconds': self.saved_seconds,
+            }
+
+    def _compile_seconds(self, key):
+        try:
+            with open(os.path.join(self.directory, key + '.ms')) as f:
+                return int(f.read()) / 1000
+        except (OSError, ValueError):
+            return 0.0
+
+
+def cache_from_env(environ=os.environ):
+    """Builds the cache from VERIFY_COMPILE_CACHE_DIR and
+    VERIFY_COMPILE_CACHE_BYTES. Returns None if the size is 0."""
+    max_bytes = int(environ.get('VERIFY_COMPILE_CACHE_BYTES', 512 * 1024 * 1024))
+    if not max_bytes:
+        return None
+    directory = environ.get(
+        'VERIFY_COMPILE_CACHE_DIR',
+        os.path.join(tempfile.gettempdir(), 'verify-compile-cache'))
+    return CompileCache(directory, max_bytes)
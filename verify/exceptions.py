@@ -0,0 +1,11 @@
+class UnsupportedLanguage(Exception):
+    pass
+
+class ProgramError(Exception):
+    pass
+
+class ProgramTimeout(Exception):
+    pass
+
+class ProgramCancelled(Exception):
+    pass
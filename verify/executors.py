@@ -0,0 +1,662 @@
+"""Executors are the sandboxes `run_program` hands jobs to. Every executor
+takes a (language, source, testinput, timeout) job, runs it through the
+`entry` script and returns a `subprocess.CompletedProcess`.
+
+  * DockerExecutor starts a fresh container for every job.
+  * SandboxPool keeps a pool of pre-started containers and resets them
+    between jobs, which skips the container startup cost.
+  * LocalExecutor runs the entry script as a plain subprocess on the host.
+    It is NOT isolated and is only meant for tests and benchmarks.
+
+Jobs are delivered to the sandbox in one of three ways (`delivery_modes`):
+
+  * bind: written to a temporary directory that is bind-mounted into the
+    container.
+  * tmpfs: like bind, but the directory lives on /dev/shm so nothing is
+    written to disk.
+  * stdin: packed into an in-memory tar archive that is piped to the
+    container and unpacked into a tmpfs inside it. No host files at all,
+    but compiled binaries can't be added to the compile cache.
+
+The returned CompletedProcess has a `usage` attribute holding the run's
+wall time, CPU time and peak memory (`Usage`), as reported by GNU time in
+the sandbox, or None if it couldn't be measured. LocalExecutor falls back
+to the rusage of the entry script, which includes compilation.
+"""
+
+import io, os, codecs, atexit, shutil, shlex, signal, socket, subprocess, \
+    tarfile, threading, time, queue
+from collections import namedtuple
+from tempfile import TemporaryDirectory, mkdtemp
+
+from verify.exceptions import ProgramTimeout, ProgramCancelled
+from verify.compile_cache import CompileCache, compile_flags, binary_name, \
+    cache_from_env
+from verify.limits import memory_guard
+from verify.stages import timed, record
+
+
+verify_dir = os.path.dirname(os.path.realpath(__file__))
+entry_script_path = os.path.join(verify_dir, 'entry')
+
+
+docker_run_cmd = """docker run --net=none --pids-limit 40
+    -v {0}:/home/unprivileged -w /home/unprivileged -e LANGUAGE={1}
+    -e COMPILE_FLAGS={2} -e MEMORY_GUARD_KB={3} verify /bin/bash entry"""
+
+docker_run_stdin_cmd = """docker run -i --rm --net=none --pids-limit 40
+    --tmpfs /home/unprivileged:exec -w /home/unprivileged -e LANGUAGE={0}
+    -e COMPILE_FLAGS={1} -e MEMORY_GUARD_KB={2}
+    verify /bin/bash -c 'tar -x && exec /bin/bash entry'"""
+
+# Pooled sandboxes serve many jobs, so unlike the per-job containers above
+# they run as `sandbox_uid` on a read-only root filesystem. A job can then
+# only leave files behind in the workspace, /tmp and /dev/shm, which are
+# emptied by `docker_reset_cmd`.
+# Pooled sandboxes are labelled with their owner (see `sandbox_owner`), so
+# ones left behind by a process that died can be removed.
+docker_start_cmd = """docker run -d --net=none --pids-limit 40
+    --read-only --tmpfs /tmp --user {1} --label verify.sandbox.owner={2}
+    -v {0}:/home/unprivileged -w /home/unprivileged
+    verify sleep infinity"""
+
+docker_start_stdin_cmd = """docker run -d --net=none --pids-limit 40
+    --read-only --tmpfs /tmp --user {0} --label verify.sandbox.owner={1}
+    --tmpfs /home/unprivileged:exec -w /home/unprivileged
+    verify sleep infinity"""
+
+docker_list_sandboxes_cmd = """docker ps -a --filter label=verify.sandbox.owner
+    --format '{{.ID}} {{.Label "verify.sandbox.owner"}}'"""
+
+docker_exec_cmd = """docker exec -w /home/unprivileged -e LANGUAGE={1}
+    -e COMPILE_FLAGS={2} -e MEMORY_GUARD_KB={3} {0} /bin/bash entry"""
+
+# Kills everything in the container except pid 1 (`sleep infinity`) and
+# empties every writable directory. Doubles as the health check for
+# pooled sandboxes.
+docker_reset_cmd = """docker exec {0} /bin/sh -c 'kill -9 -1;
+    rm -rf /home/unprivileged/* /home/unprivileged/.[!.]* /tmp/* /tmp/.[!.]* /dev/shm/* /dev/shm/.[!.]*;
+    true'"""
+
+docker_exec_stdin_cmd = """docker exec -i -w /home/unprivileged -e LANGUAGE={1}
+    -e COMPILE_FLAGS={2} -e MEMORY_GUARD_KB={3} {0}
+    /bin/bash -c 'tar -x && exec /bin/bash entry'"""
+
+docker_health_cmd = "docker exec {0} true"
+
+docker_remove_cmd = "docker rm -f {0}"
+
+delivery_modes = ('bind', 'tmpfs', 'stdin')
+
+# User pooled sandboxes run as. Owns their bind-mounted workspaces, so
+# when the server runs as root it defaults to the image's unprivileged user.
+sandbox_uid = int(os.environ.get(
+    'VERIFY_SANDBOX_UID', os.getuid() if os.getuid() != 0 else 1000))
+tmpfs_dir = '/dev/shm'
+
+poll_interval = 0.01 # seconds
+chunk_size = 64 * 1024
+
+# Prefix of the line GNU time appends to stderr, see the entry script
+usage_marker = '__verify_usage__ '
+
+# Prefix of the line the entry script writes to stderr after compiling
+compile_marker = '__verify_compile__ '
+
+# wall and cpu in seconds, memory is peak resident set size in KiB
+Usage = namedtuple('Usage', 'wall cpu memory')
+
+
+def write_workspace(workspace, source, testinput):
+    """Writes the program, its test input and the entry script into
+    `workspace`."""
+    program_path = os.path.join(workspace, 'program')
+    testinput_path = os.path.join(workspace, 'testinput')
+
+    with open(program_path, 'w') as program_fd, open(testinput_path, 'w') as testinput_fd:
+        program_fd.write(source)
+        testinput_fd.write(testinput)
+
+    shutil.copyfile(entry_script_path, os.path.join(workspace, 'entry'))
+
+
+def make_archive(source, testinput, binary_path=None):
+    """Returns an uncompressed tar archive holding the same files
+    `write_workspace` writes, plus the cached binary if given."""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for name, data in (('program', source), ('testinput', testinput)):
+            data = data.encode('utf-8')
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        tar.add(entry_script_path, arcname='entry')
+        if binary_path is not None:
+            tar.add(binary_path, arcname=binary_name)
+    return buf.getvalue()
+
+
+def execute(args, timeout, cancel=None, on_output=None, stdin_data=None, **kwargs):
+    """Runs `args` and returns a CompletedProcess. The process is started in
+    its own session so the whole process group can be killed on timeout, or
+    as soon as the `cancel` event is set.
+
+    If `on_output` is given, stdout is not buffered: every decoded chunk is
+    passed to `on_output` as soon as it is read and the process is killed
+    the first time `on_output` returns False. The returned stdout is empty.
+
+    `stdin_data` (bytes) is written to the process's stdin.
+
+    Output is drained by reader threads while this thread polls the process,
+    rather than using `communicate(timeout=...)`, which does not raise the
+    patched TimeoutExpired under eventlet.monkey_patch(). The process is
+    reaped with wait4 so its resource usage is recorded: the returned
+    CompletedProcess has `wall_time` and `rusage` attributes, and `usage`
+    and `compile_time` parsed from stderr (see `split_usage` and
+    `split_compile_time`), which are also recorded as stage timings."""
+    start = time.monotonic() # Wall time and timeout include spawning
+    proc = subprocess.Popen(
+        args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0,
+        stdin=subprocess.PIPE if stdin_data is not None else None,
+        start_new_session=True, **kwargs)
+    stdout, stderr = [], []
+    stopped = threading.Event()
+    readers = [
+        threading.Thread(
+            target=drain, args=(proc.stdout, on_output or stdout.append, stopped),
+            daemon=True),
+        threading.Thread(
+            target=drain, args=(proc.stderr, stderr.append, stopped), daemon=True),
+    ]
+    if stdin_data is not None:
+        readers.append(threading.Thread(
+            target=feed, args=(proc.stdin, stdin_data), daemon=True))
+    for reader in readers:
+        reader.start()
+
+    deadline = start + timeout
+    error = None
+    rusage = reap(proc)
+    while rusage is None:
+        if cancel is not None and cancel.is_set():
+            error = ProgramCancelled()
+        elif time.monotonic() >= deadline:
+            error = ProgramTimeout()
+        if error is not None or stopped.is_set():
+            kill_process_group(proc)
+            rusage = reap(proc)
+            while rusage is None:
+                time.sleep(poll_interval)
+                rusage = reap(proc)
+            break
+        time.sleep(poll_interval)
+        rusage = reap(proc)
+    wall_time = time.monotonic() - start
+
+    for reader in readers:
+        reader.join()
+    if error is not None:
+        raise error
+    stderr, usage = split_usage(''.join(stderr))
+    stderr, compile_time = split_compile_time(stderr)
+    proc_obj = subprocess.CompletedProcess(
+        args, proc.returncode, ''.join(stdout), stderr)
+    proc_obj.wall_time = wall_time
+    proc_obj.rusage = rusage
+    proc_obj.usage = usage
+    proc_obj.compile_time = compile_time
+    if compile_time is not None:
+        record('compile', compile_time)
+    if usage is not None:
+        record('run', usage.wall)
+        record('startup', max(0.0, wall_time - usage.wall - (compile_time or 0.0)))
+    return proc_obj
+
+
+def reap(proc):
+    """Collects `proc` if it has exited, setting its returncode like
+    Popen.poll() does. Returns its rusage, or None if it is still running.
+    os.wait4 with WNOHANG never blocks, so this is safe under eventlet."""
+    pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+    if pid == 0:
+        return None
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return rusage
+
+
+def split_usage(stderr):
+    """Separates the usage line GNU time appends to the program's stderr.
+    Returns (stderr without it, Usage or None)."""
+    head, marker, tail = stderr.rpartition(usage_marker)
+    if not marker:
+        return stderr, None
+    try:
+        wall, user, system, memory = tail.split()
+        usage = Usage(float(wall), float(user) + float(system), int(memory))
+    except ValueError:
+        return stderr, None
+    # GNU time also reports a non-zero exit status or a fatal signal
+    lines = head.splitlines(True)
+    if lines and lines[-1].startswith('Command '):
+        lines.pop()
+    return ''.join(lines), usage
+
+
+def split_compile_time(stderr):
+    """Separates the line the entry script writes after compiling, which
+    follows any compiler warnings. Returns (stderr without it, compile
+    seconds or None)."""
+    head, marker, tail = stderr.partition(compile_marker)
+    if not marker or (head and not head.endswith('\n')):
+        return stderr, None
+    line, _, rest = tail.partition('\n')
+    try:
+        return head + rest, int(line) / 1000
+    except ValueError:
+        return stderr, None
+
+
+def drain(pipe, consume, stopped):
+    """Reads `pipe` until EOF, passing decoded chunks to `consume`. Sets
+    `stopped` and stops reading when `consume` returns False."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    with pipe:
+        for data in iter(lambda: pipe.read(chunk_size), b''):
+            if consume(decoder.decode(data)) is False:
+                stopped.set()
+                return
+        consume(decoder.decode(b'', final=True))
+
+
+def feed(pipe, data):
+    """Writes `data` to `pipe` and closes it. The pipe is unbuffered, so
+    writes may be partial."""
+    view = memoryview(data)
+    try:
+        with pipe:
+            while view:
+                view = view[pipe.write(view):]
+    except BrokenPipeError:
+        pass # Process exited or was killed
+
+
+def kill_process_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def sandbox_owner():
+    """Label value identifying the process owning a pooled sandbox."""
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def remove_stale_sandboxes():
+    """Removes the pooled sandboxes of processes on this host that exited
+    without closing their pool, e.g. because they were killed."""
+    proc_obj = docker(docker_list_sandboxes_cmd)
+    if proc_obj is None or proc_obj.returncode != 0:
+        return
+    host = socket.gethostname()
+    for line in proc_obj.stdout.splitlines():
+        container_id, _, owner = line.partition(' ')
+        owner_host, _, pid = owner.rpartition(':')
+        if owner_host == host and pid.isdigit() and not process_exists(int(pid)):
+            docker(docker_remove_cmd.format(container_id))
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def docker(cmd, timeout=10):
+    """Runs a docker management command. Returns its CompletedProcess or
+    None if it timed out."""
+    try:
+        return subprocess.run(
+            shlex.split(cmd), timeout=timeout, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True)
+    except subprocess.TimeoutExpired:
+        return None
+
+
+
+class Executor(object):
+    """Interface implemented by every sandbox backend. Backends that run
+    jobs in a host directory share the compile cache handling in `prepare`
+    and `collect`."""
+
+    compile_cache = None
+    delivery = 'bind' # One of delivery_modes
+
+    def start(self):
+        """Acquires any long-lived resources. Called once at server start."""
+        pass
+
+    def close(self):
+        """Releases everything acquired by `start`."""
+        pass
+
+    def stats(self):
+        """Returns utilization counters, if the backend has any."""
+        return {}
+
+    def run(self, language, source, testinput, timeout, cancel=None,
+            on_output=None):
+        """Runs `source` with `testinput` on stdin. Returns a
+        CompletedProcess, raises ProgramTimeout, or ProgramCancelled once the
+        optional `cancel` event is set. See `execute` for `on_output`."""
+        raise NotImplementedError
+
+    def prepare(self, workspace, language, source, testinput):
+        """Writes the job into `workspace`, including the cached binary if
+        there is one. Returns the compile cache key if the program still
+        has to be compiled."""
+        with timed('workspace'):
+            write_workspace(workspace, source, testinput)
+            if self.compile_cache is None:
+                return None
+            key = CompileCache.key(language, source)
+            if key is None or self.compile_cache.fetch(key, workspace):
+                return None
+            return key
+
+    def collect(self, workspace, key):
+        """Caches the binary compiled for `key` in `workspace`."""
+        if key is not None:
+            with timed('cleanup'):
+                self.compile_cache.store(key, workspace)
+
+    def workspace(self):
+        """Returns a TemporaryDirectory for a job, on tmpfs in tmpfs mode."""
+        return TemporaryDirectory(
+            prefix='verify-', dir=tmpfs_dir if self.delivery == 'tmpfs' else None)
+
+    def archive(self, language, source, testinput):
+        """Packs the job for stdin delivery, including the cached binary if
+        there is one."""
+        with timed('workspace'):
+            binary_path = None
+            if self.compile_cache is not None:
+                key = CompileCache.key(language, source)
+                if key is not None:
+                    binary_path = self.compile_cache.lookup(key)
+            return make_archive(source, testinput, binary_path)
+
+
+def quoted_flags(language):
+    return shlex.quote(compile_flags.get(language, ''))
+
+
+class DockerExecutor(Executor):
+    """Cold path: one `docker run` per job."""
+
+    def run(self, language, source, testinput, timeout, cancel=None,
+            on_output=None):
+        if self.delivery == 'stdin':
+            args = shlex.split(docker_run_stdin_cmd.format(
+                language, quoted_flags(language), memory_guard(language)))
+            return execute(args, timeout, cancel, on_output,
+                           self.archive(language, source, testinput))
+
+        with self.workspace() as workspace:
+            key = self.prepare(workspace, language, source, testinput)
+            args = shlex.split(docker_run_cmd.format(
+                workspace, language, quoted_flags(language), memory_guard(language)))
+            try:
+                return execute(args, timeout, cancel, on_output)
+            finally:
+                self.collect(workspace, key)
+
+
+class LocalExecutor(Executor):
+    """Runs the entry script directly on the host. Provides no isolation
+    at all; use it for tests and benchmarks only."""
+
+    def run(self, language, source, testinput, timeout, cancel=None,
+            on_output=None):
+        proc_obj = self._run(language, source, testinput, timeout, cancel, on_output)
+        if proc_obj.usage is None: # No GNU time on this host
+            proc_obj.usage = Usage(
+                proc_obj.wall_time,
+                proc_obj.rusage.ru_utime + proc_obj.rusage.ru_stime,
+                proc_obj.rusage.ru_maxrss)
+        return proc_obj
+
+    def _run(self, language, source, testinput, timeout, cancel, on_output):
+        env = dict(os.environ, LANGUAGE=language,
+                   COMPILE_FLAGS=compile_flags.get(language, ''),
+                   MEMORY_GUARD_KB=str(memory_guard(language)))
+        with self.workspace() as workspace:
+            if self.delivery == 'stdin':
+                return execute(
+                    ['/bin/bash', '-c', 'tar -x && exec /bin/bash entry'],
+                    timeout, cancel, on_output,
+                    self.archive(language, source, testinput),
+                    cwd=workspace, env=env)
+
+            key = self.prepare(workspace, language, source, testinput)
+            try:
+                return execute(
+                    ['/bin/bash', 'entry'], timeout, cancel, on_output,
+                    cwd=workspace, env=env)
+            finally:
+                self.collect(workspace, key)
+
+
+class SandboxError(Exception):
+    pass
+
+
+class Sandbox(object):
+    """A long-lived container with its own bind-mounted workspace, or with
+    a tmpfs workspace inside the container for stdin delivery."""
+
+    def __init__(self, delivery='bind'):
+        self.runs = 0
+        self.last_used = time.monotonic()
+        if delivery == 'stdin':
+            self.workspace = None
+            cmd = docker_start_stdin_cmd.format(sandbox_uid, sandbox_owner())
+        else:
+            self.workspace = mkdtemp(
+                prefix='verify-sandbox-',
+                dir=tmpfs_dir if delivery == 'tmpfs' else None)
+            if os.getuid() != sandbox_uid:
+                os.chown(self.workspace, sandbox_uid, -1)
+            cmd = docker_start_cmd.format(self.workspace, sandbox_uid, sandbox_owner())
+        proc_obj = docker(cmd, timeout=30)
+        if proc_obj is None or proc_obj.returncode != 0:
+            self._remove_workspace()
+            raise SandboxError(proc_obj.stderr if proc_obj else 'docker run timed out')
+        self.container_id = proc_obj.stdout.strip()
+
+    def run(self, language, timeout, cancel=None, on_output=None, archive=None):
+        """Runs the job already written to `workspace`, or the job packed in
+        `archive`."""
+        self.runs += 1
+        self.last_used = time.monotonic()
+        cmd = docker_exec_stdin_cmd if archive is not None else docker_exec_cmd
+        args = shlex.split(cmd.format(
+            self.container_id, language, quoted_flags(language),
+            memory_guard(language)))
+        return execute(args, timeout, cancel, on_output, archive)
+
+    def healthy(self):
+        proc_obj = docker(docker_health_cmd.format(self.container_id))
+        return proc_obj is not None and proc_obj.returncode == 0
+
+    def reset(self):
+        """Kills leftover processes and empties the workspace. Returns False
+        if the container did not respond."""
+        proc_obj = docker(docker_reset_cmd.format(self.container_id))
+        return proc_obj is not None and proc_obj.returncode == 0
+
+    def destroy(self):
+        docker(docker_remove_cmd.format(self.container_id))
+        self._remove_workspace()
+
+    def _remove_workspace(self):
+        if self.workspace is not None:
+            shutil.rmtree(self.workspace, ignore_errors=True)
+
+
+class SandboxPool(Executor):
+    """Pool of `size` pre-started sandboxes. Sandboxes are reset after every
+    job and recycled after `max_runs` jobs or a failed reset. Sandboxes
+    that sat idle for more than `health_interval` seconds are health checked
+    before they are handed out. The pool is closed when the process exits;
+    sandboxes of processes that were killed are removed by the next pool
+    started on the host."""
+
+    def __init__(self, size=4, max_runs=100, health_interval=30,
+                 sandbox_factory=Sandbox):
+        self.size = size
+        self.max_runs = max_runs
+        self.health_interval = health_interval
+        self.sandbox_factory = sandbox_factory
+        self._idle = queue.Queue()
+        self._started = False
+        self._lock = threading.Lock()
+        self._busy = 0
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if self.sandbox_factory is Sandbox:
+            remove_stale_sandboxes()
+        atexit.register(self.close)
+        for _ in range(self.size):
+            self._replace()
+
+    def close(self):
+        """Destroys the idle sandboxes, and busy ones once their job is
+        done."""
+        with self._lock:
+            if not self._started:
+                return
+            self._started = False
+        atexit.unregister(self.close)
+        while True:
+            try:
+                sandbox = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if sandbox is not None:
+                sandbox.destroy()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'busy': self._busy,
+                'utilization': self._busy / self.size if self.size else 0.0,
+            }
+
+    def run(self, language, source, testinput, timeout, cancel=None,
+            on_output=None):
+        self.start()
+        sandbox = self._acquire()
+        if self.delivery == 'stdin':
+            try:
+                return sandbox.run(language, timeout, cancel, on_output,
+                                   self.archive(language, source, testinput))
+            finally:
+                self._release(sandbox)
+
+        key = None
+        try:
+            key = self.prepare(sandbox.workspace, language, source, testinput)
+            return sandbox.run(language, timeout, cancel, on_output)
+        finally:
+            self.collect(sandbox.workspace, key)
+            self._release(sandbox)
+
+    def _acquire(self):
+        with timed('acquire'):
+            sandbox = self._get()
+        with self._lock:
+            self._busy += 1
+        return sandbox
+
+    def _get(self):
+        while True:
+            sandbox = self._idle.get()
+            if sandbox is None:
+                try:
+                    return self.sandbox_factory(self.delivery)
+                except SandboxError:
+                    self._idle.put(None)
+                    raise
+            idle_for = time.monotonic() - sandbox.last_used
+            if idle_for < self.health_interval or sandbox.healthy():
+                return sandbox
+            self._recycle(sandbox)
+
+    def _release(self, sandbox):
+        with self._lock:
+            self._busy -= 1
+        with timed('cleanup'):
+            if not self._started:
+                sandbox.destroy()
+            elif sandbox.runs >= self.max_runs or not sandbox.reset():
+                self._recycle(sandbox)
+            else:
+                self._idle.put(sandbox)
+
+    def _recycle(self, sandbox):
+        """Destroys `sandbox` and starts its replacement in the background."""
+        threading.Thread(target=sandbox.destroy, daemon=True).start()
+        threading.Thread(target=self._replace, daemon=True).start()
+
+    def _replace(self):
+        try:
+            sandbox = self.sandbox_factory(self.delivery)
+        except SandboxError:
+            self._idle.put(None) # Retry lazily on the next acquire
+            return
+        if self._started:
+            self._idle.put(sandbox)
+        else: # Closed meanwhile
+            sandbox.destroy()
+
+
+
+executors = {
+    'docker': DockerExecutor,
+    'pool': SandboxPool,
+    'local': LocalExecutor,
+}
+
+def executor_from_env(environ=os.environ):
+    """Builds the executor selected by VERIFY_EXECUTOR (docker, pool or
+    local). The pool is sized by VERIFY_POOL_SIZE and VERIFY_POOL_MAX_RUNS.
+    Jobs are delivered as selected by VERIFY_DELIVERY (bind, tmpfs or
+    stdin). See `verify.compile_cache.cache_from_env` for the compile
+    cache."""
+    name = environ.get('VERIFY_EXECUTOR', 'docker')
+    if name not in executors:
+        raise ValueError('Unknown VERIFY_EXECUTOR: {}'.format(name))
+    if name == 'pool':
+        executor = SandboxPool(
+            size=int(environ.get('VERIFY_POOL_SIZE', 4)),
+            max_runs=int(environ.get('VERIFY_POOL_MAX_RUNS', 100)))
+    else:
+        executor = executors[name]()
+    executor.delivery = environ.get('VERIFY_DELIVERY', 'bind')
+    if executor.delivery not in delivery_modes:
+        raise ValueError('Unknown VERIFY_DELIVERY: {}'.format(executor.delivery))
+    executor.compile_cache = cache_from_env(environ)
+    return executor
@@ -0,0 +1,74 @@
+"""Per-language time and memory limits.
+
+A problem's timeout is multiplied by the language's time factor, so slow
+interpreters can be given more time than compiled languages. A run that
+uses more CPU time than that, or is still running when it is up, fails
+with TIMEOUT; one whose peak resident memory exceeds the language's memory
+limit fails with MEMORY_LIMIT. The entry script also caps each program's
+address space at `guard_factor` times the memory limit, so a runaway
+program can't exhaust the host before it is measured.
+
+Limits are overridden with VERIFY_LIMITS, a comma separated list of
+`<language>=<time factor>:<memory MiB>`, e.g. `python=2:512,ruby=2:512`.
+"""
+
+import os
+from collections import namedtuple
+
+
+Limits = namedtuple('Limits', 'time_factor memory_mb')
+
+default_limits = {
+    'c': Limits(1.0, 256),
+    'c++': Limits(1.0, 256),
+    'python': Limits(1.0, 256),
+    'ruby': Limits(1.0, 256),
+    'bash': Limits(1.0, 256),
+}
+
+# Interpreters reserve far more address space than they touch
+guard_factor = 4
+
+
+def limits_from_env(environ=os.environ):
+    limits = dict(default_limits)
+    for item in filter(None, environ.get('VERIFY_LIMITS', '').split(',')):
+        try:
+            language, values = item.split('=')
+            time_factor, memory_mb = values.split(':')
+            limits[language.strip()] = Limits(float(time_factor), int(memory_mb))
+        except ValueError:
+            raise ValueError('Malformed VERIFY_LIMITS entry: {}'.format(item))
+    return limits
+
+
+_language_limits = None
+
+def get_limits():
+    """Returns the limits of each language, reading them from the
+    environment on first use."""
+    global _language_limits
+    if _language_limits is None:
+        _language_limits = limits_from_env()
+    return _language_limits
+
+def set_limits(limits):
+    """Replaces the limits of each language, see `limits_from_env`."""
+    global _language_limits
+    _language_limits = limits
+
+
+def time_limit(language, timeout):
+    """Seconds of wall and CPU time a `language` program gets on a problem
+    with the given timeout."""
+    return timeout * get_limits()[language].time_factor
+
+
+def memory_limit(language):
+    """Peak resident memory, in KiB, a `language` program may use."""
+    return get_limits()[language].memory_mb * 1024
+
+
+def memory_guard(language):
+    """Address space cap, in KiB, set by the entry script."""
+    return memory_limit(language) * guard_factor
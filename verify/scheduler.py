@@ -0,0 +1,121 @@
+"""Concurrent scheduler for verification jobs.
+
+Jobs are queued per user and workers take them round-robin across users, so
+a user with many queued submissions only gets one job in before everyone
+else has had a turn. Each user may have at most `max_per_user` jobs
+waiting, so one user can't fill the whole queue and get everyone else's
+submissions rejected; their overflow stays queued in the database. Jobs
+submitted with `priority=True` (problem authors checking their own
+problem) skip the per-user queues and limit entirely.
+"""
+
+import os, time, threading, traceback, collections
+
+
+class QueueFull(Exception):
+    pass
+
+
+Job = collections.namedtuple('Job', ['fn', 'args', 'enqueued'])
+
+
+class Scheduler(object):
+    """Runs jobs on `workers` worker threads with at most `max_queue` jobs
+    waiting, and at most `max_per_user` of them from one user."""
+
+    def __init__(self, workers=2, max_queue=100, max_per_user=10):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self._cond = threading.Condition()
+        self._priority = collections.deque()
+        self._queues = collections.OrderedDict() # user -> deque of jobs
+        self._depth = 0
+        self._running = 0
+        self._waits = collections.deque(maxlen=1000) # recent wait times
+        self._threads = []
+
+    def start(self):
+        """Starts the worker threads. Idempotent."""
+        with self._cond:
+            if self._threads:
+                return
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._worker, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, fn, *args, user=None, priority=False):
+        """Queues `fn(*args)`. Raises QueueFull if `max_queue` jobs, or
+        `max_per_user` of `user`'s non-priority jobs, are already waiting."""
+        self.start()
+        with self._cond:
+            if self._depth >= self.max_queue:
+                raise QueueFull()
+            if not priority and len(self._queues.get(user, ())) >= self.max_per_user:
+                raise QueueFull()
+            job = Job(fn, args, time.monotonic())
+            if priority:
+                self._priority.append(job)
+            else:
+                self._queues.setdefault(user, collections.deque()).append(job)
+            self._depth += 1
+            self._cond.notify()
+
+    def stats(self):
+        """Returns queue depth, busy workers and recent queue wait times (in
+        seconds) for sizing the worker pool."""
+        with self._cond:
+            waits = sorted(self._waits)
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queue_depth': self._depth,
+                'queue_limit': self.max_queue,
+                'queue_limit_per_user': self.max_per_user,
+                'queued_users': len(self._queues),
+                'priority_depth': len(self._priority),
+                'wait_mean': sum(waits) / len(waits) if waits else 0.0,
+                'wait_p95': waits[int(len(waits) * 0.95)] if waits else 0.0,
+                'wait_max': waits[-1] if waits else 0.0,
+            }
+
+    def _next(self):
+        """Pops the next job. Caller must hold `_cond`."""
+        if self._priority:
+            return self._priority.popleft()
+        user, jobs = next(iter(self._queues.items()))
+        job = jobs.popleft()
+        del self._queues[user]
+        if jobs:
+            self._queues[user] = jobs # Back of the line
+        return job
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._depth:
+                    self._cond.wait()
+                job = self._next()
+                self._depth -= 1
+                self._running += 1
+                self._waits.append(time.monotonic() - job.enqueued)
+            try:
+                job.fn(*job.args)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._running -= 1
+
+
+def scheduler_from_env(environ=os.environ):
+    """Builds a scheduler from VERIFY_WORKERS (default: cpu count),
+    VERIFY_QUEUE_SIZE and VERIFY_QUEUE_PER_USER."""
+    if environ.get('VERIFY_WORKER_MODE', 'thread') != 'thread':
+        # Its multiprocess pool deadlocked under eventlet's monkey patching
+        raise ValueError('VERIFY_WORKER_MODE=process is no longer supported')
+    return Scheduler(
+        workers=int(environ.get('VERIFY_WORKERS', os.cpu_count() or 1)),
+        max_queue=int(environ.get('VERIFY_QUEUE_SIZE', 100)),
+        max_per_user=int(environ.get('VERIFY_QUEUE_PER_USER', 10)))
@@ -0,0 +1,49 @@
+"""Timing of the stages of judging a test case.
+
+Every run is split into:
+
+* `workspace`: writing the job into a workspace or packing its archive,
+  including the compile cache lookup.
+* `acquire`: waiting for a pooled sandbox, or starting a replacement.
+* `startup`: time the run took beyond compiling and running the program,
+  i.e. container and interpreter startup.
+* `compile`: compiling C/C++ programs that missed the compile cache.
+* `run`: the program itself, as measured in the sandbox.
+* `compare`: checking the program's output.
+* `cleanup`: caching the compiled binary and resetting the sandbox.
+
+`startup`, `compile` and `run` are only known when the entry script
+reports them, see `verify.executors.split_usage`. Durations are handed to
+the listeners registered with `add_listener` as (stage, seconds).
+"""
+
+import time
+import contextlib
+
+
+stages = ('workspace', 'acquire', 'startup', 'compile', 'run', 'compare', 'cleanup')
+
+_listeners = []
+
+
+def add_listener(listener):
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    _listeners.remove(listener)
+
+
+def record(stage, seconds):
+    for listener in _listeners:
+        listener(stage, seconds)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """Records the duration of the with-block as `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
@@ -1,78 +1,218 @@
 #!/usr/bin/env python3.5
 
-import os, shutil, shlex, subprocess
-from tempfile import TemporaryDirectory
-import multiprocess as mp
+import os, time, queue, threading
+from collections import namedtuple
 
+from verify.exceptions import UnsupportedLanguage, ProgramError, ProgramTimeout, \
+    ProgramCancelled
+from verify.executors import SandboxError, executor_from_env
+from verify.compare import make_comparator
+from verify.limits import time_limit, memory_limit, limits_from_env, set_limits
+from verify.stages import record
 
-supported_languages = ('c', 'c++', 'python', 'ruby', 'bash')
-verify_dir = os.path.dirname(os.path.realpath(__file__))
-entry_script_path = os.path.join(verify_dir, 'entry')
-
-
-class UnsupportedLanguage(Exception):
-    pass
-
-class ProgramError(Exception):
-    pass
-
-class ProgramTimeout(Exception):
-    pass
 
+supported_languages = ('c', 'c++', 'python', 'ruby', 'bash')
 
-docker_run_cmd = """docker run --net=none --pids-limit 40
-    -v {0}:/home/unprivileged -w /home/unprivileged -e LANGUAGE={1} 
-    verify /bin/bash entry"""
-
-def run_program(language, source, testinput, timeout=3):
-    """Launches docker container to run `source` with given `language` and 
-    `testinput`. Returns stdout of program.
+# `case_workers` is the maximum number of test cases of one solution that
+# run at the same time; programs are killed once they print more than
+# `output_limit` characters
+Settings = namedtuple('Settings', 'case_workers output_limit')
+
+# Status strings for a failed case, as shown to the user
+case_messages = {
+    'FAIL': 'FAIL',
+    'ERROR': 'Program terminated due to error',
+    'TIMEOUT': 'Program timed out.',
+    'OUTPUT_LIMIT': 'Output limit exceeded',
+    'MEMORY_LIMIT': 'Memory limit exceeded',
+}
+
+def settings_from_env(environ=os.environ):
+    """Reads VERIFY_CASE_WORKERS and VERIFY_OUTPUT_LIMIT."""
+    return Settings(
+        case_workers=int(environ.get('VERIFY_CASE_WORKERS', 4)),
+        output_limit=int(environ.get('VERIFY_OUTPUT_LIMIT', 16 * 1024 * 1024)))
+
+_settings = None
+
+def get_settings():
+    """Returns the settings used by `verify_cases`, reading them from the
+    environment on first use."""
+    global _settings
+    if _settings is None:
+        _settings = settings_from_env()
+    return _settings
+
+def set_settings(settings):
+    global _settings
+    _settings = settings
+
+def configure(environ=os.environ):
+    """Replaces the settings and language limits with those in `environ`."""
+    set_settings(settings_from_env(environ))
+    set_limits(limits_from_env(environ))
+
+_executor = None
+
+def get_executor():
+    """Returns the executor used by `run_program`, building it from the
+    environment on first use."""
+    global _executor
+    if _executor is None:
+        _executor = executor_from_env()
+    return _executor
+
+def set_executor(executor):
+    """Replaces the executor used by `run_program`. The previous executor is
+    closed."""
+    global _executor
+    if _executor is not None:
+        _executor.close()
+    _executor = executor
+
+
+def run_program(language, source, testinput, timeout=3, cancel=None):
+    """Runs `source` with given `language` and `testinput` in a sandbox
+    provided by the current executor. Returns stdout of program.
     """
     if language not in supported_languages:
         raise UnsupportedLanguage(language)
 
-    # Create program directory to be copied to docker container
-    with TemporaryDirectory() as program_dir:
-
-        program_path = os.path.join(program_dir, 'program')
-        testinput_path = os.path.join(program_dir, 'testinput')
+    proc_obj = get_executor().run(language, source, testinput, timeout, cancel)
 
-        with open(program_path, 'w') as program_fd, open(testinput_path, 'w') as testinput_fd:
-            program_fd.write(source)
-            testinput_fd.write(testinput)
+    if proc_obj.returncode != 0:
+        raise ProgramError(proc_obj.stderr)
 
-        # Copy entry script
-        shutil.copyfile(entry_script_path, os.path.join(program_dir, 'entry'))
+    return proc_obj.stdout[:-1] # Remove trailing newline
 
-        # Build docker-run command
-        args = shlex.split(docker_run_cmd.format(program_dir, language))
 
-        try:
-            proc_obj = subprocess.run(
-                args, timeout=timeout, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE, universal_newlines=True)
-        except subprocess.TimeoutExpired:
-            raise ProgramTimeout()
+def run_case(language, source, testinput, testoutput, timeout=3, cancel=None,
+             compare='exact', epsilon=1e-6):
+    """Like `measure_case`, but returns the status only."""
+    return measure_case(language, source, testinput, testoutput, timeout,
+                        cancel, compare, epsilon)[0]
+
+
+def measure_case(language, source, testinput, testoutput, timeout=3,
+                 cancel=None, compare='exact', epsilon=1e-6):
+    """Runs a single test case, streaming the program's output through a
+    comparator for the given `compare` mode. The program is killed on the
+    first mismatch, once it exceeds the output limit, or once it runs longer
+    than the language's time limit for `timeout` (see `verify.limits`).
+    Returns PASS, FAIL, TIMEOUT, ERROR, OUTPUT_LIMIT, MEMORY_LIMIT or
+    CANCELLED, and a dict with the run's `wall` and `cpu` seconds and peak
+    `memory` in KiB, or None if the run was cut short or not measured."""
+    limit = time_limit(language, timeout)
+    output_limit = get_settings().output_limit
+    comparator = make_comparator(compare, testoutput, epsilon)
+    state = {'length': 0, 'mismatch': False, 'overflow': False, 'compare': 0.0}
+
+    def on_output(chunk):
+        state['length'] += len(chunk)
+        if state['length'] > output_limit:
+            state['overflow'] = True
+        else:
+            start = time.perf_counter()
+            if not comparator.feed(chunk):
+                state['mismatch'] = True
+            state['compare'] += time.perf_counter() - start
+        return not (state['overflow'] or state['mismatch'])
 
+    try:
+        proc_obj = get_executor().run(
+            language, source, testinput, limit, cancel, on_output)
+    except ProgramTimeout as e:
+        return 'TIMEOUT', None
+    except ProgramCancelled as e:
+        return 'CANCELLED', None
+
+    usage = getattr(proc_obj, 'usage', None)
+    if usage is not None:
+        usage = usage._asdict()
+    if state['overflow']:
+        return 'OUTPUT_LIMIT', usage
+    if usage is not None and usage['memory'] > memory_limit(language):
+        return 'MEMORY_LIMIT', usage
+    if usage is not None and usage['cpu'] > limit:
+        return 'TIMEOUT', usage
+    if state['mismatch']:
+        return 'FAIL', usage
     if proc_obj.returncode != 0:
-        raise ProgramError(proc_obj.stderr)
-
-    return proc_obj.stdout[:-1] # Remove trailing newline
+        return 'ERROR', usage
+    start = time.perf_counter()
+    passed = comparator.finish()
+    record('compare', state['compare'] + time.perf_counter() - start)
+    return ('PASS' if passed else 'FAIL'), usage
+
+
+def verify_cases(language, source, cases, timeout=3, compare='exact', epsilon=1e-6):
+    """Runs every (testinput, testoutput) pair in `cases` in parallel and
+    stops as soon as one of them does not pass; cases that were still
+    queued or running are reported as CANCELLED. Output is compared as
+    described in `verify.compare`. Returns a status message, the list of
+    per-case results and the list of per-case usage (see `measure_case`)."""
+    if language not in supported_languages:
+        return 'Unsupported language', [], []
+
+    # Plain threads and queue.Queue rather than concurrent.futures, whose
+    # SimpleQueue is not made cooperative by eventlet.monkey_patch().
+    pending = queue.Queue()
+    done = queue.Queue()
+    for i, case in enumerate(cases):
+        pending.put((i, case))
+    cancel = threading.Event()
+
+    def worker():
+        while not cancel.is_set():
+            try:
+                i, (testinput, testoutput) = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                done.put((i, measure_case(
+                    language, source, testinput, testoutput, timeout, cancel,
+                    compare, epsilon)))
+            except Exception as e:
+                done.put((i, e))
+
+    case_workers = get_settings().case_workers
+    workers = [threading.Thread(target=worker, daemon=True)
+               for _ in range(max(1, min(case_workers, len(cases))))]
+    for thread in workers:
+        thread.start()
+
+    results = ['CANCELLED'] * len(cases)
+    usage = [None] * len(cases)
+    failed = None
+    try:
+        for _ in cases:
+            i, result = done.get()
+            if isinstance(result, Exception): # e.g. SandboxError
+                raise result
+            results[i], usage[i] = result
+            result = results[i]
+            if result != 'PASS':
+                failed = i
+                break
+    finally:
+        cancel.set()
+        for thread in workers:
+            thread.join()
+
+    if failed is None:
+        return 'PASS', results, usage
+    status = case_messages[results[failed]]
+    if len(cases) > 1:
+        status = '{} on test case {}'.format(status.rstrip('.'), failed + 1)
+    return status, results, usage
 
 
 def verify(language, source, testinput, testoutput, timeout=3):
     """Wrapper for `run_program` that compares program output with `testoutput`.
-    Invokes `callback` with an appropriate status message after call to
-    `run_program`."""
+    Returns an appropriate status message after call to `run_program`."""
     try:
-        output = run_program(language, source, testinput, timeout)
-        print(output)
-        status = 'PASS' if output == testoutput else 'FAIL'
-    except UnsupportedLanguage as e:
-        status = 'Unsupported language'
-    except ProgramError as e:
-        status = 'Program terminated due to error'
-    except ProgramTimeout as e:
-        status = 'Program timed out.'
+        status, results, usage = verify_cases(
+            language, source, [(testinput, testoutput)], timeout)
+    except SandboxError as e:
+        status = 'Sandbox unavailable'
     return status
-
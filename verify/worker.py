@@ -0,0 +1,121 @@
+"""Judging in separate worker processes.
+
+`JudgePool` starts `processes` copies of this script and judges the
+solutions of one problem on them. Workers are plain subprocesses talking
+JSON lines over their stdin/stdout rather than a multiprocessing pool,
+whose forked children would resume the parent's green threads under
+eventlet. Each worker reads the problem first:
+
+    {"cases": [[input, output], ...], "timeout": 3, "compare": "exact", "epsilon": 1e-06}
+
+then one `{"language": ..., "source": ...}` line per solution, answering
+each with `{"verdict": [status, results, usage]}` (see `verify_cases`), or
+`{"verdict": null}` if judging raised. With VERIFY_EXECUTOR=pool the
+workers use the docker executor rather than starting pools of their own.
+"""
+
+import os, sys, json, queue, threading, traceback, subprocess
+
+
+class JudgePool(object):
+    """Judges solutions against `cases` on `processes` worker processes."""
+
+    def __init__(self, processes, cases, timeout=3, compare='exact', epsilon=1e-6):
+        self._problem = json.dumps({
+            'cases': cases, 'timeout': timeout, 'compare': compare, 'epsilon': epsilon})
+        self._tasks = queue.Queue()
+        self._results = queue.Queue()
+        self._threads = [threading.Thread(target=self._feed, daemon=True)
+                         for _ in range(processes)]
+        for thread in self._threads:
+            thread.start()
+
+    def judge(self, tasks):
+        """Judges (solution_id, language, source) `tasks` and yields
+        (solution_id, verdict) as they finish, with None as the verdict of
+        a solution whose judging failed."""
+        count = 0
+        for task in tasks:
+            self._tasks.put(task)
+            count += 1
+        for _ in range(count):
+            yield self._results.get()
+
+    def close(self):
+        """Drops queued tasks and stops the workers once they finished
+        their current one."""
+        while True:
+            try:
+                self._tasks.get_nowait()
+            except queue.Empty:
+                break
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _start(self):
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, universal_newlines=True)
+        process.stdin.write(self._problem + '\n')
+        process.stdin.flush()
+        return process
+
+    def _feed(self):
+        """Hands tasks to one worker process, restarting it if it dies."""
+        process = None
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            solution_id, language, source = task
+            try:
+                if process is None:
+                    process = self._start()
+                process.stdin.write(json.dumps({'language': language, 'source': source}) + '\n')
+                process.stdin.flush()
+                verdict = json.loads(process.stdout.readline())['verdict']
+            except (OSError, ValueError): # Worker died, e.g. killed
+                traceback.print_exc()
+                if process is not None:
+                    process.kill()
+                    process.wait()
+                process, verdict = None, None
+            self._results.put((solution_id, verdict))
+        if process is not None:
+            process.stdin.close()
+            process.wait()
+
+
+def main():
+    replies = sys.stdout
+    sys.stdout = sys.stderr # Keep stray prints out of the replies
+    from verify.verify import verify_cases, set_executor
+    from verify.executors import executor_from_env
+
+    # A sandbox pool per worker would keep processes * VERIFY_POOL_SIZE
+    # containers running, so workers start a container per run instead
+    environ = dict(os.environ)
+    if environ.get('VERIFY_EXECUTOR') == 'pool':
+        environ['VERIFY_EXECUTOR'] = 'docker'
+    set_executor(executor_from_env(environ))
+
+    problem = json.loads(sys.stdin.readline())
+    for line in sys.stdin:
+        task = json.loads(line)
+        try:
+            verdict = verify_cases(
+                task['language'], task['source'], problem['cases'], problem['timeout'],
+                problem['compare'], problem['epsilon'])
+        except Exception:
+            traceback.print_exc()
+            verdict = None
+        replies.write(json.dumps({'verdict': verdict}) + '\n')
+        replies.flush()
+
+
+if __name__ == '__main__':
+    # Import the verify package, not verify/verify.py next to this script
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    main()